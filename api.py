@@ -0,0 +1,171 @@
+# api.py
+# API HTTP ligera: valida las solicitudes, encola los trabajos en el JobStore y sirve su
+# estado. No importa moviepy, numpy ni los clientes de Google: el render lo hace el pool
+# de workers (worker.py), así que los workers de gunicorn arrancan rápido y ocupan poco.
+#   gunicorn api:app
+
+import os
+import json
+import uuid
+import logging
+
+from flask import Flask, Response, request, jsonify
+from flask_cors import CORS
+from dotenv import load_dotenv
+
+from jobs_store import JobStore, Planificador, ColaLlena, ESTADOS_ACTIVOS
+from perfiles import obtener_perfil, PERFIL_POR_DEFECTO
+from cache_medios import hash_texto
+
+load_dotenv()
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s'
+)
+
+app = Flask(__name__)
+CORS(app)
+
+# Estado de los trabajos en SQLite: compartido con el pool de workers de render
+JOBS = JobStore(os.getenv("JOBS_DB_PATH", "/tmp/render_jobs.sqlite3"))
+
+# La API solo encola: el límite de renders simultáneos lo aplican los workers
+PLANIFICADOR = Planificador(
+    JOBS,
+    max_cola=int(os.getenv("RENDER_MAX_COLA", "20")),
+    max_cola_lotes=int(os.getenv("RENDER_MAX_COLA_LOTES", "200")),
+)
+
+
+@app.route("/")
+def index():
+    return "Renderizador Inteligente v4.0 con IA Generativa está activo."
+
+class SolicitudInvalida(Exception):
+    """Datos de un video mal formados; la API responde 400 con el mensaje."""
+
+def preparar_trabajo(data):
+    """Valida los datos de un video (de /api/render-video o de un lote) y devuelve el payload del trabajo."""
+    if not data or 'scenes' not in data or 'style' not in data:
+        raise SolicitudInvalida("La solicitud debe incluir 'scenes' y 'style'.")
+
+    # Perfil de codificación: 'draft' | 'standard' | 'archive' ("preview": true equivale a 'draft')
+    nombre_perfil = data.get('profile') or ('draft' if data.get('preview') else PERFIL_POR_DEFECTO)
+    try:
+        perfil = obtener_perfil(nombre_perfil)
+    except KeyError:
+        raise SolicitudInvalida(f"Perfil de codificación desconocido: '{nombre_perfil}'.")
+
+    # Render final de una receta ya aprobada en una previsualización: se reutiliza tal cual
+    receta = None
+    if data.get('recipeFromJob'):
+        trabajo_previo = JOBS.obtener(data['recipeFromJob'])
+        if not trabajo_previo or not trabajo_previo.get('recipe'):
+            raise SolicitudInvalida("El trabajo indicado en 'recipeFromJob' no existe o aún no tiene receta.")
+        receta = trabajo_previo['recipe']
+    return {"scenes": data['scenes'], "style": data['style'], "profile": perfil.nombre, "recipe": receta}
+
+@app.route('/api/render-video', methods=['POST'])
+def render_video_endpoint():
+    """
+    NUEVO ENDPOINT PRINCIPAL: Recibe los medios y el estilo, y la IA crea el video.
+    """
+    try:
+        payload = preparar_trabajo(request.get_json())
+
+        # El trabajo se encola; un worker del pool lo ejecuta cuando haya una plaza libre
+        job_id = PLANIFICADOR.enviar(payload)
+
+        return jsonify({"message": "Trabajo de renderizado inteligente aceptado.", "jobId": job_id}), 202
+    except SolicitudInvalida as e:
+        return jsonify({"error": str(e)}), 400
+    except ColaLlena as e:
+        logging.warning(f"/api/render-video rechazado: {e}")
+        return jsonify({"error": "El servidor está saturado. Inténtalo de nuevo más tarde."}), 429
+    except Exception as e:
+        logging.error("Error al iniciar /api/render-video", exc_info=True)
+        return jsonify({"error": f"Error interno del servidor: {e}"}), 500
+
+def huella(*partes):
+    """Hash estable de datos JSON (para detectar videos y escenas repetidos en un lote)."""
+    return hash_texto(json.dumps(partes, sort_keys=True, ensure_ascii=False, separators=(',', ':')))
+
+@app.route('/api/render-batch', methods=['POST'])
+def render_batch_endpoint():
+    """
+    Lote de videos: {"videos": [{scenes, style, profile?, preview?, recipeFromJob?}, ...]}.
+    Los campos a nivel de lote (p.ej. "style" o "profile") valen para todos los videos que
+    no los indiquen. Los videos idénticos comparten un único trabajo y los que solo cambian
+    de perfil reutilizan la receta del primero en lugar de volver a pedirla a la IA.
+    """
+    try:
+        data = request.get_json() or {}
+        videos = data.get('videos')
+        if not isinstance(videos, list) or not videos:
+            return jsonify({"error": "La solicitud debe incluir una lista 'videos' no vacía."}), 400
+        defectos = {k: v for k, v in data.items() if k != 'videos'}
+
+        trabajos, resumen = [], []
+        por_video, por_receta = {}, {}
+        for indice, video in enumerate(videos):
+            try:
+                payload = preparar_trabajo({**defectos, **(video or {})})
+            except SolicitudInvalida as e:
+                return jsonify({"error": f"Video {indice}: {e}", "index": indice}), 400
+            clave_video = huella(payload)
+            if clave_video in por_video:
+                original = por_video[clave_video]
+                resumen.append({"index": indice, "jobId": resumen[original]['jobId'], "duplicateOf": original})
+                continue
+            job_id = str(uuid.uuid4())
+            clave_escenas = huella(payload['scenes'], payload['style'])
+            if payload['recipe'] is None:
+                if clave_escenas in por_receta:
+                    # Dependencia interna del lote (no la 'recipeFromJob' del cliente, que ya se resolvió
+                    # en preparar_trabajo): el planificador no lo reclama hasta que el origen tenga receta
+                    payload['recipeFromBatchJob'] = por_receta[clave_escenas]
+                else:
+                    por_receta[clave_escenas] = job_id
+            por_video[clave_video] = indice
+            trabajos.append((job_id, payload))
+            resumen.append({"index": indice, "jobId": job_id})
+
+        # Los medios de todo el lote se descargan (una vez cada uno) mientras los trabajos esperan
+        # plaza: lo hace un worker del pool, la API solo encola la precarga junto al lote
+        urls = {u for _, p in trabajos for s in p['scenes'] for u in (s.get('mediaUrl'), s.get('audioUrl')) if u}
+        lote_id = PLANIFICADOR.enviar_lote(trabajos, resumen, urls=urls)
+        logging.info(f"[lote {lote_id}] {len(videos)} videos aceptados: {len(trabajos)} trabajos, {len(urls)} medios distintos.")
+
+        return jsonify({"message": "Lote aceptado.", "batchId": lote_id, "jobs": len(trabajos), "videos": resumen}), 202
+    except ColaLlena as e:
+        logging.warning(f"/api/render-batch rechazado: {e}")
+        return jsonify({"error": "El servidor está saturado. Inténtalo de nuevo más tarde."}), 429
+    except Exception as e:
+        logging.error("Error al iniciar /api/render-batch", exc_info=True)
+        return jsonify({"error": f"Error interno del servidor: {e}"}), 500
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas agregadas (formato de texto de Prometheus) de la API y los workers, leídas del JobStore."""
+    from metricas import exposicion_prometheus
+    return Response(exposicion_prometheus(JOBS, ESTADOS_ACTIVOS), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/job-status/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    job = JOBS.obtener(job_id)
+    if not job:
+        return jsonify({"error": "Trabajo no encontrado."}), 404
+    return jsonify(job)
+
+@app.route('/api/batch-status/<batch_id>', methods=['GET'])
+def get_batch_status(batch_id):
+    lote = JOBS.obtener_lote(batch_id)
+    if not lote:
+        return jsonify({"error": "Lote no encontrado."}), 404
+    return jsonify(lote)
+
+# --- EJECUCIÓN DEL SERVIDOR (los trabajos los ejecuta `python worker.py`) ---
+if __name__ == '__main__':
+    port = int(os.environ.get('PORT', 5001))
+    app.run(host='0.0.0.0', port=port, debug=False)
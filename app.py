@@ -1,16 +1,15 @@
 # app.py (Renderizador Inteligente v4.0 - Impulsado por IA Generativa)
 # -*- coding: utf-8 -*-
+# Cerebro (receta con IA) y brazos (render) de los trabajos. Lo importa cada proceso del
+# pool de workers (worker.py); la API HTTP, que solo encola y sirve estados, está en api.py.
 
 import os
 import uuid
 import json
-import requests
 import logging
 import time
-import threading
-from functools import wraps
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from dotenv import load_dotenv
 
 # --- LIBRERÍAS DE IA Y NUBE ---
@@ -19,8 +18,24 @@ from google.cloud import storage
 
 # --- LIBRERÍA DE EDICIÓN DE VIDEO ---
 from moviepy.editor import *
-import numpy as np
-import math
+
+from segmentos import (escribir_segmento, concatenar_segmentos, renderizar_en_paralelo, planificar_tramos,
+                       linea_de_tiempo, ajustar_a_frames, clave_segmento, clave_tramo, CacheSegmentos)
+import audio_mezcla
+from transitions import componer_transicion, TRANSICIONES
+from cache_medios import cache_medios_del_entorno
+from ffmpeg_backend import renderizar_con_ffmpeg, EfectoNoSoportado
+import vfx
+import texto_raster
+from cache_recetas import clave_receta, crear_cache_recetas, CatalogoSFX
+from jobs_store import JobStore, Planificador
+from salida import DestinoGCS, DestinoLocal, SubidaProgresiva, MOVFLAGS_STREAMING, MOVFLAGS_FASTSTART
+from perfiles import obtener_perfil, canvas_de, PERFIL_POR_DEFECTO
+from ingesta import NormalizadorMedios
+from frames_estaticos import tramos_estaticos, memorizar_estaticos
+from compositor import CompositorPlano, CapaEstatica, CapaDinamica
+from espacio_trabajo import GestorEspacios, SinEspacio
+from metricas import medir_etapa, logger_frames, cronometrar_frames
 
 # --- 1. CONFIGURACIÓN INICIAL Y LOGGING ---
 load_dotenv()
@@ -30,10 +45,50 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s'
 )
 
-app = Flask(__name__)
-CORS(app)
+# Estado de los trabajos en SQLite: compartido con la API (api.py)
+JOBS = JobStore(os.getenv("JOBS_DB_PATH", "/tmp/render_jobs.sqlite3"))
+
+# --- Configuración del renderizado ---
+# 'paralelo': un segmento por escena codificado en un pool de procesos y unido sin recodificar.
+# 'secuencial': composición completa en memoria y una única llamada a write_videofile.
+RENDER_MODO = os.getenv("RENDER_MODO", "paralelo")
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", os.cpu_count() or 1))
+CANVAS_SALIDA = tuple(int(v) for v in os.getenv("RENDER_CANVAS", "1280x720").split("x"))
+# 'moviepy': efectos como callbacks por frame. 'ffmpeg': la receta se compila a un único
+# filter_complex y, si usa algo no soportado, se vuelve automáticamente a moviepy.
+RENDER_ENGINE = os.getenv("RENDER_ENGINE", "moviepy")
+# Componer una sola vez los tramos de escena en los que no cambia ninguna capa
+RENDER_MEMO_ESTATICOS = os.getenv("RENDER_MEMO_ESTATICOS", "1") == "1"
+# 'plano': fondo + capas de texto mezcladas por caja sobre un buffer reutilizado (ver compositor.py).
+# 'moviepy': CompositeVideoClip, como antes.
+RENDER_COMPOSITOR = os.getenv("RENDER_COMPOSITOR", "plano")
+
+# Caché compartida de medios descargados (imágenes, videos y narraciones)
+CACHE_MEDIOS = cache_medios_del_entorno()
+
+# Segmentos ya renderizados por escena: un reenvío solo re-renderiza las escenas que cambian.
+# Subir VERSION_RENDERIZADOR invalida la caché cuando cambia cómo se compone una escena.
+VERSION_RENDERIZADOR = "4.2.1"
+CACHE_SEGMENTOS = CacheSegmentos(
+    os.getenv("SEGMENT_CACHE_DIR", "/tmp/segment_cache"),
+    max_bytes=int(os.getenv("SEGMENT_CACHE_MAX_MB", "4096")) * 1024 * 1024,
+)
+
+# Medios reducidos al lienzo de cada perfil antes de componer (ver ingesta.py)
+NORMALIZADOR_MEDIOS = NormalizadorMedios(
+    os.getenv("INGEST_CACHE_DIR", "/tmp/ingest_cache"),
+    max_bytes=int(os.getenv("INGEST_CACHE_MAX_MB", "2048")) * 1024 * 1024,
+    workers=int(os.getenv("INGEST_WORKERS", "4")),
+)
 
-JOBS = {} # Diccionario en memoria para rastrear el estado de los trabajos
+# Directorios de trabajo con cuota global de disco: los trabajos que no caben esperan (ver espacio_trabajo.py)
+ESPACIOS = GestorEspacios(
+    os.getenv("WORKSPACE_DIR", "/tmp/render_workspace"),
+    cuota_bytes=int(os.getenv("WORKSPACE_QUOTA_MB", "4096")) * 1024 * 1024,
+    espera_max=float(os.getenv("WORKSPACE_WAIT_SECONDS", "1800")),
+)
+# Lo que escribe un trabajo por minuto de video a 1280x720 (segmentos y video final), para su reserva
+WORKSPACE_MB_POR_MINUTO = float(os.getenv("WORKSPACE_MB_PER_MINUTE", "60"))
 
 # --- Configuración de Clientes de Google ---
 try:
@@ -56,22 +111,49 @@ except Exception as e:
     logging.critical("ERROR FATAL AL CONFIGURAR CLIENTES DE GOOGLE.", exc_info=True)
 
 
+# --- Destino del video final ---
+# 'gcs' (por defecto) o 'local' (OUTPUT_LOCAL_DIR) para desarrollo y pruebas sin GCS.
+if os.getenv("OUTPUT_SINK", "gcs") == "local":
+    DESTINO_SALIDA = DestinoLocal(os.getenv("OUTPUT_LOCAL_DIR", "/tmp/render_output"), os.getenv("OUTPUT_LOCAL_URL"))
+else:
+    DESTINO_SALIDA = DestinoGCS(lambda: storage_client.bucket(GCS_BUCKET_NAME))
+# "1": subir mientras se codifica (MP4 fragmentado) en lugar de esperar al archivo completo.
+# Por defecto el MP4 es faststart, que reproducen todos los clientes; el fragmentado no.
+UPLOAD_STREAMING = os.getenv("UPLOAD_STREAMING", "0") == "1"
+UPLOAD_CHUNK_MB = int(os.getenv("UPLOAD_CHUNK_MB", "8"))
+
+
 # ==============================================================================
 # === MÓDULO DE EFECTOS VISUALES (Integrado)                                 ===
 # ==============================================================================
 
 def vfx_aplicar_viñeta(clip, radio=0.7, suavizado=0.4, color=(0, 0, 0)):
+    # Máscaras cacheadas y aplicadas como una multiplicación por frame (ver vfx.aplicar_viñeta)
+    return vfx.aplicar_viñeta(clip, radio, suavizado, color)
+
+def cubrir_lienzo(clip, video_size):
+    """
+    Escala el clip para que cubra el lienzo conservando su proporción y recorta el centro
+    (el mismo encuadre 'cover' que usa la ingesta). Nunca deforma la imagen.
+    """
     w, h = clip.size
-    y, x = np.ogrid[0:h, 0:w]
-    dist_centro = np.sqrt(((x - w / 2) / (w / 2))**2 + ((y - h / 2) / (h / 2))**2)
-    mascara = np.clip((dist_centro - radio) / suavizado, 0, 1)
-    viñeta_overlay = ColorClip(size=(w, h), color=color, duration=clip.duration)
-    viñeta_con_mascara = viñeta_overlay.set_mask(ImageClip(mascara * 255, ismask=True))
-    return CompositeVideoClip([clip, viñeta_con_mascara])
+    escala = max(video_size[0] / w, video_size[1] / h)
+    cubierto = (max(video_size[0], round(w * escala)), max(video_size[1], round(h * escala)))
+    if cubierto != (w, h):
+        clip = clip.resize(newsize=cubierto)
+    if cubierto != tuple(video_size):
+        clip = clip.crop(x1=(cubierto[0] - video_size[0]) // 2, y1=(cubierto[1] - video_size[1]) // 2,
+                         width=video_size[0], height=video_size[1])
+    return clip
 
 def vfx_crear_efecto_ken_burns(clip, duracion, video_size, zoom_dir='in', pan_dir='derecha', factor_zoom=1.15):
-    from moviepy.video.fx.all import crop, resize
-    img_w, img_h = clip.size
+    from moviepy.video.fx.resize import resizer
+    # El recorrido se hace dentro del recorte central de la imagen con la proporción del
+    # lienzo (el encuadre de cubrir_lienzo): la ventana nunca deforma la imagen
+    ancho_total, alto_total = clip.size
+    proporcion = video_size[0] / video_size[1]
+    img_w, img_h = int(min(ancho_total, alto_total * proporcion)), int(min(alto_total, ancho_total / proporcion))
+    origen_x, origen_y = (ancho_total - img_w) // 2, (alto_total - img_h) // 2
     if zoom_dir == 'in':
         w_inicial, h_inicial, w_final, h_final = img_w, img_h, img_w / factor_zoom, img_h / factor_zoom
     else:
@@ -89,46 +171,54 @@ def vfx_crear_efecto_ken_burns(clip, duracion, video_size, zoom_dir='in', pan_di
         alto_actual = interp(h_inicial, h_final, t)
         x_centro_actual = interp(x_centro_inicial, x_centro_final, t)
         y_centro_actual = interp(y_centro_inicial, y_centro_final, t)
-        frame_recortado = crop(get_frame(t), x_center=x_centro_actual, y_center=y_centro_actual, width=ancho_actual, height=alto_actual)
-        return resize(frame_recortado, newsize=video_size)
+        # La ventana de recorte se desplaza (no se encoge) para quedar dentro de la imagen
+        ancho_actual, alto_actual = int(round(ancho_actual)), int(round(alto_actual))
+        x1 = origen_x + min(max(int(round(x_centro_actual - ancho_actual / 2)), 0), img_w - ancho_actual)
+        y1 = origen_y + min(max(int(round(y_centro_actual - alto_actual / 2)), 0), img_h - alto_actual)
+        frame_recortado = get_frame(t)[y1:y1 + alto_actual, x1:x1 + ancho_actual]
+        return resizer(frame_recortado, video_size)
     return clip.set_duration(duracion).fl(transformar_frame)
 
 # ==============================================================================
 # === MÓDULO DE EFECTOS DE TEXTO (Integrado)                                 ===
 # ==============================================================================
 
+# Todos los textos salen de un raster cacheado por (texto, estilo): ver texto_raster.py
+
 def text_fx_crear_texto_con_fondo(texto, padding=20, bg_color=(0,0,0), bg_opacity=0.6, **kwargs):
-    clip_texto = TextClip(txt=texto, **kwargs)
-    size_fondo = (clip_texto.w + padding * 2, clip_texto.h + padding * 2)
-    clip_fondo = ColorClip(size=size_fondo, color=bg_color).set_opacity(bg_opacity)
-    return CompositeVideoClip([clip_fondo.set_position('center'), clip_texto.set_position('center')])
+    return texto_raster.clip_texto(texto, padding=padding, bg_color=bg_color, bg_opacity=bg_opacity, **kwargs)
+
+def text_fx_raster_texto_con_fondo(texto, padding=20, bg_color=(0,0,0), bg_opacity=0.6, **kwargs):
+    return texto_raster.rasterizar_texto(texto, padding=padding, bg_color=bg_color, bg_opacity=bg_opacity, **kwargs)
 
 def text_fx_crear_texto_popup(texto, duracion_anim, **kwargs):
-    from moviepy.video.fx.all import resize
-    def ease_out_back(t_norm):
-        c1 = 1.70158
-        c3 = c1 + 1
-        return 1 + c3 * pow(t_norm - 1, 3) + c1 * pow(t_norm - 1, 2)
-    def resize_func(t):
-        return ease_out_back(t / duracion_anim) if t < duracion_anim else 1
-    clip_texto = TextClip(txt=texto, **kwargs)
-    return clip_texto.fx(resize, resize_func)
+    return texto_raster.texto_popup(texto, duracion_anim, **kwargs)
 
 def text_fx_crear_texto_maquina_escribir(texto, duracion_total, fps=30, **kwargs):
-    clips_letras = []
-    duracion_por_letra = duracion_total / len(texto) if texto else 0
-    for i in range(len(texto)):
-        texto_visible = texto[:i + 1]
-        clip_letra = TextClip(txt=texto_visible, **kwargs)
-        clips_letras.append(clip_letra.set_duration(duracion_por_letra))
-    if not clips_letras: return ColorClip(size=(1,1), color=(0,0,0), duration=duracion_total).set_opacity(0)
-    return concatenate_videoclips(clips_letras).set_fps(fps)
+    return texto_raster.texto_maquina_escribir(texto, duracion_total, **kwargs).set_fps(fps)
 
 
 # ==============================================================================
 # === EL CEREBRO: GENERACIÓN DE RECETA CON IA (GEMINI)                       ===
 # ==============================================================================
 
+# Incrementar al cambiar los prompts o la plantilla: invalida las recetas en caché
+PROMPT_VERSION = "4.1.1"
+
+CACHE_RECETAS = crear_cache_recetas(
+    os.getenv("RECIPE_CACHE_BACKEND", "memoria"),
+    directorio=os.getenv("RECIPE_CACHE_DIR", "/tmp/recipe_cache"),
+)
+CATALOGO_SFX = CatalogoSFX(
+    lambda: storage_client.bucket(GCS_BUCKET_NAME).blob("sound_effects.json"),
+    ttl=int(os.getenv("SFX_CATALOG_TTL", "300")),
+)
+# Recetas por bloques de escenas pedidos en paralelo, cada intento con su timeout
+RECETA_ESCENAS_POR_BLOQUE = int(os.getenv("RECIPE_CHUNK_SCENES", "8"))
+RECETA_WORKERS = int(os.getenv("RECIPE_WORKERS", "4"))
+RECETA_TIMEOUT_BLOQUE = float(os.getenv("RECIPE_CHUNK_TIMEOUT", "90"))
+RECETA_REINTENTOS = int(os.getenv("RECIPE_CHUNK_RETRIES", "2"))
+
 def get_ai_prompts():
     """Almacena los prompts de sistema para los diferentes estilos de edición."""
     prompts = {
@@ -152,29 +242,75 @@ def safe_json_parse(text):
         logging.error(f"Fallo al decodificar JSON. Error: {e}. Texto problemático: {text[:500]}")
         return None
 
-def create_ai_recipe(job_id, scenes_data, style):
+def create_ai_recipe(job_id, scenes_data, style, al_recibir_bloque=None):
+    """
+    Receta de edición de todas las escenas. `al_recibir_bloque(primera_escena, recetas)` se
+    llama (desde este hilo) con las recetas de cada bloque en cuanto llega.
+    """
     logging.info(f"[{job_id}] CEREBRO IA: Iniciando creación de receta. Estilo solicitado: '{style}'.")
 
-    # 1. Leer el catálogo de efectos de sonido desde GCS, como solicitaste.
+    # 1. Leer el catálogo de efectos de sonido (cacheado con TTL y validado por ETag)
     sound_effects_catalog = "No hay efectos de sonido disponibles."
+    catalog_version = None
     try:
-        bucket = storage_client.bucket(GCS_BUCKET_NAME)
-        blob = bucket.blob("sound_effects.json") # Ruta del archivo que tú creas.
-        sound_effects_json_str = blob.download_as_string()
-        sound_effects_catalog = json.loads(sound_effects_json_str)
-        logging.info(f"[{job_id}] CEREBRO IA: Catálogo de SFX cargado desde GCS.")
+        with medir_etapa(JOBS, job_id, 'catalog'):
+            sound_effects_catalog, catalog_version = CATALOGO_SFX.obtener()
+        logging.info(f"[{job_id}] CEREBRO IA: Catálogo de SFX disponible (versión {catalog_version}).")
     except Exception as e:
         logging.warning(f"[{job_id}] CEREBRO IA: No se pudo cargar 'sound_effects.json' desde GCS: {e}. Se continuará sin SFX.")
 
-    # 2. Construir el prompt para Gemini
+    # Reintentos y re-renders con las mismas escenas y estilo reutilizan la receta
+    recipe_key = clave_receta(scenes_data, style, PROMPT_VERSION, catalog_version)
+    cached_recipe = CACHE_RECETAS.obtener(recipe_key)
+    if cached_recipe:
+        logging.info(f"[{job_id}] CEREBRO IA: Receta reutilizada desde caché ({recipe_key[:12]}).")
+        if al_recibir_bloque:
+            al_recibir_bloque(0, cached_recipe['scenes'])
+        return cached_recipe
+
+    # 2. Escenas en bloques pedidos a Gemini en paralelo: un video largo no depende de una
+    # única respuesta enorme y una respuesta malformada solo obliga a repetir su bloque
+    bloques = [scenes_data[k:k + RECETA_ESCENAS_POR_BLOQUE] for k in range(0, len(scenes_data), RECETA_ESCENAS_POR_BLOQUE)]
+    logging.info(f"[{job_id}] CEREBRO IA: {len(scenes_data)} escenas en {len(bloques)} bloques.")
+    recetas_bloques = [None] * len(bloques)
+    completa = True
+    try:
+        with medir_etapa(JOBS, job_id, 'brain'), ThreadPoolExecutor(max_workers=max(1, min(RECETA_WORKERS, len(bloques)))) as pool:
+            futuros = {}
+            for n, bloque in enumerate(bloques):
+                siguiente = bloques[n + 1][0].get('id') if n + 1 < len(bloques) else None
+                futuros[pool.submit(generar_bloque_receta, job_id, n, bloque, style, sound_effects_catalog,
+                                    catalog_version, siguiente)] = n
+            for futuro in as_completed(futuros):
+                n = futuros[futuro]
+                recetas_bloques[n], bloque_completo = futuro.result()
+                completa = completa and bloque_completo
+                if al_recibir_bloque:
+                    al_recibir_bloque(n * RECETA_ESCENAS_POR_BLOQUE, recetas_bloques[n])
+    except Exception as e:
+        logging.error(f"[{job_id}] CEREBRO IA: Fallo catastrófico al generar la receta.", exc_info=True)
+        raise e
+
+    ai_recipe = {"scenes": [receta for bloque in recetas_bloques for receta in bloque]}
+    logging.info(f"[{job_id}] CEREBRO IA: Receta generada exitosamente por Gemini.")
+    if completa:
+        CACHE_RECETAS.guardar(recipe_key, ai_recipe)
+    return ai_recipe
+
+def construir_prompt(style, scenes_data, sound_effects_catalog, siguiente=None):
+    """Prompt de Gemini para un bloque de escenas. `siguiente`: id de la escena que sigue al bloque (None si es el final del video)."""
     system_prompt = get_ai_prompts().get(style, get_ai_prompts()['documental']) # 'documental' por defecto
+    if siguiente is None:
+        continuidad = "- La última escena no debe tener `transition_to_next`."
+    else:
+        continuidad = f"- Estas escenas son solo una parte del video: la última sí debe tener `transition_to_next` hacia la escena '{siguiente}'."
     
-    user_prompt = f"""
+    return f"""
     {system_prompt}
 
     **DATOS DE ENTRADA:**
-    1.  **Datos de Escenas:** {json.dumps(scenes_data, indent=2)}
-    2.  **Catálogo de Efectos de Sonido Disponibles:** {json.dumps(sound_effects_catalog, indent=2)}
+    1.  **Datos de Escenas:** {json.dumps(scenes_data, ensure_ascii=False)}
+    2.  **Catálogo de Efectos de Sonido Disponibles:** {json.dumps(sound_effects_catalog, ensure_ascii=False)}
 
     **TAREA Y FORMATO DE SALIDA (CRÍTICO):**
     Analiza los datos de entrada y devuelve **ÚNICAMENTE un objeto JSON válido** que represente la "receta" de edición completa. La estructura del JSON debe ser la siguiente:
@@ -225,192 +361,677 @@ def create_ai_recipe(job_id, scenes_data, style):
     - Cada escena en la salida debe corresponder a una escena de entrada.
     - Elige efectos visuales, de texto y de sonido que encajen con el estilo solicitado.
     - `start_time` para los SFX debe tener sentido dentro de la duración de la escena.
-    - La última escena no debe tener `transition_to_next`.
+    {continuidad}
+    - Tipos de `visual_effects` disponibles: `ken_burns` (zoom_dir, pan_dir, factor_zoom), `vignette` (radio, suavizado), `color_correction` (brillo, contraste, saturacion, tinte: [[r,g,b], opacidad]), `color_grade` (lo mismo que `color_correction` más `filtro`: "b&n", "sepia" o "invertir"; preferible cuando se combinan varios ajustes de color) y `grain` (intensidad, opacidad).
     """
 
-    try:
-        response = model_text.generate_content(user_prompt)
-        ai_recipe = safe_json_parse(response.text)
-        if not ai_recipe or 'scenes' not in ai_recipe:
-            raise ValueError(f"La respuesta de la IA no es un JSON de receta válido. Respuesta: {response.text}")
-        
-        logging.info(f"[{job_id}] CEREBRO IA: Receta generada exitosamente por Gemini.")
-        return ai_recipe
-    except Exception as e:
-        logging.error(f"[{job_id}] CEREBRO IA: Fallo catastrófico al generar la receta.", exc_info=True)
-        raise e
+def generar_bloque_receta(job_id, n, bloque, style, sound_effects_catalog, catalog_version, siguiente):
+    """
+    (recetas de las escenas de un bloque en su orden, si están todas). Cada intento tiene su
+    timeout y una respuesta malformada o incompleta se reintenta con backoff. Si tras el
+    último intento aún faltan escenas, esas van sin efectos ({}) en lugar de hacer fallar el
+    trabajo. Los bloques completos también se cachean: un video que comparte escenas con
+    otro solo pide las que cambian.
+    """
+    clave = clave_receta({"bloque": bloque, "siguiente": siguiente}, style, PROMPT_VERSION, catalog_version)
+    cacheada = CACHE_RECETAS.obtener(clave)
+    if cacheada:
+        return cacheada, True
+    prompt = construir_prompt(style, bloque, sound_effects_catalog, siguiente)
+    for intento in range(RECETA_REINTENTOS + 1):
+        try:
+            response = model_text.generate_content(prompt, request_options={"timeout": RECETA_TIMEOUT_BLOQUE})
+            receta = safe_json_parse(response.text)
+            if not receta or not isinstance(receta.get('scenes'), list):
+                raise ValueError(f"La respuesta de la IA no es un JSON de receta válido. Respuesta: {response.text[:500]}")
+            recetas, faltan = recetas_de_escenas(receta, bloque)
+            if faltan and intento < RECETA_REINTENTOS:
+                raise ValueError(f"La respuesta de la IA no incluye las escenas {faltan}.")
+            if faltan:
+                logging.warning(f"[{job_id}] CEREBRO IA: Bloque {n + 1} sin receta para las escenas {faltan}; van sin efectos.")
+                return recetas, False
+            CACHE_RECETAS.guardar(clave, recetas)
+            return recetas, True
+        except Exception as e:
+            if intento == RECETA_REINTENTOS:
+                raise
+            logging.warning(f"[{job_id}] CEREBRO IA: Bloque {n + 1} fallido (intento {intento + 1}): {e}. Reintentando...")
+            time.sleep(2 ** intento)
+
+def recetas_de_escenas(ai_recipe, escenas):
+    """
+    (receta de cada escena en su orden, escenas sin receta). Se busca por scene_id o, si la
+    escena no tiene id, por su posición en la receta; a las que no tienen les toca {}. Si
+    la IA repite una escena se queda la primera.
+    """
+    lista = ai_recipe.get('scenes', [])
+    indice = {}
+    for receta in lista:
+        if isinstance(receta, dict) and receta.get('scene_id') is not None:
+            indice.setdefault(receta['scene_id'], receta)
+    recetas, faltan = [], []
+    for k, escena in enumerate(escenas):
+        if escena.get('id') is None:
+            receta = lista[k] if k < len(lista) and isinstance(lista[k], dict) else None
+        else:
+            receta = indice.get(escena['id'])
+        if receta is None:
+            faltan.append(escena.get('id', k))
+        recetas.append(receta or {})
+    return recetas, faltan
 
 
 # ==============================================================================
 # === LOS BRAZOS: EJECUCIÓN PRECISA DEL RENDERIZADO                          ===
 # ==============================================================================
 
-def download_file(url, local_path):
-    """Descarga un archivo desde una URL a una ruta local."""
+@lru_cache(maxsize=1024)
+def duracion_escena(narration_path):
+    """Duración de una escena: la de su narración más 0.5s de margen (las rutas de la caché son por contenido)."""
+    narration_clip = AudioFileClip(narration_path)
     try:
-        with requests.get(url, stream=True) as r:
-            r.raise_for_status()
-            with open(local_path, 'wb') as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
-        return local_path
-    except Exception as e:
-        logging.error(f"Error descargando {url}: {e}", exc_info=True)
-        raise e
+        return narration_clip.duration + 0.5
+    finally:
+        narration_clip.close()
+
+def margen_zoom(recipe_for_scene):
+    """Ampliación máxima que pide la receta de la escena (Ken Burns recorta la imagen hasta 1/factor_zoom)."""
+    factores = [float(e.get('params', {}).get('factor_zoom', 1.15))
+                for e in recipe_for_scene.get('visual_effects', []) if e['type'] == 'ken_burns']
+    return max(factores + [1.0])
+
+def normalizar_medios(job_id, original_scenes, recetas, rutas_medios, canvas, fps):
+    """
+    Copia de `rutas_medios` con imágenes y videos reducidos al lienzo (y videos a `fps`).
+    Un medio usado en varias escenas se normaliza una vez con el mayor margen de zoom.
+    """
+    pedidos = {}
+    for scene_data, receta in zip(original_scenes, recetas):
+        ruta = rutas_medios[scene_data['mediaUrl']]
+        tipo = scene_data.get('mediaType', 'image')
+        margen = max(margen_zoom(receta), pedidos.get(ruta, (tipo, 1.0))[1])
+        pedidos[ruta] = (tipo, margen)
+    normalizadas = NORMALIZADOR_MEDIOS.normalizar_todos(pedidos, canvas, fps)
+    reducidos = sum(1 for ruta, normalizada in normalizadas.items() if ruta != normalizada)
+    logging.info(f"[{job_id}] BRAZOS: Medios normalizados a {canvas[0]}x{canvas[1]} ({reducidos} de {len(normalizadas)} reducidos).")
+    medios = {scene_data['mediaUrl'] for scene_data in original_scenes}
+    return {url: normalizadas[ruta] if url in medios else ruta for url, ruta in rutas_medios.items()}
 
-def process_video_from_recipe(job_id, original_scenes, ai_recipe):
-    tmp_dir = f"/tmp/{job_id}_render"
-    os.makedirs(tmp_dir, exist_ok=True)
+# Efectos que no cambian con el tiempo sobre una imagen fija
+EFECTOS_ESTATICOS = ('vignette', 'color_correction', 'color_grade')
+
+def fondo_estatico(scene_data, recipe_for_scene):
+    """True si el clip base de la escena es el mismo en todos los frames (imagen fija con efectos estáticos)."""
+    return scene_data.get('mediaType', 'image') != 'video' and all(
+        e['type'] in EFECTOS_ESTATICOS for e in recipe_for_scene.get('visual_effects', []))
+
+def intervalos_dinamicos(scene_data, recipe_for_scene, duration):
+    """
+    (intervalos en los que la escena cambia frame a frame, instantes en los que aparece o
+    desaparece un texto), según la receta. Lo demás puede servirse desde la memo de frames.
+    """
+    if not fondo_estatico(scene_data, recipe_for_scene):
+        return [(0.0, duration)], []
+    dinamicos, cortes = [], []
+    for text_info in recipe_for_scene.get('text_overlays', []):
+        inicio, fin = float(text_info['start_time']), float(text_info['start_time']) + float(text_info['duration'])
+        cortes += [inicio, fin]
+        effect = text_info.get('effect', {})
+        if effect.get('type') == 'popup':
+            dinamicos.append((inicio, inicio + float(effect['anim_duration'])))
+        elif effect.get('type') == 'typewriter':
+            dinamicos.append((inicio, fin))
+    return dinamicos, cortes
+
+def componer_escena(job_id, i, scene_data, recipe_for_scene, rutas_medios, video_size=None, fps=24, contador=None):
+    """
+    Devuelve el clip compuesto (video + textos) de una escena a partir de sus medios ya
+    descargados. El audio (narración + SFX) se mezcla aparte para todo el video: ver mezclar_audio.
+    `contador` acumula los frames compuestos y los servidos desde la memo de frames estáticos.
+    """
+    # 1. Crear clip base desde los medios precargados
+    media_path = rutas_medios[scene_data['mediaUrl']]
+    duration = duracion_escena(rutas_medios[scene_data['audioUrl']]) # Duración basada en audio + 0.5s de margen
+
+    # Admite tanto imágenes como videos de entrada
+    if scene_data.get('mediaType', 'image') == 'video':
+        base_clip = VideoFileClip(media_path).set_duration(duration).set_audio(None) # Quitar audio original
+    else:
+        base_clip = ImageClip(media_path, duration=duration)
     
-    try:
-        JOBS[job_id]['status'] = 'processing'
-        scene_clips = []
+    # Sin lienzo explícito se conserva el tamaño original del medio
+    if video_size is None:
+        video_size = base_clip.size
+    elif list(base_clip.size) != list(video_size) and not any(e['type'] == 'ken_burns' for e in recipe_for_scene.get('visual_effects', [])):
+        base_clip = cubrir_lienzo(base_clip, video_size)
+
+    # 2. Aplicar efectos visuales de la receta
+    for effect in recipe_for_scene.get('visual_effects', []):
+        logging.info(f"  -> Aplicando efecto visual: {effect['type']}")
+        if effect['type'] == 'vignette':
+            base_clip = vfx_aplicar_viñeta(base_clip, **effect.get('params', {}))
+        elif effect['type'] == 'ken_burns':
+            base_clip = vfx_crear_efecto_ken_burns(base_clip, duration, video_size, **effect.get('params', {}))
+        elif effect['type'] == 'color_correction':
+            base_clip = vfx.aplicar_correccion_color(base_clip, **effect.get('params', {}))
+        elif effect['type'] == 'color_grade':
+            base_clip = vfx.aplicar_color(base_clip, **effect.get('params', {}))
+        elif effect['type'] == 'grain':
+            base_clip = vfx.aplicar_overlay_textura(base_clip.set_fps(fps), 'grano', **effect.get('params', {}))
+
+    # 3. Aplicar overlays de texto de la receta
+    if RENDER_COMPOSITOR == 'plano':
+        capas = [capa for text_info in recipe_for_scene.get('text_overlays', []) for capa in capas_de_texto(text_info, video_size)]
+        escena = CompositorPlano(base_clip, capas, video_size, fondo_estatico(scene_data, recipe_for_scene)).clip(duration)
+    else:
+        escena = componer_con_moviepy(base_clip, recipe_for_scene, video_size, duration)
+    if not RENDER_MEMO_ESTATICOS:
+        return escena
+    dinamicos, cortes = intervalos_dinamicos(scene_data, recipe_for_scene, duration)
+    return memorizar_estaticos(escena, tramos_estaticos(duration, dinamicos, cortes), {} if contador is None else contador)
+
+def capas_de_texto(text_info, video_size):
+    """Capas del compositor plano para un overlay de texto: una dinámica mientras se anima y una estática el resto."""
+    logging.info(f"  -> Creando texto: '{text_info['text'][:20]}...'")
+    style = text_info.get('style', {})
+    effect = text_info.get('effect', {})
+    background = text_info.get('background') or {}
+    inicio = float(text_info['start_time'])
+    fin = inicio + float(text_info['duration'])
+    posicion = text_info['position']
+
+    if effect.get('type') == 'popup':
+        # Tras la animación el popup queda a escala 1: es el raster tal cual
+        fin_anim = min(inicio + float(effect['anim_duration']), fin)
+        popup = text_fx_crear_texto_popup(text_info['text'], duracion_anim=effect['anim_duration'], **style, **background)
+        raster = texto_raster.rasterizar_texto(text_info['text'], **style, **background)
+        return [CapaDinamica(popup, posicion, inicio, fin_anim, video_size),
+                CapaEstatica(raster.rgba, posicion, fin_anim, fin, video_size)]
+    if effect.get('type') == 'typewriter':
+        maquina = text_fx_crear_texto_maquina_escribir(text_info['text'], duracion_total=text_info['duration'], **style, **background)
+        return [CapaDinamica(maquina, posicion, inicio, fin, video_size)]
+    if background:
+        raster = text_fx_raster_texto_con_fondo(text_info['text'], **style, **background)
+    else:
+        raster = texto_raster.rasterizar_texto(text_info['text'], **style)
+    return [CapaEstatica(raster.rgba, posicion, inicio, fin, video_size)]
+
+def componer_con_moviepy(base_clip, recipe_for_scene, video_size, duration):
+    """Escena compuesta con CompositeVideoClip (RENDER_COMPOSITOR=moviepy)."""
+    text_clips_to_add = []
+    for text_info in recipe_for_scene.get('text_overlays', []):
+        logging.info(f"  -> Creando texto: '{text_info['text'][:20]}...'")
+        style = text_info.get('style', {})
+        effect = text_info.get('effect', {})
+        background = text_info.get('background') or {}
         
-        recipe_scenes = ai_recipe['scenes']
+        # El fondo (si se especifica) se dibuja en el mismo raster que el texto,
+        # también para las animaciones de aparición
+        if effect.get('type') == 'popup':
+            text_clip = text_fx_crear_texto_popup(text_info['text'], duracion_anim=effect['anim_duration'], **style, **background)
+        elif effect.get('type') == 'typewriter':
+            text_clip = text_fx_crear_texto_maquina_escribir(text_info['text'], duracion_total=text_info['duration'], **style, **background)
+        elif background:
+            text_clip = text_fx_crear_texto_con_fondo(text_info['text'], **style, **background)
+        else: # Crear texto simple
+            text_clip = texto_raster.clip_texto(text_info['text'], **style)
         
+        text_clip = text_clip.set_start(text_info['start_time']).set_duration(text_info['duration']).set_position(text_info['position'])
+        text_clips_to_add.append(text_clip)
+
+    return CompositeVideoClip([base_clip] + text_clips_to_add, size=video_size).set_duration(duration)
+
+def registrar_memo(job_id, contador):
+    """Suma al trabajo los frames compuestos y los servidos desde la memo de frames estáticos."""
+    for nombre in ('frames_compuestos', 'frames_memo'):
+        JOBS.sumar_contador(job_id, nombre, contador.get(nombre, 0))
+
+def planificar_transiciones(job_id, original_scenes, recetas, rutas_medios, fps):
+    """
+    Tramos (cuerpos de escena y ventanas de transición) del trabajo y la línea de tiempo
+    de cada escena (inicio, duración y solapes) que usa la mezcla de audio.
+    """
+    transiciones = []
+    for i, receta in enumerate(recetas):
+        transicion = receta.get('transition_to_next') if i < len(recetas) - 1 else None
+        if transicion and transicion.get('type') not in TRANSICIONES:
+            logging.warning(f"[{job_id}] BRAZOS: Transición '{transicion.get('type')}' no soportada. Se usa un corte.")
+            transicion = None
+        transiciones.append(transicion)
+    duraciones = [duracion_escena(rutas_medios[s['audioUrl']]) for s in original_scenes]
+    return planificar_tramos(duraciones, transiciones, fps), linea_de_tiempo(duraciones, transiciones, fps)
+
+def urls_sfx(job_id, recetas):
+    """{sfx_id: url} de los SFX que usan las recetas, según el catálogo (vacío si no está disponible)."""
+    ids = {sfx['sfx_id'] for receta in recetas for sfx in receta.get('sound_effects', [])}
+    if not ids:
+        return {}
+    try:
+        catalogo, _ = CATALOGO_SFX.obtener()
+    except Exception as e:
+        logging.warning(f"[{job_id}] BRAZOS: Catálogo de SFX no disponible ({e}). Se omiten los SFX.")
+        return {}
+    urls = {}
+    for sfx_id in ids:
+        url = audio_mezcla.url_sfx(catalogo, sfx_id)
+        if url:
+            urls[sfx_id] = url
+        else:
+            logging.warning(f"[{job_id}] BRAZOS: SFX '{sfx_id}' no está en el catálogo. Se omite.")
+    return urls
+
+def mezclar_audio(job_id, original_scenes, recetas, rutas_medios, sfx_urls, linea, ruta_wav):
+    """
+    Mezcla narraciones y SFX de todo el video en un solo buffer y lo escribe como WAV.
+    Cada escena se funde con la siguiente durante su transición (como el acrossfade de ffmpeg).
+    """
+    pistas = []
+    for i, scene_data in enumerate(original_scenes):
+        pistas_escena = [(audio_mezcla.decodificar_pcm(rutas_medios[scene_data['audioUrl']]), 0.0, 1.0)]
+        for sfx in recetas[i].get('sound_effects', []):
+            if sfx['sfx_id'] in sfx_urls:
+                logging.info(f"  -> Añadiendo SFX: {sfx['sfx_id']}")
+                pcm = audio_mezcla.pcm_cacheado(rutas_medios[sfx_urls[sfx['sfx_id']]])
+                pistas_escena.append((pcm, float(sfx.get('start_time', 0)), float(sfx.get('volume', 1.0))))
+        escena = linea[i]
+        pistas.append((audio_mezcla.mezclar(pistas_escena, escena['duracion'], entrada=escena['entrada'],
+                                            salida=escena['salida']), escena['inicio'], 1.0))
+    duracion_total = linea[-1]['inicio'] + linea[-1]['duracion']
+    logging.info(f"[{job_id}] BRAZOS: Audio mezclado ({duracion_total:.2f}s, {len(sfx_urls)} SFX distintos).")
+    return audio_mezcla.escribir_wav(audio_mezcla.mezclar(pistas, duracion_total), ruta_wav)
+
+def clip_de_tramo(tramo, clips):
+    """Clip de un tramo: el cuerpo de una escena tal cual o la composición de una ventana de transición."""
+    if tramo['tipo'] == 'escena':
+        return clips[tramo['escena']].subclip(tramo['inicio'], tramo['fin'])
+    saliente, entrante = tramo['escenas']
+    return componer_transicion(clips[saliente], clips[entrante], tramo['transicion'], tramo['duracion'])
+
+def hilos_por_segmento(perfil):
+    """
+    Hilos de x264 de cada segmento: los del perfil o, en automático (threads=0), los núcleos
+    repartidos entre los RENDER_WORKERS procesos que codifican a la vez.
+    """
+    return perfil.threads or max(1, (os.cpu_count() or 1) // max(1, RENDER_WORKERS))
+
+def renderizar_tramo_a_segmento(tarea):
+    """Compone las escenas de un tramo y lo codifica a su propio segmento. Se ejecuta dentro del pool de procesos."""
+    job_id, n, tramo, escenas, rutas_medios, tmp_dir, video_size, perfil = tarea
+    logging.info(f"[{job_id}] BRAZOS: Renderizando segmento {n+1} ({tramo['tipo']})...")
+    inicio = time.perf_counter()
+    contador = {}
+    clips = {i: componer_escena(job_id, i, scene_data, receta, rutas_medios, video_size, perfil.fps, contador)
+             for i, (scene_data, receta) in escenas.items()}
+    try:
+        clip, tiempo_frames = cronometrar_frames(clip_de_tramo(tramo, clips))
+        construccion = time.perf_counter() - inicio
+        ruta = escribir_segmento(clip, os.path.join(tmp_dir, f"segmento_{n:04d}.mp4"), perfil,
+                                 threads=hilos_por_segmento(perfil), logger=logger_frames(JOBS, job_id, f"segmento_{n:04d}"))
+        # Las ventanas de transición cuentan para el trabajo pero no para una escena concreta
+        escena = tramo['escena'] if tramo['tipo'] == 'escena' else None
+        JOBS.registrar_etapa(job_id, 'compose', construccion + tiempo_frames['segundos'], escena)
+        JOBS.registrar_etapa(job_id, 'encode', time.perf_counter() - inicio - construccion - tiempo_frames['segundos'], escena)
+        registrar_memo(job_id, contador)
+        return ruta
+    finally:
+        for clip in clips.values():
+            clip.close()
+
+def escenas_de_tramo(tramo):
+    return [tramo['escena']] if tramo['tipo'] == 'escena' else tramo['escenas']
+
+def duracion_tramo(tramo):
+    return tramo['fin'] - tramo['inicio'] if tramo['tipo'] == 'escena' else tramo['duracion']
+
+def estimar_espacio(duracion, canvas):
+    """Bytes a reservar para renderizar `duracion` segundos: WAV de la mezcla, segmentos en curso y video final."""
+    wav = duracion * audio_mezcla.FRECUENCIA_SALIDA * audio_mezcla.CANALES * 2
+    video = duracion / 60 * WORKSPACE_MB_POR_MINUTO * 1024 * 1024 * (canvas[0] * canvas[1]) / (1280 * 720)
+    return int(wav + 1.5 * video) + 16 * 1024 * 1024
+
+def reservar_espacio(job_id, duracion, canvas):
+    """Espacio de trabajo del trabajo. Mientras su reserva no quepa en la cuota de disco, queda en 'waiting_disk'."""
+    n_bytes = estimar_espacio(duracion, canvas)
+    esperando = []
+    def al_esperar():
+        if not esperando:
+            logging.info(f"[{job_id}] BRAZOS: Esperando {n_bytes / 1e6:.0f} MB de disco de trabajo...")
+        esperando.append(1)
+        JOBS.actualizar(job_id, status='waiting_disk')
+    with medir_etapa(JOBS, job_id, 'disk_wait'):
+        espacio = ESPACIOS.reservar(job_id, n_bytes, al_esperar=al_esperar)
+    JOBS.actualizar(job_id, status='processing', workspace={"reservedBytes": n_bytes})
+    return espacio
+
+def claves_de_tramos(original_scenes, recetas, tramos, perfil, canvas):
+    """Clave en la caché de segmentos de cada tramo (contenido de sus medios, recetas, perfil y lienzo)."""
+    claves_escena = {}
+    for tramo in tramos:
+        for i in escenas_de_tramo(tramo):
+            if i not in claves_escena:
+                scene_data = original_scenes[i]
+                hashes = [CACHE_MEDIOS.hash_de(scene_data['mediaUrl']), CACHE_MEDIOS.hash_de(scene_data['audioUrl'])]
+                claves_escena[i] = clave_segmento(hashes, scene_data.get('mediaType', 'image'), recetas[i],
+                                                  perfil, canvas, VERSION_RENDERIZADOR)
+    return [clave_tramo(tramo, [claves_escena[i] for i in escenas_de_tramo(tramo)]) for tramo in tramos]
+
+def renderizar_tramos(job_id, pendientes, tramos, claves, original_scenes, recetas, rutas_medios, tmp_dir, canvas, perfil,
+                      al_completar=None, al_terminar=None, metodo="fork"):
+    """
+    Renderiza en el pool los tramos `pendientes` (índices de `tramos`), guarda sus segmentos
+    en la caché y devuelve sus rutas. Cada segmento pasa a la caché en cuanto se codifica
+    (no se acumulan en `tmp_dir`) y entonces se llama a `al_terminar(n, ruta)`. `metodo`:
+    ver renderizar_en_paralelo.
+    """
+    tareas = []
+    for n in pendientes:
+        escenas = {i: (original_scenes[i], recetas[i]) for i in escenas_de_tramo(tramos[n])}
+        tareas.append((job_id, n, tramos[n], escenas, rutas_medios, tmp_dir, canvas, perfil))
+    def terminado(k, ruta):
+        n = pendientes[k]
+        ruta = CACHE_SEGMENTOS.guardar(claves[n], ruta)
+        if al_terminar:
+            al_terminar(n, ruta)
+        return ruta
+    return renderizar_en_paralelo(renderizar_tramo_a_segmento, tareas, RENDER_WORKERS, al_completar, terminado, metodo)
+
+class AdelantoRender:
+    """
+    Renderiza segmentos mientras el cerebro sigue generando la receta. En cuanto están
+    las recetas de las escenas 0..m-1, sus cuerpos (y las transiciones entre ellas) ya
+    no cambian: se codifican y se guardan en la caché de segmentos con la misma clave
+    que usará el render final, que después solo tiene que reutilizarlos.
+    """
+
+    def __init__(self, job_id, original_scenes, perfil):
+        self.job_id = job_id
+        self.original_scenes = original_scenes
+        self.perfil = perfil
+        self.canvas = canvas_de(perfil, CANVAS_SALIDA)
+        self.recetas = [None] * len(original_scenes)
+        self.hechos = set()
+        self._cerrado = False
+        # Un solo hilo, en orden: primero se descargan los medios (mientras la IA trabaja) y
+        # después cada bloque recibido adelanta lo que pueda sin frenar al cerebro
+        self._hilo = ThreadPoolExecutor(max_workers=1)
+        urls = [u for s in original_scenes for u in (s.get('mediaUrl'), s.get('audioUrl'))]
+        self._medios = self._hilo.submit(CACHE_MEDIOS.prefetch, urls)
+
+    def recibir(self, primera, recetas):
+        """Callback de create_ai_recipe."""
+        self.recetas[primera:primera + len(recetas)] = recetas
+        self._hilo.submit(self._adelantar_prefijo)
+
+    def _adelantar_prefijo(self):
+        # Nunca falla: el render final hace lo que aquí no se pudo
+        m = next((i for i, r in enumerate(self.recetas) if r is None), len(self.recetas))
+        if self._cerrado or m == len(self.recetas) or m < 1:
+            return  # con la receta completa (o sin prefijo todavía) no hay nada que adelantar
+        try:
+            self._adelantar(m)
+        except Exception:
+            logging.warning(f"[{self.job_id}] BRAZOS: No se pudieron adelantar segmentos.", exc_info=True)
+
+    def _adelantar(self, m):
+        rutas_medios, _ = self._medios.result()
+        escenas, recetas = self.original_scenes[:m], self.recetas[:m]
+        rutas_medios = normalizar_medios(self.job_id, escenas, recetas, rutas_medios, self.canvas, self.perfil.fps)
+        recetas_parciales = recetas + [{}] * (len(self.recetas) - m)
+        tramos, _ = planificar_transiciones(self.job_id, self.original_scenes, recetas_parciales, rutas_medios, self.perfil.fps)
+        claves = claves_de_tramos(self.original_scenes, recetas_parciales, tramos, self.perfil, self.canvas)
+        # Solo los tramos que no dependen de escenas sin receta; un prefijo de tramos coincide con el del render final
+        pendientes = [n for n, tramo in enumerate(tramos)
+                      if max(escenas_de_tramo(tramo)) < m and claves[n] not in self.hechos
+                      and CACHE_SEGMENTOS.obtener(claves[n]) is None]
+        if not pendientes:
+            return
+        # Adelantar es oportunista: si no hay disco libre ahora no se espera, ya lo hará el render final
+        try:
+            espacio = ESPACIOS.reservar(f"{self.job_id}_adelanto", estimar_espacio(sum(duracion_tramo(tramos[n]) for n in pendientes),
+                                                                                   self.canvas), espera=0)
+        except SinEspacio:
+            logging.info(f"[{self.job_id}] BRAZOS: Sin disco de trabajo libre para adelantar segmentos.")
+            return
+        logging.info(f"[{self.job_id}] BRAZOS: Adelantando {len(pendientes)} segmentos con la receta de {m} escenas...")
+        # El cerebro sigue con llamadas gRPC en otros hilos: un fork ahora podría heredar sus
+        # locks tomados, así que el pool sale de un forkserver
+        with espacio:
+            renderizar_tramos(self.job_id, pendientes, tramos, claves, self.original_scenes, recetas_parciales,
+                              rutas_medios, espacio.ruta, self.canvas, self.perfil, metodo="forkserver")
+        self.hechos.update(claves[n] for n in pendientes)
+        JOBS.actualizar(self.job_id, earlySegments=len(self.hechos))
+
+    def cerrar(self):
+        """Descarta lo que quede por adelantar y espera al render en curso (el final reutilizará sus segmentos)."""
+        self._cerrado = True
+        self._hilo.shutdown(wait=True)
+
+def renderizar_receta_con_ffmpeg(job_id, original_scenes, recetas, rutas_medios, tmp_dir, ruta_salida, perfil,
+                                 linea, ruta_audio, movflags=MOVFLAGS_FASTSTART):
+    """Intenta el motor nativo de ffmpeg. Devuelve False si la receta necesita el motor de moviepy."""
+    escenas = []
+    for scene_data, receta, escena in zip(original_scenes, recetas, linea):
+        escenas.append({
+            "media_path": rutas_medios[scene_data['mediaUrl']],
+            "media_type": scene_data.get('mediaType', 'image'),
+            "audio_path": rutas_medios[scene_data['audioUrl']],
+            "duracion": escena['duracion'],
+            "solape": escena['salida'],
+            "receta": receta,
+        })
+    try:
+        logging.info(f"[{job_id}] BRAZOS: Renderizando con el motor ffmpeg...")
+        with medir_etapa(JOBS, job_id, 'encode'):
+            renderizar_con_ffmpeg(escenas, ruta_salida, canvas_de(perfil, CANVAS_SALIDA), perfil.fps, tmp_dir,
+                                  threads=perfil.threads, movflags=movflags, preset=perfil.preset, crf=perfil.crf,
+                                  ruta_audio=ruta_audio,
+                                  al_progresar=lambda hechos, total: JOBS.registrar_frames(job_id, 'final', hechos, total))
+    except EfectoNoSoportado as e:
+        logging.info(f"[{job_id}] BRAZOS: Motor ffmpeg no aplicable ({e}). Se usa moviepy.")
+        return False
+    return True
+
+def process_video_from_recipe(job_id, original_scenes, ai_recipe, perfil):
+    espacio = None
+    subida = None
+    
+    try:
+        JOBS.actualizar(job_id, status='processing')
+
+        # La receta de cada escena por su scene_id (o su posición si no tiene id)
+        recetas, _ = recetas_de_escenas(ai_recipe, original_scenes)
+
+        # Prefetch: todos los medios del trabajo (y sus SFX) se descargan en paralelo antes de componer
+        JOBS.actualizar(job_id, status='downloading')
+        sfx_urls = urls_sfx(job_id, recetas)
+        urls = [u for s in original_scenes for u in (s.get('mediaUrl'), s.get('audioUrl'))] + list(sfx_urls.values())
+        with medir_etapa(JOBS, job_id, 'download'):
+            rutas_medios, stats_cache = CACHE_MEDIOS.prefetch(urls)
+        segundos_descarga = stats_cache.pop('segundos')
+        # Las descargas de cada escena se solapan con las demás y ya cuentan en 'download':
+        # van en una etapa propia para no sumarse dos veces en los totales
         for i, scene_data in enumerate(original_scenes):
-            JOBS[job_id]['progress'] = f"{i + 1}/{len(original_scenes)}"
-            logging.info(f"[{job_id}] BRAZOS: Componiendo escena {i+1}...")
-            
-            # Encuentra la receta correspondiente a esta escena
-            recipe_for_scene = next((r for r in recipe_scenes if r.get("scene_id") == scene_data.get("id")), {})
-
-            # 1. Descargar y crear clip base
-            media_path = download_file(scene_data['mediaUrl'], os.path.join(tmp_dir, f"media_{i}"))
-            narration_path = download_file(scene_data['audioUrl'], os.path.join(tmp_dir, f"audio_{i}"))
-            
-            narration_clip = AudioFileClip(narration_path)
-            duration = narration_clip.duration + 0.5 # Duración basada en audio + 0.5s de margen
-
-            # Admite tanto imágenes como videos de entrada
-            if scene_data.get('mediaType', 'image') == 'video':
-                base_clip = VideoFileClip(media_path).set_duration(duration).set_audio(None) # Quitar audio original
-            else:
-                base_clip = ImageClip(media_path, duration=duration)
-            
-            video_size = base_clip.size
-
-            # 2. Aplicar efectos visuales de la receta
-            for effect in recipe_for_scene.get('visual_effects', []):
-                logging.info(f"  -> Aplicando efecto visual: {effect['type']}")
-                if effect['type'] == 'vignette':
-                    base_clip = vfx_aplicar_viñeta(base_clip, **effect.get('params', {}))
-                elif effect['type'] == 'ken_burns':
-                    base_clip = vfx_crear_efecto_ken_burns(base_clip, duration, video_size, **effect.get('params', {}))
-
-            # 3. Preparar el audio (Narración + SFX)
-            audio_clips_to_compose = [narration_clip]
-            for sfx in recipe_for_scene.get('sound_effects', []):
-                 logging.info(f"  -> Añadiendo SFX: {sfx['sfx_id']}")
-                 # Aquí descargarías el sfx desde GCS usando su URL del catálogo
-                 # sfx_path = download_file(sfx_url, ...)
-                 # sfx_clip = AudioFileClip(sfx_path).set_start(sfx['start_time']).volumex(sfx['volume'])
-                 # audio_clips_to_compose.append(sfx_clip)
-            
-            final_audio = CompositeAudioClip(audio_clips_to_compose)
-            base_clip = base_clip.set_audio(final_audio)
-
-            # 4. Aplicar overlays de texto de la receta
-            text_clips_to_add = []
-            for text_info in recipe_for_scene.get('text_overlays', []):
-                logging.info(f"  -> Creando texto: '{text_info['text'][:20]}...'")
-                style = text_info.get('style', {})
-                effect = text_info.get('effect', {})
-                background = text_info.get('background')
-                
-                # Crear texto con fondo si se especifica
-                if background:
-                    text_clip = text_fx_crear_texto_con_fondo(text_info['text'], **style, **background)
-                else: # Crear texto simple
-                    text_clip = TextClip(text_info['text'], **style)
-
-                # Aplicar animación de aparición si se especifica
-                if effect.get('type') == 'popup':
-                    text_clip = text_fx_crear_texto_popup(text_info['text'], duracion_anim=effect['anim_duration'], **style)
-                elif effect.get('type') == 'typewriter':
-                    text_clip = text_fx_crear_texto_maquina_escribir(text_info['text'], duracion_total=text_info['duration'], **style)
-                
-                text_clip = text_clip.set_start(text_info['start_time']).set_duration(text_info['duration']).set_position(text_info['position'])
-                text_clips_to_add.append(text_clip)
-
-            # Componer la escena final
-            final_scene_clip = CompositeVideoClip([base_clip] + text_clips_to_add, size=video_size)
-            scene_clips.append(final_scene_clip)
-
-        # 5. Ensamblaje final (AÚN SIMPLIFICADO - SIN TRANSICIONES)
-        final_video = concatenate_videoclips(scene_clips)
-        
-        logging.info(f"[{job_id}] BRAZOS: Renderizado completado. Subiendo a GCS...")
-        final_video_path = os.path.join(tmp_dir, "final_video.mp4")
-        final_video.write_videofile(final_video_path, codec="libx264", audio_codec="aac", fps=24)
+            JOBS.registrar_etapa(job_id, 'download_escena', max(segundos_descarga.get(scene_data.get(k), 0.0)
+                                                        for k in ('mediaUrl', 'audioUrl')), escena=i)
+        JOBS.actualizar(job_id, status="processing", mediaCache=stats_cache)
+        logging.info(f"[{job_id}] BRAZOS: Medios listos ({stats_cache['hits']} en caché, {stats_cache['misses']} descargados).")
+
+        # El perfil fija resolución, fps y preset/CRF de x264 (p.ej. 'draft' para previsualizar)
+        canvas = canvas_de(perfil, CANVAS_SALIDA)
+        logging.info(f"[{job_id}] BRAZOS: Perfil '{perfil.nombre}' ({canvas[0]}x{canvas[1]} @ {perfil.fps} fps, preset {perfil.preset}, crf {perfil.crf}).")
+        # Ingesta: una foto de 24 MP se reduce aquí una vez en lugar de en cada frame
+        with medir_etapa(JOBS, job_id, 'ingest'):
+            rutas_medios = normalizar_medios(job_id, original_scenes, recetas, rutas_medios, canvas, perfil.fps)
+
+        # Espacio de trabajo con cuota de disco. Los medios de cada escena se fijan en sus cachés
+        # (hardlink, sin copiarlos) y se sueltan en cuanto su último segmento está codificado
+        tramos, linea = planificar_transiciones(job_id, original_scenes, recetas, rutas_medios, perfil.fps)
+        espacio = reservar_espacio(job_id, linea[-1]['inicio'] + linea[-1]['duracion'], canvas)
+        medios_escena = [(rutas_medios[s['mediaUrl']], rutas_medios[s['audioUrl']]) for s in original_scenes]
+        for ruta in (r for medios in medios_escena for r in medios):
+            espacio.fijar(ruta)
+        def soltar_escena(i):
+            for ruta in medios_escena[i]:
+                espacio.soltar(ruta)
+        final_video_path = espacio.archivo("final_video.mp4")
+
+        # La subida sigue al archivo final mientras el codificador lo escribe
+        subida = SubidaProgresiva(
+            DESTINO_SALIDA, final_video_path, f"videos_inteligentes/{job_id}.mp4", 'video/mp4',
+            chunk_size=UPLOAD_CHUNK_MB * 1024 * 1024,
+            al_progresar=lambda n: JOBS.actualizar(job_id, uploadedBytes=n),
+        )
+        movflags = MOVFLAGS_STREAMING if UPLOAD_STREAMING else MOVFLAGS_FASTSTART
+        if UPLOAD_STREAMING:
+            subida.iniciar()
+
+        # Una sola pista de audio para todo el video; el video se renderiza sin audio y se une al final
+        with medir_etapa(JOBS, job_id, 'audio_mix'):
+            ruta_audio = mezclar_audio(job_id, original_scenes, recetas, rutas_medios, sfx_urls, linea,
+                                       espacio.archivo("audio.wav"))
+        inicio_render = time.perf_counter()
+
+        if RENDER_ENGINE == 'ffmpeg' and renderizar_receta_con_ffmpeg(job_id, original_scenes, recetas, rutas_medios, espacio.ruta,
+                                                                      final_video_path, perfil, linea, ruta_audio, movflags):
+            pass
+        elif RENDER_MODO == 'paralelo':
+            # Cada tramo (cuerpo de escena o ventana de transición) se codifica a su propio segmento
+            # en paralelo y luego se unen sin recodificar: solo las ventanas componen dos escenas.
+            # Los tramos cuyo segmento ya está en caché (mismas entradas) no se vuelven a renderizar.
+            claves = claves_de_tramos(original_scenes, recetas, tramos, perfil, canvas)
+            segmentos = [CACHE_SEGMENTOS.obtener(clave) for clave in claves]
+            pendientes = [n for n, ruta in enumerate(segmentos) if ruta is None]
+            # Los segmentos que se van a unir también se fijan: la caché no puede expulsarlos antes
+            por_codificar = {i: 0 for i in range(len(original_scenes))}
+            for n, ruta in enumerate(segmentos):
+                if ruta:
+                    espacio.fijar(ruta)
+                else:
+                    for i in escenas_de_tramo(tramos[n]):
+                        por_codificar[i] += 1
+            for i in [i for i, faltan in por_codificar.items() if not faltan]:
+                soltar_escena(i)
+            def al_terminar(n, ruta):
+                espacio.fijar(ruta)
+                for i in escenas_de_tramo(tramos[n]):
+                    por_codificar[i] -= 1
+                    if not por_codificar[i]:
+                        soltar_escena(i)
+            reutilizadas = [original_scenes[t['escena']].get('id', t['escena'])
+                            for t, ruta in zip(tramos, segmentos) if ruta and t['tipo'] == 'escena']
+            JOBS.actualizar(job_id, reusedScenes=reutilizadas,
+                            renderedScenes=[original_scenes[tramos[n]['escena']].get('id', tramos[n]['escena'])
+                                            for n in pendientes if tramos[n]['tipo'] == 'escena'])
+            logging.info(f"[{job_id}] BRAZOS: {len(tramos) - len(pendientes)} de {len(tramos)} segmentos reutilizados de la caché. "
+                         f"Renderizando {len(pendientes)} con {RENDER_WORKERS} procesos...")
+            def al_completar(hechas, total):
+                JOBS.actualizar(job_id, progress=f"{len(tramos) - len(pendientes) + hechas}/{len(tramos)}")
+            nuevos = renderizar_tramos(job_id, pendientes, tramos, claves, original_scenes, recetas, rutas_medios,
+                                       espacio.ruta, canvas, perfil, al_completar, al_terminar)
+            for n, ruta in zip(pendientes, nuevos):
+                segmentos[n] = ruta
+            concatenar_segmentos(segmentos, final_video_path, movflags, ruta_audio)
+        else:
+            scene_clips, contador_memo = [], {}
+            for i, scene_data in enumerate(original_scenes):
+                JOBS.actualizar(job_id, progress=f"{i + 1}/{len(original_scenes)}")
+                logging.info(f"[{job_id}] BRAZOS: Componiendo escena {i+1}...")
+                with medir_etapa(JOBS, job_id, 'compose', escena=i):
+                    scene_clips.append(componer_escena(job_id, i, scene_data, recetas[i], rutas_medios, canvas, perfil.fps, contador_memo))
+
+            # 5. Ensamblaje final: cuerpos de escena intactos y solo las ventanas de transición compuestas
+            final_video = ajustar_a_frames(concatenate_videoclips([clip_de_tramo(tramo, scene_clips) for tramo in tramos]), perfil.fps)
+            final_video, tiempo_frames = cronometrar_frames(final_video)
+            inicio_escritura = time.perf_counter()
+            # Con `audio` como ruta moviepy copia la pista tal cual (PCM en el MP4): como clip de
+            # audio la codifica a AAC antes de unirla al video
+            final_video = final_video.set_audio(AudioFileClip(ruta_audio))
+            final_video.write_videofile(final_video_path, codec="libx264", audio_codec="aac", audio_bitrate="192k",
+                                        temp_audiofile=espacio.archivo("audio_final.m4a"), fps=perfil.fps,
+                                        preset=perfil.preset, threads=perfil.threads or None,
+                                        ffmpeg_params=["-crf", str(perfil.crf), "-movflags", movflags],
+                                        logger=logger_frames(JOBS, job_id, 'final'))
+            final_video.audio.close()
+            JOBS.registrar_etapa(job_id, 'compose', tiempo_frames['segundos'])
+            JOBS.registrar_etapa(job_id, 'encode', time.perf_counter() - inicio_escritura - tiempo_frames['segundos'])
+            registrar_memo(job_id, contador_memo)
         
-        public_url = upload_to_gcs(open(final_video_path, 'rb').read(), f"videos_inteligentes/{job_id}.mp4", 'video/mp4')
+        JOBS.registrar_etapa(job_id, 'render', time.perf_counter() - inicio_render)
+        espacio.medir()
+        JOBS.actualizar(job_id, workspace={"reservedBytes": espacio.reservados, "peakBytes": espacio.pico})
+        logging.info(f"[{job_id}] BRAZOS: Renderizado completado. Finalizando subida...")
+        JOBS.actualizar(job_id, status="uploading")
+        # Con subida en streaming esto es solo la cola que quedaba por subir al terminar de codificar
+        with medir_etapa(JOBS, job_id, 'upload'):
+            public_url = subida.terminar()
+        subida = None
         
-        JOBS[job_id].update({"status": "completed", "videoUrl": public_url, "progress": "100%"})
+        JOBS.actualizar(job_id, status="completed", videoUrl=public_url, progress="100%")
         logging.info(f"[{job_id}] ¡TRABAJO COMPLETADO! URL: {public_url}")
 
     except Exception as e:
         logging.error(f"[{job_id}] ERROR FATAL en los BRAZOS.", exc_info=True)
-        JOBS[job_id].update({"status": "error", "error": str(e)})
+        JOBS.actualizar(job_id, status="error", error=str(e))
     finally:
-        if os.path.exists(tmp_dir):
-            os.system(f"rm -rf {tmp_dir}")
+        # También con SystemExit (SIGTERM del pool): la subida se cancela antes de borrar el
+        # archivo que sigue, para no publicar un objeto a medias
+        if subida:
+            subida.cancelar()
+        if espacio:
+            espacio.cerrar()
 
 
 # ==============================================================================
-# === API ENDPOINTS Y FUNCIONES DE SOPORTE                                   ===
+# === EJECUCIÓN DE TRABAJOS (pool de workers, ver worker.py)                 ===
 # ==============================================================================
 
-@app.route("/")
-def index():
-    return "Renderizador Inteligente v4.0 con IA Generativa está activo."
-
-@app.route('/api/render-video', methods=['POST'])
-def render_video_endpoint():
+def receta_compartida(job_id, origen):
     """
-    NUEVO ENDPOINT PRINCIPAL: Recibe los medios y el estilo, y la IA crea el video.
+    Receta del trabajo `origen` (mismo lote, mismas escenas y estilo). El planificador no
+    reclama el trabajo hasta que el origen la tiene, así que no se espera: None si el origen
+    falló o ya no existe, y entonces se genera una propia.
     """
-    try:
-        data = request.get_json()
-        if not data or 'scenes' not in data or 'style' not in data:
-            return jsonify({"error": "La solicitud debe incluir 'scenes' y 'style'."}), 400
-        
-        scenes = data['scenes']
-        style = data['style']
-        
-        job_id = str(uuid.uuid4())
-        JOBS[job_id] = {"status": "pending_brain", "progress": "0%"}
-        
-        # El flujo ahora es asíncrono desde el inicio
-        thread = threading.Thread(target=run_full_process, args=(job_id, scenes, style))
-        thread.start()
-        
-        return jsonify({"message": "Trabajo de renderizado inteligente aceptado.", "jobId": job_id}), 202
-    except Exception as e:
-        logging.error("Error al iniciar /api/render-video", exc_info=True)
-        return jsonify({"error": f"Error interno del servidor: {e}"}), 500
+    trabajo = JOBS.obtener(origen)
+    if trabajo and trabajo.get('recipe'):
+        logging.info(f"[{job_id}] CEREBRO IA: Receta compartida con el trabajo {origen}.")
+        return trabajo['recipe']
+    logging.warning(f"[{job_id}] CEREBRO IA: La receta del trabajo {origen} no está disponible; se genera una propia.")
+    return None
 
-def run_full_process(job_id, scenes, style):
+def run_full_process(job_id, scenes, style, nombre_perfil=PERFIL_POR_DEFECTO, receta=None, receta_de_trabajo=None):
     """Función que encapsula el cerebro y los brazos para correr en un hilo."""
     try:
-        # 1. El Cerebro con IA crea la receta
-        ai_recipe = create_ai_recipe(job_id, scenes, style)
-        JOBS[job_id]['status'] = 'pending_render'
+        perfil = obtener_perfil(nombre_perfil)
+        # En un lote, los videos que solo cambian de perfil reutilizan la receta del primero
+        if receta is None and receta_de_trabajo:
+            receta = receta_compartida(job_id, receta_de_trabajo)
+        # 1. El Cerebro con IA crea la receta (salvo que venga de una previsualización aprobada).
+        # Con render paralelo, los segmentos de las primeras escenas se codifican mientras llegan los demás bloques
+        if receta is None and RENDER_MODO == 'paralelo' and RENDER_ENGINE == 'moviepy' and len(scenes) > RECETA_ESCENAS_POR_BLOQUE:
+            adelanto = AdelantoRender(job_id, scenes, perfil)
+            try:
+                receta = create_ai_recipe(job_id, scenes, style, adelanto.recibir)
+            finally:
+                adelanto.cerrar()
+        ai_recipe = receta or create_ai_recipe(job_id, scenes, style)
+        # La receta se guarda para poder renderizarla de nuevo con otro perfil
+        JOBS.actualizar(job_id, status='pending_render', profile=perfil.nombre, recipe=ai_recipe)
         
         # 2. Los Brazos ejecutan la receta
-        process_video_from_recipe(job_id, scenes, ai_recipe)
+        process_video_from_recipe(job_id, scenes, ai_recipe, perfil)
     except Exception as e:
         logging.error(f"[{job_id}] Fallo en el hilo principal del proceso.", exc_info=True)
-        JOBS[job_id].update({"status": "error", "error": f"Fallo en la fase de IA: {e}"})
-
-@app.route('/api/job-status/<job_id>', methods=['GET'])
-def get_job_status(job_id):
-    job = JOBS.get(job_id)
-    if not job:
-        return jsonify({"error": "Trabajo no encontrado."}), 404
-    return jsonify(job)
-
-# --- EJECUCIÓN DEL SERVIDOR ---
-if __name__ == '__main__':
-    port = int(os.environ.get('PORT', 5001))
-    app.run(host='0.0.0.0', port=port, debug=False)
+        JOBS.actualizar(job_id, status="error", error=f"Fallo en la fase de IA: {e}")
+
+def precargar_lote(lote_id, urls):
+    """Descarga a la caché los medios de un lote (ver Planificador.atender_precargas); sus trabajos los encuentran ya en caché."""
+    _, stats = CACHE_MEDIOS.prefetch(urls)
+    logging.info(f"[lote {lote_id}] Medios precargados ({stats['hits']} en caché, {stats['misses']} descargados).")
+
+def ejecutar_trabajo(job_id, payload):
+    """Punto de entrada del planificador para un trabajo reclamado de la cola."""
+    run_full_process(job_id, payload['scenes'], payload['style'], payload.get('profile', PERFIL_POR_DEFECTO),
+                     payload.get('recipe'), payload.get('recipeFromBatchJob'))
+
+# Límite global de renders simultáneos entre todos los procesos del pool (ver worker.py)
+PLANIFICADOR = Planificador(JOBS, max_concurrentes=int(os.getenv("RENDER_MAX_CONCURRENTES", "2")))
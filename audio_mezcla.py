@@ -0,0 +1,94 @@
+# audio_mezcla.py
+# Motor de audio: decodifica narraciones y SFX a PCM (float32 estéreo a la frecuencia
+# de salida), mezcla toda la línea de tiempo con numpy y escribe una única pista WAV
+# para el muxer. Cada SFX se decodifica una sola vez por proceso.
+
+import wave
+import logging
+import subprocess
+from functools import lru_cache
+
+import numpy as np
+from moviepy.config import get_setting
+
+FRECUENCIA_SALIDA = 44100
+CANALES = 2
+
+
+def decodificar_pcm(ruta, fps=FRECUENCIA_SALIDA):
+    """Decodifica cualquier audio que entienda ffmpeg a un array (n, 2) float32 en [-1, 1]."""
+    comando = [
+        get_setting("FFMPEG_BINARY"), "-loglevel", "error", "-i", ruta, "-vn",
+        "-f", "f32le", "-acodec", "pcm_f32le", "-ac", str(CANALES), "-ar", str(fps), "-",
+    ]
+    try:
+        salida = subprocess.run(comando, check=True, capture_output=True).stdout
+    except subprocess.CalledProcessError as e:
+        logging.error(f"AUDIO: No se pudo decodificar {ruta}: {e.stderr.decode(errors='ignore')}")
+        raise
+    return np.frombuffer(salida, dtype=np.float32).reshape(-1, CANALES)
+
+
+@lru_cache(maxsize=128)
+def pcm_cacheado(ruta, fps=FRECUENCIA_SALIDA):
+    """
+    PCM decodificado y cacheado en memoria. Pensado para SFX (cortos y repetidos entre
+    escenas y trabajos): las rutas de la caché de medios son por contenido, así que la
+    misma ruta es siempre el mismo audio.
+    """
+    pcm = decodificar_pcm(ruta, fps)
+    pcm.setflags(write=False)
+    return pcm
+
+
+def mezclar(pistas, duracion, fps=FRECUENCIA_SALIDA, entrada=0.0, salida=0.0):
+    """
+    Suma las pistas [(pcm, inicio_segundos, volumen), ...] en un buffer de `duracion`
+    segundos. Lo que excede el buffer se recorta. `entrada`/`salida` aplican fundidos
+    lineales al resultado (el acrossfade de las transiciones).
+    """
+    n = int(round(duracion * fps))
+    mezcla = np.zeros((n, CANALES), dtype=np.float32)
+    for pcm, inicio, volumen in pistas:
+        a = int(round(inicio * fps))
+        origen = pcm[max(0, -a):]
+        a = max(0, a)
+        m = min(len(origen), n - a)
+        if m <= 0:
+            continue
+        if volumen == 1:
+            mezcla[a:a + m] += origen[:m]
+        else:
+            mezcla[a:a + m] += origen[:m] * np.float32(volumen)
+    n_entrada = min(n, int(round(entrada * fps)))
+    if n_entrada:
+        mezcla[:n_entrada] *= np.linspace(0, 1, n_entrada, endpoint=False, dtype=np.float32)[:, None]
+    n_salida = min(n, int(round(salida * fps)))
+    if n_salida:
+        mezcla[n - n_salida:] *= np.linspace(1, 0, n_salida, endpoint=False, dtype=np.float32)[:, None]
+    return mezcla
+
+
+def escribir_wav(pcm, ruta, fps=FRECUENCIA_SALIDA):
+    """Escribe el PCM como WAV de 16 bits (con saturación, no desbordamiento)."""
+    muestras = (np.clip(pcm, -1.0, 1.0) * 32767).astype('<i2')
+    with wave.open(ruta, 'wb') as f:
+        f.setnchannels(pcm.shape[1])
+        f.setsampwidth(2)
+        f.setframerate(fps)
+        f.writeframes(muestras.tobytes())
+    return ruta
+
+
+def url_sfx(catalogo, sfx_id):
+    """
+    URL de un SFX en el catálogo. Admite una lista de entradas ({"id", "url"}) o un dict
+    {id: url} / {id: {"url": ...}}. Devuelve None si no existe.
+    """
+    if isinstance(catalogo, dict):
+        entrada = catalogo.get(sfx_id)
+    else:
+        entrada = next((e for e in catalogo or [] if isinstance(e, dict) and e.get('id') == sfx_id), None)
+    if isinstance(entrada, dict):
+        return entrada.get('url')
+    return entrada
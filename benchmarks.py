@@ -0,0 +1,509 @@
+# benchmarks.py
+# Benchmarks de render sin red ni credenciales.
+#   python benchmarks.py viñeta                     micro-benchmark de la viñeta
+#   python benchmarks.py suite [--resoluciones 720p,1080p] [--base benchmarks_base.json]
+#                              [--guardar-base] [--tolerancia 0.25]
+#   python benchmarks.py paridad [--resolucion 720p] [--umbral 28]
+# La suite genera medios sintéticos, los sirve desde un HTTP local, sustituye Gemini y
+# GCS por dobles deterministas y mide fps y pico de RSS por efecto y por pipeline
+# completo. Sale con código 1 cuando algo empeora más que la tolerancia respecto a la base
+# y con código 2 si la base no existe.
+# La paridad renderiza la misma escena sintética (una imagen 4:3, para que el encuadre
+# importe) con los motores de moviepy y ffmpeg y sale con código 1 si en algún caso el
+# PSNR entre ambos queda por debajo del umbral.
+
+import os
+import sys
+import json
+import wave
+import time
+import shutil
+import hashlib
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+from types import SimpleNamespace
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+import numpy as np
+from moviepy.editor import ColorClip, ImageClip, VideoClip, CompositeVideoClip
+from moviepy.config import get_setting
+
+import vfx
+
+
+def _viñeta_anterior(clip, radio=0.7, suavizado=0.4, color=(0, 0, 0)):
+    """Implementación previa (máscara recalculada + capa compuesta) como referencia."""
+    w, h = clip.size
+    y, x = np.ogrid[0:h, 0:w]
+    dist_centro = np.sqrt(((x - w / 2) / (w / 2))**2 + ((y - h / 2) / (h / 2))**2)
+    mascara = np.clip((dist_centro - radio) / suavizado, 0, 1)
+    viñeta_overlay = ColorClip(size=(w, h), color=color, duration=clip.duration)
+    viñeta_con_mascara = viñeta_overlay.set_mask(ImageClip(mascara, ismask=True))
+    return CompositeVideoClip([clip, viñeta_con_mascara])
+
+
+def medir_por_frame(clip, n_frames=48, fps=24):
+    """Segundos medios por frame al pedir `n_frames` consecutivos a `clip`."""
+    clip.get_frame(0)  # calentamiento
+    inicio = time.perf_counter()
+    for i in range(n_frames):
+        clip.get_frame((i / fps) % clip.duration)
+    return (time.perf_counter() - inicio) / n_frames
+
+
+def benchmark_viñeta(size=(1920, 1080), n_frames=48):
+    w, h = size
+    fondo = np.random.RandomState(0).randint(0, 256, (h, w, 3), dtype=np.uint8)
+    # VideoClip y no ImageClip: ImageClip.fl_image aplicaría el efecto una sola vez
+    base = VideoClip(lambda t: fondo, duration=10)
+    resultados = {}
+    for nombre, fabrica in (("anterior", lambda: _viñeta_anterior(base)),
+                            ("cacheada", lambda: vfx.aplicar_viñeta(base))):
+        construccion = time.perf_counter()
+        clip = fabrica()
+        construccion = time.perf_counter() - construccion
+        resultados[nombre] = {"construccion_ms": construccion * 1000,
+                              "por_frame_ms": medir_por_frame(clip, n_frames) * 1000}
+    return resultados
+
+
+BENCHMARKS = {
+    "viñeta": benchmark_viñeta,
+}
+
+
+# ==============================================================================
+# === SUITE: MEDIOS SINTÉTICOS, DOBLES DE GEMINI/GCS Y MEDICIÓN              ===
+# ==============================================================================
+
+RESOLUCIONES = {"720p": (1280, 720), "1080p": (1920, 1080)}
+DURACION_NARRACION = 3.0
+FPS_MEDICION = 24
+
+
+def _escribir_tono(ruta, duracion, frecuencia, fps=44100):
+    """Narración sintética: un tono modulado en amplitud (WAV mono de 16 bits)."""
+    t = np.arange(int(duracion * fps)) / fps
+    senal = 0.4 * np.sin(2 * np.pi * frecuencia * t) * (0.6 + 0.4 * np.sin(2 * np.pi * 3 * t))
+    with wave.open(ruta, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(fps)
+        f.writeframes((senal * 32767).astype('<i2').tobytes())
+    return ruta
+
+
+def _imagen_procedural(w, h, semilla):
+    """Degradado con ruido y formas: algo parecido a una foto para el compresor."""
+    rng = np.random.default_rng(semilla)
+    y, x = np.mgrid[0:h, 0:w]
+    imagen = np.stack([x * 255 // max(w - 1, 1), y * 255 // max(h - 1, 1),
+                       (x + y) * 255 // max(w + h - 2, 1)], axis=-1).astype(np.int16)
+    for _ in range(12):
+        cx, cy, r = rng.integers(0, w), rng.integers(0, h), rng.integers(h // 20, h // 4)
+        imagen[(x - cx) ** 2 + (y - cy) ** 2 < r * r] = rng.integers(0, 256, 3)
+    imagen += rng.integers(-12, 13, imagen.shape, dtype=np.int16)
+    return np.clip(imagen, 0, 255).astype(np.uint8)
+
+
+def generar_medios(directorio, w=2560, h=1440):
+    """Imágenes, un video corto, narraciones y un SFX sintéticos. Devuelve los nombres de archivo."""
+    from PIL import Image
+    os.makedirs(directorio, exist_ok=True)
+    for i in range(3):
+        Image.fromarray(_imagen_procedural(w, h, i)).save(os.path.join(directorio, f"imagen_{i}.png"))
+        _escribir_tono(os.path.join(directorio, f"narracion_{i}.wav"), DURACION_NARRACION, 220 + 110 * i)
+    _escribir_tono(os.path.join(directorio, "narracion_3.wav"), DURACION_NARRACION, 550)
+    Image.fromarray(_imagen_procedural(1600, 1200, 7)).save(os.path.join(directorio, "imagen_4x3.png"))
+    _escribir_tono(os.path.join(directorio, "sfx_pop.wav"), 0.3, 880)
+    fondo = _imagen_procedural(1280, 720, 99)
+    video = VideoClip(lambda t: np.roll(fondo, int(t * 200), axis=1), duration=DURACION_NARRACION + 1)
+    video.write_videofile(os.path.join(directorio, "video_0.mp4"), fps=24, codec="libx264", audio=False,
+                          preset="ultrafast", logger=None)
+    return directorio
+
+
+class _ManejadorSilencioso(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class ServidorLocal:
+    """Servidor HTTP en un puerto libre que sirve `directorio` (sustituye a las URLs públicas de los medios)."""
+
+    def __init__(self, directorio):
+        self._servidor = ThreadingHTTPServer(("127.0.0.1", 0), partial(_ManejadorSilencioso, directory=directorio))
+        self.url = f"http://127.0.0.1:{self._servidor.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self._servidor.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+
+class ModeloFalso:
+    """Sustituto de `model_text`: devuelve siempre la misma receta, con el formato de Gemini (bloque ```json)."""
+
+    def __init__(self, receta):
+        self.receta = receta
+        self.llamadas = 0
+
+    def generate_content(self, prompt, **kwargs):
+        self.llamadas += 1
+        return SimpleNamespace(text="```json\n" + json.dumps(self.receta) + "\n```")
+
+
+class _BlobFalso:
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.etag = None
+
+    def open(self, modo, chunk_size=None, content_type=None):
+        os.makedirs(os.path.dirname(self.ruta), exist_ok=True)
+        return open(self.ruta, modo)
+
+    def reload(self):
+        with open(self.ruta, 'rb') as f:
+            self.etag = hashlib.md5(f.read()).hexdigest()
+
+    def download_as_bytes(self):
+        with open(self.ruta, 'rb') as f:
+            return f.read()
+
+    @property
+    def public_url(self):
+        return f"file://{self.ruta}"
+
+
+class StorageFalso:
+    """Sustituto de `storage_client`: los buckets son subdirectorios locales."""
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+
+    def bucket(self, nombre):
+        return SimpleNamespace(blob=lambda ruta: _BlobFalso(os.path.join(self.directorio, nombre, ruta)))
+
+
+def receta_sintetica(n_escenas=4):
+    """Receta que ejercita todos los efectos, textos, transiciones y un SFX."""
+    efectos = [
+        [{"type": "ken_burns", "params": {"zoom_dir": "in", "pan_dir": "derecha"}}, {"type": "vignette"}],
+        [{"type": "color_correction", "params": {"contraste": 0.2, "saturacion": 0.8}}, {"type": "grain"}],
+        [{"type": "ken_burns", "params": {"zoom_dir": "out", "pan_dir": "centro"}}],
+        [{"type": "vignette"}],
+    ]
+    textos = [
+        {"text": "Benchmark", "start_time": 0.2, "duration": 2.0, "position": "center",
+         "style": {"fontsize": 60, "color": "white"}, "effect": {"type": "popup", "anim_duration": 0.5}},
+        {"text": "Máquina de escribir", "start_time": 0.0, "duration": 2.5, "position": "bottom",
+         "style": {"fontsize": 48, "color": "yellow"}, "effect": {"type": "typewriter"},
+         "background": {"padding": 20, "bg_color": [0, 0, 0], "bg_opacity": 0.6}},
+    ]
+    transiciones = [{"type": "crossfade", "duration": 0.5}, {"type": "slide", "duration": 0.5, "direction": "izquierda"}, None]
+    escenas = []
+    for i in range(n_escenas):
+        escena = {"scene_id": f"s{i}", "visual_effects": efectos[i % len(efectos)],
+                  "text_overlays": [textos[i % len(textos)]],
+                  "sound_effects": [{"sfx_id": "pop", "start_time": 0.5, "volume": 0.7}] if i == 1 else []}
+        if i < n_escenas - 1 and transiciones[i % len(transiciones)]:
+            escena["transition_to_next"] = transiciones[i % len(transiciones)]
+        escenas.append(escena)
+    return {"scenes": escenas}
+
+
+def escenas_sinteticas(url_base, n_escenas=4):
+    escenas = []
+    for i in range(n_escenas):
+        if i == 2:
+            media = {"mediaUrl": f"{url_base}/video_0.mp4", "mediaType": "video"}
+        else:
+            media = {"mediaUrl": f"{url_base}/imagen_{i % 3}.png", "mediaType": "image"}
+        escenas.append({"id": f"s{i}", "audioUrl": f"{url_base}/narracion_{i}.wav", **media})
+    return escenas
+
+
+def _pico_rss_mb():
+    """Pico de RSS (MB) de este proceso y de sus hijos ya terminados (p.ej. el pool de render)."""
+    propio = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    hijos = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(propio, hijos) / 1024
+
+
+def _en_proceso_aparte(funcion, *args):
+    """
+    Ejecuta la medición en un proceso hijo (fork) para que el pico de RSS sea solo suyo.
+    Con fork los argumentos se heredan sin serializar; solo vuelve el dict de resultados.
+    """
+    contexto = multiprocessing.get_context("fork")
+    lectura, escritura = contexto.Pipe(duplex=False)
+
+    def objetivo():
+        try:
+            escritura.send(("ok", funcion(*args)))
+        except Exception as e:
+            escritura.send(("error", repr(e)))
+
+    proceso = contexto.Process(target=objetivo)
+    proceso.start()
+    estado, valor = lectura.recv()
+    proceso.join()
+    if estado != "ok":
+        raise RuntimeError(f"{funcion.__name__}{args[1:]}: {valor}")
+    return valor
+
+
+def _contar_frames(ruta):
+    salida = subprocess.run([get_setting("FFMPEG_BINARY"), "-i", ruta, "-map", "0:v", "-f", "null", "-"],
+                            capture_output=True, text=True).stderr
+    lineas = [l for l in salida.replace('\r', '\n').splitlines() if l.startswith("frame=")]
+    return int(lineas[-1].split("=")[1].split()[0]) if lineas else 0
+
+
+class _Entorno:
+    """app.py importado con rutas temporales, medios servidos en local y dobles de Gemini/GCS."""
+
+    def __init__(self, directorio, url_base):
+        os.environ.update({
+            "JOBS_DB_PATH": os.path.join(directorio, "jobs.sqlite3"),
+            "MEDIA_CACHE_DIR": os.path.join(directorio, "media_cache"),
+            "SEGMENT_CACHE_DIR": os.path.join(directorio, "segment_cache"),
+            "INGEST_CACHE_DIR": os.path.join(directorio, "ingest_cache"),
+            "WORKSPACE_DIR": os.path.join(directorio, "workspace"),
+            "RECIPE_CACHE_BACKEND": "ninguno",
+        })
+        import app
+        self.app = app
+        self.directorio = directorio
+        self.url_base = url_base
+        app.GCS_BUCKET_NAME = "benchmark"
+        app.storage_client = StorageFalso(os.path.join(directorio, "gcs"))
+        catalogo = _BlobFalso(os.path.join(directorio, "gcs", "benchmark", "sound_effects.json"))
+        with catalogo.open('w') as f:
+            json.dump({"pop": f"{url_base}/sfx_pop.wav"}, f)
+
+
+def medir_efecto(entorno, nombre, size, n_frames=48):
+    """
+    fps y pico de RSS al componer una escena con un único efecto. La base es un video y no
+    una imagen: con una imagen fija el compositor y la memo de frames estáticos calculan
+    los efectos estáticos una sola vez y se mediría la caché, no el efecto.
+    """
+    app = entorno.app
+    app.RENDER_MEMO_ESTATICOS = False  # proceso aparte: no afecta a las demás mediciones
+    from texto_raster import texto_karaoke
+    receta = {"visual_effects": [], "text_overlays": []}
+    texto = {"text": "Benchmark de texto", "start_time": 0.0, "duration": DURACION_NARRACION,
+             "position": "center", "style": {"fontsize": 64, "color": "white"}}
+    if nombre in ("ken_burns", "vignette", "grain", "color_correction", "color_grade"):
+        params = {"color_correction": {"contraste": 0.2, "saturacion": 0.8},
+                  "color_grade": {"contraste": 0.2, "brillo": 10, "tinte": [[255, 120, 0], 0.15], "filtro": "sepia"}}.get(nombre, {})
+        receta["visual_effects"].append({"type": nombre, "params": params})
+    elif nombre in ("popup", "typewriter"):
+        efecto = {"type": "popup", "anim_duration": 1.0} if nombre == "popup" else {"type": "typewriter"}
+        receta["text_overlays"].append({**texto, "effect": efecto})
+    escena = {"id": "e", "mediaUrl": f"{entorno.url_base}/video_0.mp4", "mediaType": "video",
+              "audioUrl": f"{entorno.url_base}/narracion_0.wav"}
+    rutas, _ = app.CACHE_MEDIOS.prefetch([escena["mediaUrl"], escena["audioUrl"]])
+    clip = app.componer_escena("bench", 0, escena, receta, rutas, size, FPS_MEDICION)
+    if nombre == "karaoke":
+        palabras = [{"word": p, "start_time": j * 0.4, "end_time": (j + 1) * 0.4}
+                    for j, p in enumerate("uno dos tres cuatro cinco seis".split())]
+        clip = CompositeVideoClip([clip, texto_karaoke(palabras, fontsize=64).set_position("center")], size=size)
+    clip.get_frame(0)  # calentamiento (decodificación y cachés)
+    inicio = time.perf_counter()
+    for i in range(n_frames):
+        clip.get_frame((i / FPS_MEDICION) % clip.duration)
+    segundos = time.perf_counter() - inicio
+    return {"fps": n_frames / segundos, "rss_mb": _pico_rss_mb()}
+
+
+def medir_pipeline(entorno, size, nombre_perfil="standard"):
+    """fps (frames de salida / segundo de reloj) y pico de RSS de un trabajo completo: receta, render y subida."""
+    app = entorno.app
+    from segmentos import CacheSegmentos
+    # Caché de segmentos vacía: se mide el render, no la reutilización
+    app.CACHE_SEGMENTOS = CacheSegmentos(tempfile.mkdtemp(dir=entorno.directorio), 1 << 40)
+    app.CANVAS_SALIDA = size
+    app.model_text = ModeloFalso(receta_sintetica())
+    escenas = escenas_sinteticas(entorno.url_base)
+    job_id = f"bench-{size[1]}p-{time.time_ns()}"
+    app.JOBS.encolar(job_id, {}, max_cola=1 << 30)
+    inicio = time.perf_counter()
+    app.run_full_process(job_id, escenas, "youtuber_dinamico", nombre_perfil)
+    segundos = time.perf_counter() - inicio
+    trabajo = app.JOBS.obtener(job_id)
+    if trabajo.get("status") != "completed":
+        raise RuntimeError(f"El pipeline de benchmark falló: {trabajo.get('error')}")
+    frames = _contar_frames(trabajo["videoUrl"][len("file://"):])
+    return {"fps": frames / segundos, "rss_mb": _pico_rss_mb(), "segundos": segundos}
+
+
+EFECTOS_SUITE = ("ninguno", "ken_burns", "vignette", "grain", "color_correction", "color_grade", "popup", "typewriter", "karaoke")
+
+
+def ejecutar_suite(resoluciones=("720p", "1080p"), perfil="standard"):
+    directorio = tempfile.mkdtemp(prefix="bench_render_")
+    try:
+        generar_medios(os.path.join(directorio, "medios"))
+        with ServidorLocal(os.path.join(directorio, "medios")) as servidor:
+            entorno = _Entorno(directorio, servidor.url)
+            resultados = {"efectos": {}, "pipeline": {}}
+            for resolucion in resoluciones:
+                size = RESOLUCIONES[resolucion]
+                for efecto in EFECTOS_SUITE:
+                    resultados["efectos"][f"{efecto}@{resolucion}"] = _en_proceso_aparte(medir_efecto, entorno, efecto, size)
+                resultados["pipeline"][f"{perfil}@{resolucion}"] = _en_proceso_aparte(medir_pipeline, entorno, size, perfil)
+            return resultados
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+# ==============================================================================
+# === PARIDAD ENTRE LOS MOTORES DE MOVIEPY Y FFMPEG                          ===
+# ==============================================================================
+
+def _texto_paridad(posicion):
+    return {"text_overlays": [{"text": "Paridad", "start_time": 0.0, "duration": DURACION_NARRACION + 1,
+                               "position": posicion, "style": {"fontsize": 64, "color": "white"},
+                               "background": {"padding": 20, "bg_color": [0, 0, 0], "bg_opacity": 0.6}}]}
+
+
+# Solo lo que ambos motores saben hacer: el motor ffmpeg no traduce grano ni animaciones de texto
+CASOS_PARIDAD = {
+    "ninguno": {},
+    "ken_burns_in": {"visual_effects": [{"type": "ken_burns", "params": {"zoom_dir": "in", "pan_dir": "derecha"}}]},
+    "ken_burns_out": {"visual_effects": [{"type": "ken_burns", "params": {"zoom_dir": "out", "pan_dir": "arriba"}}]},
+    "vignette": {"visual_effects": [{"type": "vignette"}]},
+    "color_correction": {"visual_effects": [{"type": "color_correction", "params": {"contraste": 0.2, "saturacion": 0.8}}]},
+    "color_grade": {"visual_effects": [{"type": "color_grade", "params": {"contraste": 0.2, "brillo": 10, "filtro": "sepia"}}]},
+    **{f"texto_{posicion}": _texto_paridad(posicion) for posicion in ("center", "top", "bottom", "left", "right")},
+}
+
+
+def psnr(a, b):
+    """PSNR (dB) entre dos frames RGB uint8."""
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float('inf') if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+
+
+def _referencia_cubrir(ruta, size):
+    """La imagen escalada para cubrir `size` y recortada al centro: el encuadre que deben dar ambos motores."""
+    from PIL import Image
+    with Image.open(ruta) as imagen:
+        escala = max(size[0] / imagen.width, size[1] / imagen.height)
+        w, h = max(size[0], round(imagen.width * escala)), max(size[1], round(imagen.height * escala))
+        x, y = (w - size[0]) // 2, (h - size[1]) // 2
+        return np.asarray(imagen.convert('RGB').resize((w, h), Image.BILINEAR).crop((x, y, x + size[0], y + size[1])))
+
+
+def medir_paridad(entorno, caso, size, tiempos=(0.5, 1.5, 2.5)):
+    """
+    PSNR mínimo, en `tiempos`, entre la escena compuesta por moviepy y la renderizada por
+    ffmpeg. Sin efectos, ambos se comparan también con el encuadre de referencia.
+    """
+    from moviepy.editor import VideoFileClip
+    from ffmpeg_backend import renderizar_con_ffmpeg
+    app = entorno.app
+    receta = CASOS_PARIDAD[caso]
+    escena = {"id": "p", "mediaUrl": f"{entorno.url_base}/imagen_4x3.png", "audioUrl": f"{entorno.url_base}/narracion_0.wav"}
+    rutas, _ = app.CACHE_MEDIOS.prefetch([escena["mediaUrl"], escena["audioUrl"]])
+    clip = app.componer_escena("paridad", 0, escena, receta, rutas, size, FPS_MEDICION)
+    tmp_dir = tempfile.mkdtemp(dir=entorno.directorio)
+    ruta = renderizar_con_ffmpeg([{"media_path": rutas[escena["mediaUrl"]], "media_type": "image",
+                                   "audio_path": rutas[escena["audioUrl"]], "duracion": clip.duration, "receta": receta}],
+                                 os.path.join(tmp_dir, f"{caso}.mp4"), size, FPS_MEDICION, tmp_dir, preset="ultrafast", crf=10)
+    with VideoFileClip(ruta, audio=False) as video:
+        pares = [(clip.get_frame(t), video.get_frame(t)) for t in tiempos]
+    if not receta:
+        referencia = _referencia_cubrir(rutas[escena["mediaUrl"]], size)
+        pares += [(referencia, frame) for par in pares for frame in par]
+    return min(psnr(a, b) for a, b in pares)
+
+
+def ejecutar_paridad(resolucion="720p"):
+    directorio = tempfile.mkdtemp(prefix="bench_paridad_")
+    try:
+        generar_medios(os.path.join(directorio, "medios"))
+        with ServidorLocal(os.path.join(directorio, "medios")) as servidor:
+            entorno = _Entorno(directorio, servidor.url)
+            return {caso: medir_paridad(entorno, caso, RESOLUCIONES[resolucion]) for caso in CASOS_PARIDAD}
+    finally:
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def main_paridad(argv):
+    parser = argparse.ArgumentParser(prog="benchmarks.py paridad")
+    parser.add_argument("--resolucion", default="720p")
+    parser.add_argument("--umbral", type=float, default=28.0, help="PSNR mínimo (dB) entre motores")
+    args = parser.parse_args(argv)
+
+    fallos = 0
+    for caso, db in ejecutar_paridad(args.resolucion).items():
+        ok = db >= args.umbral
+        fallos += not ok
+        print(f"{caso:18s} PSNR {db:6.1f} dB   {'ok' if ok else 'DIFERENTE'}")
+    return 1 if fallos else 0
+
+
+def comparar_con_base(resultados, base, tolerancia):
+    """Lista de regresiones: fps por debajo de base*(1-tol) o RSS por encima de base*(1+tol)."""
+    regresiones = []
+    for grupo, medidas in base.items():
+        for nombre, ref in medidas.items():
+            actual = resultados.get(grupo, {}).get(nombre)
+            if actual is None:
+                continue
+            if actual["fps"] < ref["fps"] * (1 - tolerancia):
+                regresiones.append(f"{grupo}/{nombre}: {actual['fps']:.1f} fps < base {ref['fps']:.1f} fps")
+            if actual["rss_mb"] > ref["rss_mb"] * (1 + tolerancia):
+                regresiones.append(f"{grupo}/{nombre}: {actual['rss_mb']:.0f} MB > base {ref['rss_mb']:.0f} MB")
+    return regresiones
+
+
+def main_suite(argv):
+    parser = argparse.ArgumentParser(prog="benchmarks.py suite")
+    parser.add_argument("--resoluciones", default="720p,1080p")
+    parser.add_argument("--perfil", default="standard")
+    parser.add_argument("--base", default="benchmarks_base.json")
+    parser.add_argument("--guardar-base", action="store_true", help="guarda los resultados como nueva base")
+    parser.add_argument("--tolerancia", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    resultados = ejecutar_suite(tuple(args.resoluciones.split(",")), args.perfil)
+    for grupo, medidas in resultados.items():
+        for nombre, r in medidas.items():
+            print(f"{grupo:9s} {nombre:28s} {r['fps']:8.1f} fps   pico RSS {r['rss_mb']:7.0f} MB")
+
+    if args.guardar_base:
+        with open(args.base, 'w') as f:
+            json.dump(resultados, f, indent=2, sort_keys=True)
+        print(f"Base guardada en {args.base}.")
+        return 0
+    if not os.path.exists(args.base):
+        # Sin base no hay con qué comparar: se informa como fallo y no como un aprobado silencioso
+        print(f"ERROR: No existe la base {args.base}; no se han comprobado regresiones. Usa --guardar-base para crearla.")
+        return 2
+    with open(args.base) as f:
+        regresiones = comparar_con_base(resultados, json.load(f), args.tolerancia)
+    for regresion in regresiones:
+        print(f"REGRESIÓN: {regresion}")
+    return 1 if regresiones else 0
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ["suite"]:
+        sys.exit(main_suite(sys.argv[2:]))
+    if sys.argv[1:2] == ["paridad"]:
+        sys.exit(main_paridad(sys.argv[2:]))
+    for nombre in sys.argv[1:] or BENCHMARKS:
+        for variante, r in BENCHMARKS[nombre]().items():
+            print(f"{nombre:10s} {variante:10s} construcción {r['construccion_ms']:8.1f} ms   por frame {r['por_frame_ms']:8.2f} ms")
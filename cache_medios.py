@@ -0,0 +1,316 @@
+# cache_medios.py
+# Caché en disco de medios descargados (imágenes, videos, narraciones) direccionada
+# por contenido, con expulsión LRU acotada por tamaño y prefetch concurrente.
+
+import os
+import json
+import fcntl
+import hashlib
+import logging
+import time
+import tempfile
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+TAMANO_CHUNK = 1024 * 1024
+
+
+def hash_texto(texto):
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+
+class CacheDiscoLRU:
+    """
+    Directorio de archivos con un tope de bytes. El mtime de cada archivo hace de
+    marca LRU; las inserciones y expulsiones se serializan con un lock de archivo
+    para que varios procesos (workers de gunicorn, pool de render) compartan la caché.
+    Las entradas usadas hace menos de `gracia_segundos` no se expulsan: pueden estar
+    en uso por un render en curso, así que el tope puede superarse temporalmente. Tampoco
+    las que tienen más de un enlace: un espacio de trabajo las tiene fijadas (ver
+    espacio_trabajo.py).
+    """
+
+    def __init__(self, directorio, max_bytes, gracia_segundos=300, edad_temporales=3600):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self.gracia_segundos = gracia_segundos
+        # Temporales de escrituras que no terminaron (proceso muerto a mitad de una descarga)
+        self.edad_temporales = edad_temporales
+        os.makedirs(directorio, exist_ok=True)
+        self._lock_path = os.path.join(directorio, ".lock")
+
+    @contextmanager
+    def _bloqueo(self, ruta_lock=None):
+        with open(ruta_lock or self._lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def bloqueo_clave(self, clave, franjas=64):
+        """
+        Lock entre procesos para producir una sola vez la entrada `clave` cuando varios
+        trabajos la piden a la vez. Las claves se reparten en `franjas` archivos de lock
+        para no dejar uno por clave.
+        """
+        franja = int(hashlib.sha256(clave.encode('utf-8')).hexdigest()[:8], 16) % franjas
+        return self._bloqueo(os.path.join(self.directorio, f".lock_{franja:02d}"))
+
+    def ruta(self, clave):
+        return os.path.join(self.directorio, clave)
+
+    def obtener(self, clave):
+        """Devuelve la ruta del archivo si está en caché (y lo marca como usado), o None."""
+        ruta = self.ruta(clave)
+        try:
+            os.utime(ruta)
+        except FileNotFoundError:
+            return None
+        return ruta
+
+    def archivo_temporal(self):
+        """Crea un archivo temporal en el mismo sistema de archivos (para os.replace atómico)."""
+        fd, ruta_tmp = tempfile.mkstemp(dir=self.directorio, prefix=".tmp_")
+        os.close(fd)
+        return ruta_tmp
+
+    def guardar(self, clave, ruta_tmp):
+        """Mueve `ruta_tmp` a la caché bajo `clave` y expulsa lo menos usado si se supera el tope."""
+        ruta = self.ruta(clave)
+        with self._bloqueo():
+            os.replace(ruta_tmp, ruta)
+            self._expulsar(proteger=ruta)
+        return ruta
+
+    def tamano_total(self):
+        return sum(tamano for _, _, tamano, _ in self._entradas())
+
+    def _entradas(self):
+        entradas = []
+        for nombre in os.listdir(self.directorio):
+            if nombre.startswith('.'):
+                continue
+            ruta = os.path.join(self.directorio, nombre)
+            try:
+                st = os.stat(ruta)
+            except FileNotFoundError:
+                continue
+            entradas.append((st.st_mtime, ruta, st.st_size, st.st_nlink))
+        return entradas
+
+    def _limpiar_temporales(self):
+        limite = time.time() - self.edad_temporales
+        for nombre in os.listdir(self.directorio):
+            if not nombre.startswith('.tmp_'):
+                continue
+            ruta = os.path.join(self.directorio, nombre)
+            try:
+                if os.stat(ruta).st_mtime < limite:
+                    os.remove(ruta)
+                    logging.info(f"CACHÉ: Borrado temporal abandonado {nombre}.")
+            except FileNotFoundError:
+                pass
+
+    def _expulsar(self, proteger=None):
+        self._limpiar_temporales()
+        entradas = sorted(self._entradas())
+        total = sum(tamano for _, _, tamano, _ in entradas)
+        limite_gracia = time.time() - self.gracia_segundos
+        for mtime, ruta, tamano, enlaces in entradas:
+            if total <= self.max_bytes or mtime > limite_gracia:
+                break
+            if ruta == proteger or enlaces > 1:
+                continue
+            try:
+                os.remove(ruta)
+                total -= tamano
+                logging.info(f"CACHÉ: Expulsado {os.path.basename(ruta)} ({tamano} bytes).")
+            except FileNotFoundError:
+                pass
+
+
+def crear_sesion_http(pool_maxsize=16, reintentos=3):
+    """Sesión HTTP con pool de conexiones keep-alive y reintentos con backoff."""
+    sesion = requests.Session()
+    adaptador = HTTPAdapter(
+        pool_connections=pool_maxsize,
+        pool_maxsize=pool_maxsize,
+        max_retries=Retry(total=reintentos, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504)),
+    )
+    sesion.mount("http://", adaptador)
+    sesion.mount("https://", adaptador)
+    return sesion
+
+
+class CacheMedios:
+    """
+    Caché de descargas direccionada por contenido: los bytes se guardan bajo su sha256
+    en 'blobs/' y cada URL apunta a su hash (y ETag) en 'urls/'. Dos URLs con el mismo
+    contenido comparten un único archivo.
+
+    Con `revalidar`, una URL ya en caché se comprueba contra el origen con un GET
+    condicional (If-None-Match / If-Modified-Since): un asset sobrescrito en la misma URL
+    se vuelve a descargar y cambia de hash, y con él las claves de los segmentos que lo
+    usan. Durante `ttl_revalidacion` segundos tras una comprobación se sirve sin preguntar
+    (p.ej. la precarga de un lote seguida del trabajo, o varias escenas con el mismo audio).
+    """
+
+    def __init__(self, directorio, max_bytes, workers=8, revalidar=True, ttl_revalidacion=60):
+        self.blobs = CacheDiscoLRU(os.path.join(directorio, "blobs"), max_bytes)
+        self.urls_dir = os.path.join(directorio, "urls")
+        os.makedirs(self.urls_dir, exist_ok=True)
+        self.workers = workers
+        self.revalidar = revalidar
+        self.ttl_revalidacion = ttl_revalidacion
+        self.sesion = crear_sesion_http(pool_maxsize=workers)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def estadisticas(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def _contar(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _leer_indice(self, url):
+        try:
+            with open(os.path.join(self.urls_dir, hash_texto(url)), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _escribir_indice(self, url, entrada):
+        ruta = os.path.join(self.urls_dir, hash_texto(url))
+        ruta_tmp = f"{ruta}.{os.getpid()}.{threading.get_ident()}"
+        with open(ruta_tmp, 'w') as f:
+            json.dump(entrada, f)
+        os.replace(ruta_tmp, ruta)
+
+    def hash_de(self, url):
+        """Hash de contenido de una URL ya descargada (o None)."""
+        entrada = self._leer_indice(url)
+        return entrada['sha256'] if entrada else None
+
+    def _vigente(self, entrada):
+        """Si la copia en caché de una entrada del índice puede servirse sin revalidar."""
+        if not self.revalidar:
+            return True
+        return time.time() - entrada.get('validado', 0) < self.ttl_revalidacion
+
+    def _obtener(self, url):
+        """Devuelve (ruta_local, fue_hit)."""
+        entrada = self._leer_indice(url)
+        if entrada and self._vigente(entrada):
+            ruta = self.blobs.obtener(entrada['sha256'])
+            if ruta:
+                return ruta, True
+        # Una sola descarga por URL aunque la pidan a la vez varios trabajos (p.ej. de un lote):
+        # quien espera el lock encuentra después el archivo ya en caché
+        with self.blobs.bloqueo_clave(hash_texto(url)):
+            return self._descargar(url)
+
+    def _descargar(self, url):
+        entrada = self._leer_indice(url)
+        headers = {}
+        copia = self.blobs.obtener(entrada['sha256']) if entrada else None
+        if copia:
+            if self._vigente(entrada):
+                return copia, True
+            if entrada.get('etag'):
+                headers['If-None-Match'] = entrada['etag']
+            if entrada.get('last_modified'):
+                headers['If-Modified-Since'] = entrada['last_modified']
+
+        ruta_tmp = self.blobs.archivo_temporal()
+        try:
+            try:
+                respuesta = self.sesion.get(url, stream=True, headers=headers, timeout=(10, 120))
+            except requests.RequestException as e:
+                if not copia:
+                    raise
+                # El origen no responde: mejor la copia en caché que fallar el trabajo
+                logging.warning(f"No se pudo revalidar {url} ({e}). Se usa la copia en caché.")
+                os.remove(ruta_tmp)
+                return copia, True
+            with respuesta as r:
+                if r.status_code == 304:
+                    os.remove(ruta_tmp)
+                    self._escribir_indice(url, {**entrada, "validado": time.time()})
+                    return copia, True
+                r.raise_for_status()
+                digest = hashlib.sha256()
+                with open(ruta_tmp, 'wb') as f:
+                    for chunk in r.iter_content(chunk_size=TAMANO_CHUNK):
+                        digest.update(chunk)
+                        f.write(chunk)
+                etag = r.headers.get('ETag')
+                last_modified = r.headers.get('Last-Modified')
+            sha = digest.hexdigest()
+            ruta = self.blobs.guardar(sha, ruta_tmp)
+            self._escribir_indice(url, {"sha256": sha, "etag": etag, "last_modified": last_modified,
+                                        "validado": time.time()})
+            return ruta, False
+        except Exception:
+            # Nunca dejar descargas parciales en la caché
+            if os.path.exists(ruta_tmp):
+                os.remove(ruta_tmp)
+            raise
+
+    def obtener(self, url):
+        """Devuelve la ruta local del contenido de `url`, descargándolo solo si no está en caché."""
+        try:
+            ruta, hit = self._obtener(url)
+        except Exception as e:
+            logging.error(f"Error descargando {url}: {e}", exc_info=True)
+            raise
+        self._contar(hit)
+        return ruta
+
+    def _obtener_cronometrado(self, url):
+        inicio = time.perf_counter()
+        ruta, hit = self._obtener(url)
+        return ruta, hit, time.perf_counter() - inicio
+
+    def prefetch(self, urls):
+        """
+        Descarga concurrentemente todas las URLs (sin duplicados).
+        Devuelve ({url: ruta_local}, {"hits": n, "misses": n, "segundos": {url: s}}) para esta llamada.
+        """
+        unicas = list(dict.fromkeys(u for u in urls if u))
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(unicas)))) as pool:
+            resultados = list(pool.map(self._obtener_cronometrado, unicas))
+        rutas, estadisticas = {}, {"hits": 0, "misses": 0, "segundos": {}}
+        for url, (ruta, hit, segundos) in zip(unicas, resultados):
+            rutas[url] = ruta
+            estadisticas["hits" if hit else "misses"] += 1
+            estadisticas["segundos"][url] = segundos
+            self._contar(hit)
+        return rutas, estadisticas
+
+
+def cache_medios_del_entorno():
+    """
+    CacheMedios configurada con MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_MB, MEDIA_PREFETCH_WORKERS,
+    MEDIA_CACHE_REVALIDATE ("0" sirve lo cacheado sin preguntar al origen) y
+    MEDIA_CACHE_REVALIDATE_TTL: todos los workers de render (trabajos y precargas de lotes)
+    comparten la misma caché en disco.
+    """
+    return CacheMedios(
+        os.getenv("MEDIA_CACHE_DIR", "/tmp/media_cache"),
+        max_bytes=int(os.getenv("MEDIA_CACHE_MAX_MB", "2048")) * 1024 * 1024,
+        workers=int(os.getenv("MEDIA_PREFETCH_WORKERS", "8")),
+        revalidar=os.getenv("MEDIA_CACHE_REVALIDATE", "1") == "1",
+        ttl_revalidacion=float(os.getenv("MEDIA_CACHE_REVALIDATE_TTL", "60")),
+    )
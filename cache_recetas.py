@@ -0,0 +1,120 @@
+# cache_recetas.py
+# Memoización de recetas generadas por la IA y caché con TTL del catálogo de SFX.
+
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from cache_medios import CacheDiscoLRU
+
+
+def clave_receta(scenes_data, style, version_prompt, version_catalogo):
+    """Hash estable de todo lo que determina una receta."""
+    contenido = json.dumps(
+        {"scenes": scenes_data, "style": style, "prompt": version_prompt, "catalogo": version_catalogo},
+        sort_keys=True, ensure_ascii=False, separators=(',', ':'),
+    )
+    return hashlib.sha256(contenido.encode('utf-8')).hexdigest()
+
+
+class CacheRecetasMemoria:
+    """LRU en memoria del proceso. Rápida, pero se pierde al reiniciar."""
+
+    def __init__(self, max_entradas=256):
+        self.max_entradas = max_entradas
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self._lock:
+            receta = self._datos.get(clave)
+            if receta is not None:
+                self._datos.move_to_end(clave)
+            return receta
+
+    def guardar(self, clave, receta):
+        with self._lock:
+            self._datos[clave] = receta
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+
+class CacheRecetasDisco:
+    """Recetas como archivos JSON en disco: sobreviven a reinicios y se comparten entre workers."""
+
+    def __init__(self, directorio, max_bytes=64 * 1024 * 1024):
+        self._cache = CacheDiscoLRU(directorio, max_bytes)
+
+    def obtener(self, clave):
+        ruta = self._cache.obtener(f"{clave}.json")
+        if not ruta:
+            return None
+        try:
+            with open(ruta, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def guardar(self, clave, receta):
+        ruta_tmp = self._cache.archivo_temporal()
+        with open(ruta_tmp, 'w', encoding='utf-8') as f:
+            json.dump(receta, f, ensure_ascii=False)
+        self._cache.guardar(f"{clave}.json", ruta_tmp)
+
+
+class CacheRecetasNula:
+    """Desactiva la memoización."""
+
+    def obtener(self, clave):
+        return None
+
+    def guardar(self, clave, receta):
+        pass
+
+
+def crear_cache_recetas(backend, directorio=None, max_entradas=256):
+    """Fábrica del backend de recetas: 'memoria', 'disco' o 'ninguno'."""
+    if backend == 'disco':
+        return CacheRecetasDisco(directorio or "/tmp/recipe_cache")
+    if backend == 'memoria':
+        return CacheRecetasMemoria(max_entradas)
+    return CacheRecetasNula()
+
+
+class CatalogoSFX:
+    """
+    Catálogo de efectos de sonido guardado en GCS. Se descarga una vez y se reutiliza
+    durante `ttl` segundos; pasado el TTL solo se consultan los metadatos del blob y se
+    vuelve a descargar únicamente si cambió su ETag.
+    """
+
+    def __init__(self, obtener_blob, ttl=300):
+        self.obtener_blob = obtener_blob
+        self.ttl = ttl
+        self._catalogo = None
+        self._etag = None
+        self._validado_en = 0
+        self._lock = threading.Lock()
+
+    def obtener(self):
+        """Devuelve (catalogo, version). Si GCS falla se sirve la última copia conocida."""
+        with self._lock:
+            if self._catalogo is not None and time.time() - self._validado_en < self.ttl:
+                return self._catalogo, self._etag
+            try:
+                blob = self.obtener_blob()
+                blob.reload()
+                if self._catalogo is None or blob.etag != self._etag:
+                    self._catalogo = json.loads(blob.download_as_bytes())
+                    self._etag = blob.etag
+                    logging.info(f"CATÁLOGO SFX: Descargado (etag {self._etag}).")
+                self._validado_en = time.time()
+            except Exception as e:
+                if self._catalogo is None:
+                    raise
+                logging.warning(f"CATÁLOGO SFX: No se pudo revalidar ({e}). Se usa la copia en caché.")
+            return self._catalogo, self._etag
@@ -0,0 +1,164 @@
+# compositor.py
+# Compositor plano de escenas: en lugar de un CompositeVideoClip (que por frame y por capa
+# copia el lienzo entero, mezcla en float y compone además una máscara de la escena), la
+# escena se resuelve a un fondo opaco y una lista ordenada de capas con su caja en el
+# lienzo y alfa premultiplicado. Las capas estáticas se preparan una sola vez y cada frame
+# mezcla solo la caja de cada capa sobre un buffer de salida reutilizado.
+
+import numpy as np
+from moviepy.editor import VideoClip
+
+POSICIONES = {'center': ('center', 'center'), 'left': ('left', 'center'), 'right': ('right', 'center'),
+               'top': ('center', 'top'), 'bottom': ('center', 'bottom')}
+
+
+def resolver_posicion(posicion, tamano, lienzo):
+    """Esquina superior izquierda de una capa de `tamano` en `lienzo`, con las mismas reglas que set_position de moviepy."""
+    if isinstance(posicion, str):
+        posicion = POSICIONES[posicion]
+    x, y = posicion
+    if isinstance(x, str):
+        x = {'left': 0, 'center': (lienzo[0] - tamano[0]) / 2, 'right': lienzo[0] - tamano[0]}[x]
+    if isinstance(y, str):
+        y = {'top': 0, 'center': (lienzo[1] - tamano[1]) / 2, 'bottom': lienzo[1] - tamano[1]}[y]
+    return int(x), int(y)
+
+
+def premultiplicar(rgb, alfa):
+    """
+    Pesos en punto fijo (x256) para destino * inverso + color: color (h, w, 3) uint16 ya
+    multiplicado por el alfa e inverso (h, w, 1) uint16. `alfa` es uint8 (0-255, de un
+    raster RGBA) o float (0-1, de una máscara de moviepy).
+    """
+    if alfa.dtype == np.uint8:
+        peso = (alfa.astype(np.uint16) * 256 + 127) // 255
+    else:
+        peso = np.round(np.clip(alfa, 0, 1) * 256).astype(np.uint16)
+    peso = peso[..., None]
+    return rgb.astype(np.uint16) * peso, 256 - peso
+
+
+def _recorte(x, y, w, h, lienzo):
+    """(caja en el lienzo, caja en la capa) de la parte visible de la capa, o None si queda fuera."""
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + w, lienzo[0]), min(y + h, lienzo[1])
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return (slice(y0, y1), slice(x0, x1)), (slice(y0 - y, y1 - y), slice(x0 - x, x1 - x))
+
+
+def _mezclar(destino, color, inverso, acumulador):
+    """destino = (destino * inverso + color) >> 8, en el sitio y sin reservar memoria."""
+    np.multiply(destino, inverso, out=acumulador)
+    np.add(acumulador, color, out=acumulador)
+    np.right_shift(acumulador, 8, out=acumulador)
+    np.copyto(destino, acumulador, casting='unsafe')
+
+
+class CapaEstatica:
+    """Raster RGBA fijo (un texto ya dibujado) visible en [inicio, fin): se recorta al lienzo y se premultiplica una sola vez."""
+
+    estatica = True
+
+    def __init__(self, rgba, posicion, inicio, fin, lienzo):
+        self.inicio, self.fin = inicio, fin
+        h, w = rgba.shape[:2]
+        recorte = _recorte(*resolver_posicion(posicion, (w, h), lienzo), w, h, lienzo)
+        self.caja = None
+        if recorte:
+            self.caja, en_capa = recorte
+            self.color, self.inverso = premultiplicar(rgba[en_capa][..., :3], rgba[en_capa][..., 3])
+            self.acumulador = np.empty(self.color.shape, dtype=np.uint16)
+
+    def mezclar(self, buffer, t):
+        if self.caja is not None:
+            _mezclar(buffer[self.caja], self.color, self.inverso, self.acumulador)
+
+
+class CapaDinamica:
+    """
+    Clip con máscara que cambia con el tiempo (popup, máquina de escribir) visible en
+    [inicio, fin). Solo se vuelve a premultiplicar cuando el clip devuelve otros arrays:
+    la máquina de escribir repite los suyos mientras no aparece una letra nueva.
+    """
+
+    estatica = False
+
+    def __init__(self, clip, posicion, inicio, fin, lienzo):
+        self.clip, self.posicion, self.lienzo = clip, posicion, lienzo
+        self.inicio, self.fin = inicio, fin
+        self._origen = (None, None)
+        self._preparada = None
+
+    def _preparar(self, t):
+        rgb = self.clip.get_frame(t - self.inicio)
+        alfa = self.clip.mask.get_frame(t - self.inicio)
+        if self._origen[0] is rgb and self._origen[1] is alfa:
+            return self._preparada
+        h, w = rgb.shape[:2]
+        recorte = _recorte(*resolver_posicion(self.posicion, (w, h), self.lienzo), w, h, self.lienzo)
+        self._preparada = None
+        if recorte:
+            caja, en_capa = recorte
+            color, inverso = premultiplicar(rgb[en_capa], alfa[en_capa])
+            self._preparada = (caja, color, inverso, np.empty(color.shape, dtype=np.uint16))
+        self._origen = (rgb, alfa)
+        return self._preparada
+
+    def mezclar(self, buffer, t):
+        preparada = self._preparar(t)
+        if preparada:
+            caja, color, inverso, acumulador = preparada
+            _mezclar(buffer[caja], color, inverso, acumulador)
+
+
+class CompositorPlano:
+    """
+    Frame de la escena = `fondo` (clip opaco del tamaño del lienzo) + `capas` en orden.
+    Con `fondo_estatico` (imagen fija con efectos estáticos) el fondo se genera una sola
+    vez y se guarda ya mezclado con las capas estáticas activas que queden por debajo de
+    la primera dinámica: cada frame solo mezcla lo que hay encima.
+
+    El frame devuelto es un buffer reutilizado: quien necesite conservarlo debe copiarlo.
+    """
+
+    def __init__(self, fondo, capas, lienzo, fondo_estatico=False):
+        self.fondo = fondo
+        self.capas = capas
+        self.fondo_estatico = fondo_estatico
+        self.buffer = np.empty((lienzo[1], lienzo[0], 3), dtype=np.uint8)
+        self._fondo = None  # frame del fondo estático, generado una sola vez
+        self._base = None   # fondo + prefijo de capas estáticas activas
+        self._clave_base = None
+
+    def _copiar_fondo(self, destino, t):
+        np.copyto(destino, self.fondo.get_frame(t), casting='unsafe')
+
+    def frame(self, t):
+        activas = [capa for capa in self.capas if capa.inicio <= t < capa.fin]
+        if not self.fondo_estatico:
+            if not activas:
+                return self.fondo.get_frame(t)
+            self._copiar_fondo(self.buffer, t)
+        else:
+            n = next((k for k, capa in enumerate(activas) if not capa.estatica), len(activas))
+            clave = tuple(id(capa) for capa in activas[:n])
+            if clave != self._clave_base:
+                if self._base is None:
+                    self._fondo = np.empty_like(self.buffer)
+                    self._copiar_fondo(self._fondo, 0)
+                    self._base = np.empty_like(self.buffer)
+                np.copyto(self._base, self._fondo)
+                for capa in activas[:n]:
+                    capa.mezclar(self._base, t)
+                self._clave_base = clave
+            activas = activas[n:]
+            if not activas:
+                return self._base
+            np.copyto(self.buffer, self._base)
+        for capa in activas:
+            capa.mezclar(self.buffer, t)
+        return self.buffer
+
+    def clip(self, duracion):
+        return VideoClip(self.frame, duration=duracion)
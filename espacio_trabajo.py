@@ -0,0 +1,197 @@
+# espacio_trabajo.py
+# Directorios de trabajo temporales con cuota de disco. Cada trabajo reserva los bytes
+# que calcula que va a escribir (WAV, segmentos, video final) y, si la reserva no cabe en
+# la cuota global, espera a que otros trabajos liberen espacio en lugar de llenar el disco
+# y fallar a mitad. Los medios de entrada no se copian: el espacio de trabajo guarda un
+# hardlink a cada archivo de las cachés compartidas que usa, y la caché no expulsa los
+# archivos enlazados (ver CacheDiscoLRU) hasta que el trabajo los suelta.
+
+import os
+import json
+import time
+import shutil
+import fcntl
+import logging
+from contextlib import contextmanager
+
+from cache_medios import hash_texto
+
+
+class SinEspacio(Exception):
+    """La reserva no cupo en la cuota de disco dentro del tiempo de espera."""
+
+
+def proceso_vivo(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def bytes_en_disco(directorio):
+    """
+    Bytes propios de un directorio de trabajo. Los archivos con más de un enlace (los
+    hardlinks a las cachés) no cuentan: ese espacio ya lo contabiliza su caché.
+    """
+    total = 0
+    for raiz, _, archivos in os.walk(directorio):
+        for nombre in archivos:
+            try:
+                st = os.lstat(os.path.join(raiz, nombre))
+            except FileNotFoundError:
+                continue
+            if st.st_nlink == 1:
+                total += st.st_blocks * 512
+    return total
+
+
+class GestorEspacios:
+    """
+    Espacios de trabajo bajo `raiz`, compartidos por todos los procesos de la máquina. Las
+    reservas viven en `raiz/.reservas` (una por espacio, con el pid de su dueño) y se
+    leen y escriben bajo un lock de archivo; las de procesos muertos se descartan y sus
+    directorios se borran.
+    """
+
+    def __init__(self, raiz, cuota_bytes, espera_max=1800, intervalo=2.0):
+        self.raiz = raiz
+        self.cuota_bytes = cuota_bytes
+        self.espera_max = espera_max
+        self.intervalo = intervalo
+        self._reservas = os.path.join(raiz, ".reservas")
+        os.makedirs(self._reservas, exist_ok=True)
+        self._lock_path = os.path.join(raiz, ".lock")
+
+    @contextmanager
+    def _bloqueo(self):
+        with open(self._lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _leer_reservas(self):
+        """{nombre: (pid, bytes)} de los espacios vivos. Borra los de procesos que ya no existen."""
+        reservas = {}
+        for nombre in os.listdir(self._reservas):
+            ruta = os.path.join(self._reservas, nombre)
+            try:
+                with open(ruta) as f:
+                    reserva = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+            if proceso_vivo(reserva['pid']):
+                reservas[nombre] = (reserva['pid'], reserva['bytes'])
+                continue
+            logging.warning(f"ESPACIO: Se borra el espacio huérfano '{nombre}' (proceso {reserva['pid']} terminado).")
+            shutil.rmtree(os.path.join(self.raiz, nombre), ignore_errors=True)
+            os.remove(ruta)
+        return reservas
+
+    def _cabe(self, n_bytes, reservas):
+        # Cada espacio ocupa lo que reservó o, si se pasó, lo que de verdad lleva escrito
+        usados = {nombre: bytes_en_disco(os.path.join(self.raiz, nombre)) for nombre in reservas}
+        ocupado = sum(max(reserva, usados[nombre]) for nombre, (_, reserva) in reservas.items())
+        pendiente = sum(max(0, reserva - usados[nombre]) for nombre, (_, reserva) in reservas.items())
+        libre = shutil.disk_usage(self.raiz).free
+        return ocupado + n_bytes <= self.cuota_bytes and pendiente + n_bytes <= libre
+
+    def reservar(self, nombre, n_bytes, espera=None, al_esperar=None):
+        """
+        Crea el espacio `nombre` con `n_bytes` reservados, esperando hasta `espera` segundos
+        (por defecto `espera_max`) a que quepa. `al_esperar()` se llama en cada intento
+        fallido. Lanza SinEspacio si se agota la espera.
+        """
+        if n_bytes > self.cuota_bytes:
+            logging.warning(f"ESPACIO: '{nombre}' pide {n_bytes} bytes, más que la cuota; se limita a la cuota.")
+            n_bytes = self.cuota_bytes
+        limite = time.monotonic() + (self.espera_max if espera is None else espera)
+        while True:
+            with self._bloqueo():
+                if self._cabe(n_bytes, self._leer_reservas()):
+                    ruta = os.path.join(self.raiz, nombre)
+                    shutil.rmtree(ruta, ignore_errors=True)  # restos de un intento anterior del mismo trabajo
+                    os.makedirs(ruta)
+                    with open(os.path.join(self._reservas, nombre), 'w') as f:
+                        json.dump({"pid": os.getpid(), "bytes": n_bytes}, f)
+                    return EspacioTrabajo(self, nombre, ruta, n_bytes)
+            if time.monotonic() >= limite:
+                raise SinEspacio(f"No hay {n_bytes / 1e6:.0f} MB libres en la cuota de disco de trabajo.")
+            if al_esperar:
+                al_esperar()
+            time.sleep(self.intervalo)
+
+    def _liberar(self, espacio):
+        with self._bloqueo():
+            shutil.rmtree(espacio.ruta, ignore_errors=True)
+            try:
+                os.remove(os.path.join(self._reservas, espacio.nombre))
+            except FileNotFoundError:
+                pass
+
+
+class EspacioTrabajo:
+    """
+    Directorio de un trabajo con su reserva de bytes. `fijar(ruta)` enlaza un archivo de
+    una caché compartida para que no se expulse mientras se usa y `soltar(ruta)` lo libera
+    (con cuenta de referencias: una misma imagen puede servir a varias escenas).
+    """
+
+    def __init__(self, gestor, nombre, ruta, reservados):
+        self.gestor = gestor
+        self.nombre = nombre
+        self.ruta = ruta
+        self.reservados = reservados
+        self.pico = 0
+        self._fijados = {}
+        self._cerrado = False
+
+    def archivo(self, nombre):
+        return os.path.join(self.ruta, nombre)
+
+    def fijar(self, ruta):
+        if ruta in self._fijados:
+            self._fijados[ruta][1] += 1
+            return
+        enlace = os.path.join(self.ruta, ".fijados", hash_texto(ruta)[:24])
+        os.makedirs(os.path.dirname(enlace), exist_ok=True)
+        try:
+            os.link(ruta, enlace)
+        except OSError as e:
+            # Otro sistema de archivos (o la caché ya lo expulsó): se usa sin fijar
+            logging.warning(f"ESPACIO: No se pudo fijar {ruta} ({e}).")
+            enlace = None
+        self._fijados[ruta] = [enlace, 1]
+
+    def soltar(self, ruta):
+        fijado = self._fijados.get(ruta)
+        if fijado is None:
+            return
+        fijado[1] -= 1
+        if fijado[1] == 0:
+            del self._fijados[ruta]
+            if fijado[0]:
+                os.remove(fijado[0])
+
+    def medir(self):
+        """Bytes escritos ahora mismo en el espacio (y actualiza el pico)."""
+        usados = bytes_en_disco(self.ruta)
+        self.pico = max(self.pico, usados)
+        return usados
+
+    def cerrar(self):
+        """Borra el directorio (en el propio proceso, sin shell) y devuelve la reserva."""
+        if not self._cerrado:
+            self._cerrado = True
+            self.gestor._liberar(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+        return False
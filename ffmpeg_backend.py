@@ -0,0 +1,270 @@
+# ffmpeg_backend.py
+# Motor de render alternativo: traduce la receta de la IA a un único filter_complex
+# de ffmpeg (zoompan, overlay, lut1d, xfade) en lugar de callbacks por
+# frame en Python. Lo que no sabe traducir lanza EfectoNoSoportado y el llamador
+# vuelve al motor de moviepy.
+
+import os
+import logging
+import tempfile
+import subprocess
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image
+from moviepy.config import get_setting
+
+from vfx import mascara_viñeta, tabla_color
+from texto_raster import rasterizar_texto
+from compositor import POSICIONES
+
+TRANSICIONES_XFADE = {
+    ("slide", "izquierda"): "slideleft",
+    ("slide", "derecha"): "slideright",
+    ("slide", "arriba"): "slideup",
+    ("slide", "abajo"): "slidedown",
+    ("crossfade", None): "fade",
+    ("fade", None): "fade",
+}
+
+
+class EfectoNoSoportado(Exception):
+    """La receta usa algo que este motor no sabe traducir a filtros de ffmpeg."""
+
+
+@lru_cache(maxsize=1)
+def filtros_disponibles():
+    """Nombres de los filtros compilados en el binario de ffmpeg (se consulta una sola vez)."""
+    salida = subprocess.run([get_setting("FFMPEG_BINARY"), "-hide_banner", "-filters"],
+                            capture_output=True, text=True).stdout
+    return {partes[1] for partes in (linea.split() for linea in salida.splitlines()) if len(partes) > 2}
+
+
+def _requerir_filtro(nombre):
+    if nombre not in filtros_disponibles():
+        raise EfectoNoSoportado(f"El ffmpeg instalado no incluye el filtro '{nombre}'.")
+
+
+def _png_viñeta(ruta, w, h, radio=0.7, suavizado=0.4, color=(0, 0, 0)):
+    """Escribe la viñeta como PNG RGBA (color + alfa) para superponerla con 'overlay'."""
+    mascara = mascara_viñeta(w, h, float(radio), float(suavizado))
+    rgba = np.empty((h, w, 4), dtype=np.uint8)
+    rgba[..., :3] = np.array(color, dtype=np.uint8)
+    rgba[..., 3] = (mascara * 255).astype(np.uint8)
+    Image.fromarray(rgba, 'RGBA').save(ruta)
+    return ruta
+
+
+def _filtros_color(ruta_cube, brillo=0, contraste=0, saturacion=1.0, tinte=None, filtro=None):
+    """
+    Filtros equivalentes a vfx.aplicar_color (y a aplicar_correccion_color, que es lo mismo
+    sin filtro): la misma tabla escrita como LUT 1D (.cube) para lut1d y, con b&n o sepia,
+    un colorchannelmixer previo que promedia los canales.
+    """
+    if tinte:
+        tinte = (tuple(int(c) for c in tinte[0]), float(tinte[1]))
+    tabla, por_suma = tabla_color(float(brillo), float(contraste), float(saturacion), tinte, filtro)
+    if por_suma:
+        tabla = tabla[:, ::3]  # la suma de un gris g es 3g
+    with open(ruta_cube, 'w') as f:
+        f.write(f"LUT_1D_SIZE {tabla.shape[1]}\n")
+        # lut1d trunca al volver a 8 bits: con un cuarto de nivel de margen sale el valor exacto
+        for r, g, b in (tabla.T + 0.25) / 255.0:
+            f.write(f"{r:.6f} {g:.6f} {b:.6f}\n")
+    filtros = ["colorchannelmixer=" + ":".join([f"{1 / 3:.6f}"] * 3 + ["0"] + [f"{1 / 3:.6f}"] * 3 + ["0"] + [f"{1 / 3:.6f}"] * 3)] if por_suma else []
+    return filtros + [f"lut1d=file={ruta_cube}:interp=nearest"]
+
+
+def _expr_ken_burns(n_frames, zoom_dir='in', pan_dir='derecha', factor_zoom=1.15):
+    """
+    Expresiones z/x/y de zoompan equivalentes a vfx_crear_efecto_ken_burns: el ancho de
+    la ventana de recorte interpola linealmente y su centro va del punto de paneo al centro.
+    """
+    p = f"(on/{n_frames})"
+    if zoom_dir == 'in':
+        ancho_ini, ancho_fin = 1.0, 1.0 / factor_zoom
+    else:
+        ancho_ini, ancho_fin = 1.0 / factor_zoom, 1.0
+    zoom = f"1/({ancho_ini}+({ancho_fin - ancho_ini})*{p})"
+    margen = ancho_fin / 2
+    fx = {'izquierda': margen, 'derecha': 1 - margen}.get(pan_dir, 0.5)
+    fy = {'arriba': margen, 'abajo': 1 - margen}.get(pan_dir, 0.5)
+    x = f"iw*({fx}+({0.5 - fx})*{p})-iw/zoom/2"
+    y = f"ih*({fy}+({0.5 - fy})*{p})-ih/zoom/2"
+    return zoom, x, y
+
+
+def _expr_posicion(posicion):
+    """Traduce set_position de moviepy ('center', ('center','bottom'), (x, y)) a x/y de overlay."""
+    if isinstance(posicion, str):
+        if posicion not in POSICIONES:
+            raise EfectoNoSoportado(f"Posición de texto no soportada: {posicion}")
+        posicion = POSICIONES[posicion]
+    ejes = []
+    for valor, total, tamano in zip(posicion, ('main_w', 'main_h'), ('overlay_w', 'overlay_h')):
+        if isinstance(valor, (int, float)):
+            ejes.append(str(valor))
+        elif valor in ('left', 'top'):
+            ejes.append("0")
+        elif valor in ('right', 'bottom'):
+            ejes.append(f"{total}-{tamano}")
+        elif valor == 'center':
+            ejes.append(f"({total}-{tamano})/2")
+        else:
+            raise EfectoNoSoportado(f"Posición de texto no soportada: {valor}")
+    return ejes
+
+
+def _png_texto(text_info, ruta):
+    """Escribe el raster cacheado del texto (con su fondo) como PNG RGBA: el mismo que usa moviepy."""
+    efecto = (text_info.get('effect') or {}).get('type')
+    if efecto:
+        raise EfectoNoSoportado(f"Animación de texto '{efecto}' no soportada.")
+    raster = rasterizar_texto(text_info['text'], **text_info.get('style', {}), **(text_info.get('background') or {}))
+    Image.fromarray(raster.rgba, 'RGBA').save(ruta)
+    return ruta
+
+
+def compilar_receta(escenas, canvas, fps, tmp_dir, ruta_audio=None):
+    """
+    Traduce las escenas a (argumentos de entrada, filter_complex).
+    Cada escena es un dict con media_path, media_type, audio_path, duracion y receta
+    (y opcionalmente 'solape', los segundos de transición con la siguiente). Con
+    `ruta_audio` la pista ya mezclada sustituye al audio de las escenas.
+    """
+    W, H = canvas
+    entradas, cadenas = [], []
+
+    def nueva_entrada(*args):
+        entradas.extend(args)
+        return len([a for a in entradas if a == '-i']) - 1
+
+    for i, escena in enumerate(escenas):
+        D = escena['duracion']
+        n_frames = max(1, int(round(D * fps)))
+        receta = escena['receta']
+        efectos = receta.get('visual_effects', [])
+        tipos = [e['type'] for e in efectos]
+
+        if escena.get('media_type', 'image') == 'video':
+            k = nueva_entrada('-i', escena['media_path'])
+            filtros = [f"tpad=stop_mode=clone:stop_duration={D:.3f}", f"fps={fps}"]
+        else:
+            k = nueva_entrada('-loop', '1', '-framerate', str(fps), '-t', f"{D:.3f}", '-i', escena['media_path'])
+            filtros = []
+        # Con Ken Burns se trabaja a doble resolución para que zoompan no tiemble
+        w_actual, h_actual = (W * 2, H * 2) if 'ken_burns' in tipos else (W, H)
+        # Cubrir el lienzo conservando la proporción y recortar el centro, como cubrir_lienzo en moviepy
+        filtros += [f"scale={w_actual}:{h_actual}:force_original_aspect_ratio=increase",
+                    f"crop={w_actual}:{h_actual}", "setsar=1"]
+        etiqueta = f"[{k}:v]"
+        paso = 0
+
+        def cerrar(filtros, etiqueta):
+            nonlocal paso
+            if not filtros:
+                return etiqueta
+            salida = f"[e{i}_{paso}]"
+            paso += 1
+            cadenas.append(f"{etiqueta}{','.join(filtros)}{salida}")
+            return salida
+
+        for e, efecto in enumerate(efectos):
+            params = efecto.get('params', {})
+            if efecto['type'] == 'ken_burns':
+                _requerir_filtro('zoompan')
+                z, x, y = _expr_ken_burns(n_frames, **params)
+                filtros.append(f"zoompan=z='{z}':x='{x}':y='{y}':d=1:s={W}x{H}:fps={fps}")
+                w_actual, h_actual = W, H
+            elif efecto['type'] == 'vignette':
+                ruta_png = _png_viñeta(os.path.join(tmp_dir, f"vineta_{i}_{paso}.png"), w_actual, h_actual, **params)
+                kv = nueva_entrada('-loop', '1', '-framerate', str(fps), '-t', f"{D:.3f}", '-i', ruta_png)
+                etiqueta = cerrar(filtros, etiqueta)
+                cadenas.append(f"{etiqueta}[{kv}:v]overlay=0:0:format=auto[e{i}_{paso}]")
+                etiqueta, filtros = f"[e{i}_{paso}]", []
+                paso += 1
+            elif efecto['type'] in ('color_correction', 'color_grade'):
+                # Misma tabla que moviepy (vfx.tabla_color): los dos motores coinciden al bit
+                _requerir_filtro('lut1d')
+                filtros += _filtros_color(os.path.join(tmp_dir, f"color_{i}_{e}.cube"), **params)
+            else:
+                raise EfectoNoSoportado(f"Efecto visual '{efecto['type']}' no soportado.")
+
+        for j, text_info in enumerate(receta.get('text_overlays', [])):
+            ruta_png = _png_texto(text_info, os.path.join(tmp_dir, f"texto_{i}_{j}.png"))
+            x, y = _expr_posicion(text_info.get('position', 'center'))
+            inicio = text_info.get('start_time', 0)
+            kt = nueva_entrada('-loop', '1', '-framerate', str(fps), '-t', f"{D:.3f}", '-i', ruta_png)
+            etiqueta = cerrar(filtros, etiqueta)
+            cadenas.append(f"{etiqueta}[{kt}:v]overlay=x='{x}':y='{y}':format=auto:"
+                           f"enable='between(t,{inicio},{inicio + text_info['duration']})'[e{i}_{paso}]")
+            etiqueta, filtros = f"[e{i}_{paso}]", []
+            paso += 1
+
+        filtros += [f"trim=duration={D:.3f}", "setpts=PTS-STARTPTS", f"fps={fps}", "format=yuv420p", "settb=AVTB"]
+        cadenas.append(f"{etiqueta}{','.join(filtros)}[v{i}]")
+
+        if not ruta_audio:
+            ka = nueva_entrada('-i', escena['audio_path'])
+            cadenas.append(f"[{ka}:a]aformat=sample_rates=44100:channel_layouts=stereo,apad,"
+                           f"atrim=duration={D:.3f},asetpts=PTS-STARTPTS[a{i}]")
+
+    # Ensamblaje: xfade/acrossfade donde la receta pide transición, concat en el resto
+    v_acum, a_acum, largo = "[v0]", "[a0]", escenas[0]['duracion']
+    for i in range(1, len(escenas)):
+        transicion = escenas[i - 1]['receta'].get('transition_to_next') or {}
+        dur_t = escenas[i - 1].get('solape')
+        if dur_t is None:
+            dur_t = min(float(transicion.get('duration', 0) or 0), escenas[i - 1]['duracion'], escenas[i]['duracion'])
+        if dur_t > 0:
+            tipo = transicion.get('type')
+            _requerir_filtro('xfade')
+            nombre = TRANSICIONES_XFADE.get((tipo, transicion.get('direction', 'izquierda') if tipo == 'slide' else None))
+            if not nombre:
+                raise EfectoNoSoportado(f"Transición '{tipo}' no soportada.")
+            largo -= dur_t
+            cadenas.append(f"{v_acum}[v{i}]xfade=transition={nombre}:duration={dur_t:.3f}:offset={largo:.3f}[vx{i}]")
+            if not ruta_audio:
+                cadenas.append(f"{a_acum}[a{i}]acrossfade=d={dur_t:.3f}[ax{i}]")
+        else:
+            cadenas.append(f"{v_acum}[v{i}]concat=n=2:v=1:a=0[vx{i}]")
+            if not ruta_audio:
+                cadenas.append(f"{a_acum}[a{i}]concat=n=2:v=0:a=1[ax{i}]")
+        v_acum, a_acum = f"[vx{i}]", f"[ax{i}]"
+        largo += escenas[i]['duracion']
+
+    cadenas.append(f"{v_acum}null[vout]")
+    if ruta_audio:
+        ka = nueva_entrada('-i', ruta_audio)
+        cadenas.append(f"[{ka}:a]anull[aout]")
+    else:
+        cadenas.append(f"{a_acum}anull[aout]")
+    return entradas, ";".join(cadenas)
+
+
+def renderizar_con_ffmpeg(escenas, ruta_salida, canvas, fps, tmp_dir, threads=0, movflags="+faststart",
+                          preset="medium", crf=23, ruta_audio=None, al_progresar=None):
+    """
+    Renderiza el video completo con una sola invocación de ffmpeg. `al_progresar(hechos, total)`
+    recibe los frames codificados según el informe de '-progress' de ffmpeg.
+    """
+    entradas, filter_complex = compilar_receta(escenas, canvas, fps, tmp_dir, ruta_audio)
+    comando = [
+        get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error", "-nostats", "-progress", "pipe:1", *entradas,
+        "-filter_complex", filter_complex, "-map", "[vout]", "-map", "[aout]",
+        "-c:v", "libx264", "-preset", preset, "-crf", str(crf), "-pix_fmt", "yuv420p",
+        "-r", str(fps), "-threads", str(threads),
+        "-c:a", "aac", "-ar", "44100", "-movflags", movflags, ruta_salida,
+    ]
+    duracion = sum(e['duracion'] for e in escenas) - sum(e.get('solape') or 0 for e in escenas[:-1])
+    total = max(1, int(round(duracion * fps)))
+    with tempfile.TemporaryFile() as errores:
+        proceso = subprocess.Popen(comando, stdout=subprocess.PIPE, stderr=errores, text=True)
+        for linea in proceso.stdout:
+            if al_progresar and linea.startswith("frame="):
+                al_progresar(min(int(linea.split("=", 1)[1]), total), total)
+        if proceso.wait() != 0:
+            errores.seek(0)
+            logging.error(f"ffmpeg falló: {errores.read().decode(errors='ignore')[-2000:]}")
+            raise subprocess.CalledProcessError(proceso.returncode, comando)
+    return ruta_salida
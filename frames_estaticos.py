@@ -0,0 +1,58 @@
+# frames_estaticos.py
+# Memo de frames estáticos: en los tramos de una escena en los que ninguna capa cambia
+# (imagen fija con viñeta y un texto ya terminado de animar) el frame compuesto es
+# siempre el mismo, así que se compone una vez y se repite en lugar de recomponer todas
+# las capas 24 veces por segundo.
+
+from bisect import bisect_right
+
+import numpy as np
+
+
+def tramos_estaticos(duracion, dinamicos, cortes=()):
+    """
+    Intervalos [inicio, fin) de [0, duracion) sin nada en movimiento. `dinamicos` son los
+    intervalos en los que alguna capa cambia frame a frame y `cortes` los instantes en los
+    que una capa aparece o desaparece (el frame cambia, pero no dentro de cada tramo).
+    """
+    bordes = sorted({0.0, float(duracion)} | {float(c) for c in cortes if 0 < c < duracion}
+                    | {float(x) for a, b in dinamicos for x in (a, b) if 0 < x < duracion})
+    tramos = []
+    for a, b in zip(bordes, bordes[1:]):
+        if not any(da < b and a < db for da, db in dinamicos):
+            tramos.append((a, b))
+    return tramos
+
+
+def _memo(tramos, contador, clave):
+    inicios = [a for a, _ in tramos]
+    ultimo = {"tramo": None, "frame": None}
+
+    def obtener(get_frame, t):
+        i = bisect_right(inicios, t) - 1
+        if i < 0 or t >= tramos[i][1]:
+            contador[clave + "_compuestos"] = contador.get(clave + "_compuestos", 0) + 1
+            return get_frame(t)
+        if ultimo["tramo"] != i:
+            # Solo se guarda el frame del último tramo: los frames se piden en orden. Se copia
+            # porque el compositor plano reutiliza su buffer de salida en el siguiente frame.
+            ultimo.update(tramo=i, frame=np.array(get_frame(t)))
+            contador[clave + "_compuestos"] = contador.get(clave + "_compuestos", 0) + 1
+        else:
+            contador[clave + "_memo"] = contador.get(clave + "_memo", 0) + 1
+        return ultimo["frame"]
+
+    return obtener
+
+
+def memorizar_estaticos(clip, tramos, contador):
+    """
+    Clip que sirve desde la memo los frames (y la máscara) de los `tramos` estáticos.
+    `contador` acumula cuántos frames se compusieron y cuántos salieron de la memo.
+    """
+    if not tramos:
+        return clip
+    nuevo = clip.fl(_memo(tramos, contador, "frames"))
+    if clip.mask is not None:
+        nuevo = nuevo.set_mask(clip.mask.fl(_memo(tramos, {}, "mascara")))
+    return nuevo
@@ -0,0 +1,120 @@
+# ingesta.py
+# Normalización de medios de entrada: antes de componer, cada imagen se decodifica una
+# vez y se reduce al lienzo del trabajo (con el margen que necesite el zoom de Ken Burns)
+# y cada video se recodifica a la resolución y fps de salida. Así el trabajo y la memoria
+# por frame dependen de la resolución de salida y no de la del medio original.
+
+import os
+import math
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+from moviepy.config import get_setting
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+from cache_medios import CacheDiscoLRU, hash_texto
+
+# Subir si cambia cómo se normaliza (invalida lo ya normalizado en caché)
+VERSION_INGESTA = 1
+
+
+def tamano_objetivo(tamano, canvas, margen=1.0):
+    """
+    Tamaño al que reducir un medio de `tamano` para que siga cubriendo `canvas` ampliado
+    por `margen` (p.ej. el factor de zoom de Ken Burns), conservando la proporción y con
+    lados pares. None si el medio ya es igual o más pequeño: nunca se amplía.
+    """
+    w, h = tamano
+    escala = max(canvas[0] * margen / w, canvas[1] * margen / h)
+    if escala >= 1:
+        return None
+    return (min(w, max(2, math.ceil(w * escala / 2) * 2)), min(h, max(2, math.ceil(h * escala / 2) * 2)))
+
+
+def reducir_imagen(ruta, ruta_salida, canvas, margen=1.0):
+    """Escribe en `ruta_salida` (PNG) la imagen reducida. Devuelve False si no hacía falta reducirla."""
+    with Image.open(ruta) as imagen:
+        destino = tamano_objetivo(imagen.size, canvas, margen)
+        if destino is None:
+            return False
+        # En JPEG decodifica directamente a escala 1/2, 1/4 u 1/8 sin pasar por la resolución completa
+        imagen.draft(imagen.mode, destino)
+        if imagen.mode not in ('RGB', 'RGBA'):
+            transparente = imagen.mode in ('LA', 'PA') or 'transparency' in imagen.info
+            imagen = imagen.convert('RGBA' if transparente else 'RGB')
+        imagen.resize(destino, Image.LANCZOS, reducing_gap=3.0).save(ruta_salida, format='PNG', compress_level=1)
+    return True
+
+
+def recodificar_video(ruta, ruta_salida, canvas, fps, margen=1.0):
+    """
+    Escribe en `ruta_salida` el video (sin audio) reducido y a `fps`. Devuelve False si ya
+    tenía como mucho ese tamaño y esos fps.
+    """
+    infos = ffmpeg_parse_infos(ruta)
+    destino = tamano_objetivo(infos['video_size'], canvas, margen)
+    if destino is None and abs(infos.get('video_fps', 0) - fps) < 1e-3:
+        return False
+    filtros = ([f"scale={destino[0]}:{destino[1]}:flags=area"] if destino else []) + [f"fps={fps}"]
+    comando = [
+        get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error", "-i", ruta,
+        "-map", "0:v:0", "-an", "-vf", ",".join(filtros),
+        # Intermedio casi sin pérdidas: se vuelve a codificar al renderizar
+        "-c:v", "libx264", "-preset", "ultrafast", "-crf", "12", "-pix_fmt", "yuv420p",
+        "-f", "mp4", ruta_salida,
+    ]
+    try:
+        subprocess.run(comando, check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        logging.error(f"INGESTA: No se pudo recodificar {ruta}: {e.stderr.decode(errors='ignore')}")
+        raise
+    return True
+
+
+class NormalizadorMedios:
+    """
+    Caché en disco de medios normalizados, por (contenido original, lienzo, margen, fps).
+    Las rutas de la caché de medios ya son por contenido, así que el nombre del archivo
+    original identifica sus bytes.
+    """
+
+    def __init__(self, directorio, max_bytes, workers=4):
+        self.cache = CacheDiscoLRU(directorio, max_bytes)
+        self.workers = workers
+
+    def normalizar(self, ruta, tipo, canvas, fps, margen=1.0):
+        """Ruta del medio normalizado (o la original si ya cabía en el lienzo)."""
+        clave = hash_texto(f"{os.path.basename(ruta)}|{tipo}|{canvas[0]}x{canvas[1]}|{margen:.4f}|{fps}|v{VERSION_INGESTA}")
+        ruta_cacheada = self.cache.obtener(clave)
+        if ruta_cacheada:
+            return ruta_cacheada
+        # Trabajos concurrentes con el mismo medio (p.ej. de un lote) lo normalizan una sola vez
+        with self.cache.bloqueo_clave(clave):
+            return self.cache.obtener(clave) or self._producir(clave, ruta, tipo, canvas, fps, margen)
+
+    def _producir(self, clave, ruta, tipo, canvas, fps, margen):
+        ruta_tmp = self.cache.archivo_temporal()
+        try:
+            if tipo == 'video':
+                reducido = recodificar_video(ruta, ruta_tmp, canvas, fps, margen)
+            else:
+                reducido = reducir_imagen(ruta, ruta_tmp, canvas, margen)
+        except Exception:
+            os.remove(ruta_tmp)
+            raise
+        if not reducido:
+            os.remove(ruta_tmp)
+            return ruta
+        return self.cache.guardar(clave, ruta_tmp)
+
+    def normalizar_todos(self, pedidos, canvas, fps):
+        """
+        `pedidos`: {ruta: (tipo, margen)}. Normaliza en paralelo (PIL y ffmpeg liberan el
+        GIL) y devuelve {ruta_original: ruta_normalizada}.
+        """
+        rutas = list(pedidos)
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(rutas)))) as pool:
+            normalizadas = list(pool.map(lambda r: self.normalizar(r, pedidos[r][0], canvas, fps, pedidos[r][1]), rutas))
+        return dict(zip(rutas, normalizadas))
@@ -0,0 +1,466 @@
+# jobs_store.py
+# Almacén persistente de trabajos en SQLite, visible para los procesos de la API y los
+# del pool de workers de render, y planificador con límite global de renders simultáneos.
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+
+ESTADOS_ACTIVOS = ('pending_brain', 'pending_render', 'downloading', 'processing', 'waiting_disk', 'uploading')
+ESTADOS_FINALES = ('completed', 'error')
+
+
+class ColaLlena(Exception):
+    """La cola de trabajos alcanzó su máximo; la API responde 429."""
+
+
+class JobStore:
+    """
+    Estado de los trabajos en una base SQLite (modo WAL). `data` guarda el JSON
+    público que devuelve /api/job-status y `payload` los datos de entrada del trabajo
+    para que cualquier proceso pueda ejecutarlo.
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._local = threading.local()
+        with self._conexion() as con:
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    payload TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )""")
+            con.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at)")
+            # Proceso del pool que ejecuta el trabajo, para liberarlo si ese worker muere
+            if 'worker_pid' not in {c['name'] for c in con.execute("PRAGMA table_info(jobs)")}:
+                con.execute("ALTER TABLE jobs ADD COLUMN worker_pid INTEGER")
+            # Duración de cada etapa (cerebro, descargas, composición, codificación, subida...);
+            # `escena` es NULL para las etapas de todo el trabajo
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS etapas (
+                    job_id TEXT NOT NULL,
+                    etapa TEXT NOT NULL,
+                    escena INTEGER,
+                    segundos REAL NOT NULL,
+                    registrada REAL NOT NULL
+                )""")
+            con.execute("CREATE INDEX IF NOT EXISTS idx_etapas_job ON etapas (job_id)")
+            # Frames codificados por cada codificador del trabajo (uno por segmento en modo paralelo)
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS progreso_frames (
+                    job_id TEXT NOT NULL,
+                    clave TEXT NOT NULL,
+                    hechos INTEGER NOT NULL,
+                    total INTEGER NOT NULL,
+                    iniciado REAL NOT NULL,
+                    actualizado REAL NOT NULL,
+                    PRIMARY KEY (job_id, clave)
+                )""")
+            # Contadores acumulados por trabajo (p.ej. frames servidos desde la memo de frames estáticos)
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS contadores (
+                    job_id TEXT NOT NULL,
+                    nombre TEXT NOT NULL,
+                    valor INTEGER NOT NULL,
+                    PRIMARY KEY (job_id, nombre)
+                )""")
+            # Lotes de /api/render-batch: qué trabajo corresponde a cada video del lote
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS lotes (
+                    id TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )""")
+            # Medios de un lote pendientes de precargar en la caché; los descarga un worker
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS precargas (
+                    lote_id TEXT PRIMARY KEY,
+                    urls TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    reclamada REAL
+                )""")
+
+    def _conexion(self, lectura=False):
+        # Una conexión por hilo y por proceso (las conexiones no sobreviven a un fork).
+        # Las lecturas usan una transacción diferida: no toman el lock de escritura y, en
+        # WAL, no esperan a los trabajos que escriben su progreso
+        con = getattr(self._local, 'con', None)
+        if con is None or getattr(self._local, 'pid', None) != os.getpid():
+            con = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.row_factory = sqlite3.Row
+            self._local.con, self._local.pid = con, os.getpid()
+        return _Transaccion(con, "DEFERRED" if lectura else "IMMEDIATE")
+
+    def actualizar(self, job_id, **campos):
+        """Mezcla `campos` en el estado público del trabajo."""
+        with self._conexion() as con:
+            fila = con.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if fila is None:
+                return
+            data = json.loads(fila['data'])
+            data.update(campos)
+            con.execute(
+                "UPDATE jobs SET status = ?, data = ?, updated_at = ? WHERE id = ?",
+                (data['status'], json.dumps(data), time.time(), job_id),
+            )
+
+    def obtener(self, job_id):
+        with self._conexion(lectura=True) as con:
+            fila = con.execute("SELECT status, data, created_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if fila is None:
+                return None
+            data = json.loads(fila['data'])
+            if fila['status'] == 'queued':
+                data['queuePosition'] = con.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at <= ?",
+                    (fila['created_at'],),
+                ).fetchone()[0]
+            tiempos = self._tiempos(con, job_id)
+            if tiempos:
+                data['timings'] = tiempos
+            frames = con.execute(
+                "SELECT SUM(hechos), SUM(total), MIN(iniciado), MAX(actualizado) FROM progreso_frames WHERE job_id = ?",
+                (job_id,),
+            ).fetchone()
+            if frames[0] is not None:
+                transcurrido = frames[3] - frames[2]
+                data['frames'] = {"done": frames[0], "total": frames[1],
+                                  "fps": round(frames[0] / transcurrido, 2) if transcurrido > 0 else None}
+            contadores = dict(con.execute("SELECT nombre, valor FROM contadores WHERE job_id = ?", (job_id,)).fetchall())
+            if contadores:
+                data['counters'] = contadores
+            return data
+
+    def _tiempos(self, con, job_id):
+        """{"stages": {etapa: segundos}, "scenes": {escena: {etapa: segundos}}} del trabajo."""
+        filas = con.execute(
+            "SELECT etapa, escena, SUM(segundos) AS s FROM etapas WHERE job_id = ? GROUP BY etapa, escena",
+            (job_id,),
+        ).fetchall()
+        if not filas:
+            return None
+        etapas, escenas = {}, {}
+        for fila in filas:
+            etapas[fila['etapa']] = round(etapas.get(fila['etapa'], 0.0) + fila['s'], 3)
+            if fila['escena'] is not None:
+                escenas.setdefault(str(fila['escena']), {})[fila['etapa']] = round(fila['s'], 3)
+        return {"stages": etapas, "scenes": escenas}
+
+    def registrar_etapa(self, job_id, etapa, segundos, escena=None):
+        with self._conexion() as con:
+            con.execute("INSERT INTO etapas (job_id, etapa, escena, segundos, registrada) VALUES (?, ?, ?, ?, ?)",
+                        (job_id, etapa, escena, segundos, time.time()))
+
+    def registrar_frames(self, job_id, clave, hechos, total):
+        """
+        Progreso de un codificador del trabajo (clave = segmento o 'final'). Cuenta como
+        latido: una codificación larga no se toma por abandonada (ver reclamar_siguiente).
+        """
+        ahora = time.time()
+        with self._conexion() as con:
+            con.execute(
+                "INSERT INTO progreso_frames (job_id, clave, hechos, total, iniciado, actualizado) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (job_id, clave) DO UPDATE SET hechos = excluded.hechos, total = excluded.total, "
+                "actualizado = excluded.actualizado",
+                (job_id, clave, hechos, total, ahora, ahora),
+            )
+            con.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (ahora, job_id))
+
+    def sumar_contador(self, job_id, nombre, n):
+        if not n:
+            return
+        with self._conexion() as con:
+            con.execute(
+                "INSERT INTO contadores (job_id, nombre, valor) VALUES (?, ?, ?) "
+                "ON CONFLICT (job_id, nombre) DO UPDATE SET valor = valor + excluded.valor",
+                (job_id, nombre, n),
+            )
+
+    def totales_contadores(self):
+        """{nombre: suma de todos los trabajos} (para /metrics)."""
+        with self._conexion(lectura=True) as con:
+            return dict(con.execute("SELECT nombre, SUM(valor) FROM contadores GROUP BY nombre").fetchall())
+
+    def histograma_etapas(self, limites):
+        """
+        Por etapa: (n trabajos, suma de segundos, [acumulados <= cada límite]), sumando
+        antes las filas por escena de un mismo trabajo.
+        """
+        sumas = ", ".join("SUM(s <= ?)" for _ in limites)
+        with self._conexion(lectura=True) as con:
+            filas = con.execute(
+                f"SELECT etapa, COUNT(*), SUM(s){', ' + sumas if limites else ''} FROM "
+                "(SELECT job_id, etapa, SUM(segundos) AS s FROM etapas GROUP BY job_id, etapa) GROUP BY etapa",
+                tuple(limites),
+            ).fetchall()
+        return {fila[0]: (fila[1], fila[2], list(fila[3:])) for fila in filas}
+
+    def contar_por_estado(self):
+        with self._conexion(lectura=True) as con:
+            return dict(con.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def contar(self, estados):
+        marcadores = ",".join("?" * len(estados))
+        with self._conexion(lectura=True) as con:
+            return con.execute(f"SELECT COUNT(*) FROM jobs WHERE status IN ({marcadores})", estados).fetchone()[0]
+
+    def encolar(self, job_id, payload, max_cola):
+        """Inserta un trabajo en cola, o lanza ColaLlena si ya hay `max_cola` esperando."""
+        ahora = time.time()
+        with self._conexion() as con:
+            en_cola = con.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if en_cola >= max_cola:
+                raise ColaLlena(f"Hay {en_cola} trabajos en cola.")
+            self._insertar(con, job_id, payload, ahora)
+
+    def _insertar(self, con, job_id, payload, creado):
+        data = {"status": "queued", "progress": "0%"}
+        con.execute(
+            "INSERT INTO jobs (id, status, data, payload, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, 'queued', json.dumps(data), json.dumps(payload), creado, creado),
+        )
+
+    def encolar_lote(self, lote_id, trabajos, videos, max_cola, urls=()):
+        """
+        Encola todos los `trabajos` [(job_id, payload)] de un lote o ninguno (ColaLlena si no
+        caben en `max_cola`). `videos` es la lista pública del lote: el trabajo de cada video.
+        Los trabajos conservan el orden del lote en la cola. `urls` son los medios del lote
+        que un worker precarga mientras los trabajos esperan plaza.
+        """
+        ahora = time.time()
+        with self._conexion() as con:
+            en_cola = con.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if en_cola + len(trabajos) > max_cola:
+                raise ColaLlena(f"Hay {en_cola} trabajos en cola y el lote añade {len(trabajos)}.")
+            for n, (job_id, payload) in enumerate(trabajos):
+                self._insertar(con, job_id, payload, ahora + n * 1e-6)
+            con.execute("INSERT INTO lotes (id, data, created_at) VALUES (?, ?, ?)",
+                        (lote_id, json.dumps({"videos": videos}), ahora))
+            if urls:
+                con.execute("INSERT INTO precargas (lote_id, urls, created_at) VALUES (?, ?, ?)",
+                            (lote_id, json.dumps(sorted(urls)), ahora))
+
+    def reclamar_precarga(self, timeout):
+        """
+        Toma la precarga pendiente más antigua (o una reclamada hace más de `timeout`
+        segundos, de un worker caído). Devuelve (lote_id, urls) o None.
+        """
+        ahora = time.time()
+        with self._conexion() as con:
+            fila = con.execute(
+                "SELECT lote_id, urls FROM precargas WHERE reclamada IS NULL OR reclamada < ? "
+                "ORDER BY created_at LIMIT 1", (ahora - timeout,),
+            ).fetchone()
+            if fila is None:
+                return None
+            con.execute("UPDATE precargas SET reclamada = ? WHERE lote_id = ?", (ahora, fila['lote_id']))
+            return fila['lote_id'], json.loads(fila['urls'])
+
+    def terminar_precarga(self, lote_id):
+        with self._conexion() as con:
+            con.execute("DELETE FROM precargas WHERE lote_id = ?", (lote_id,))
+
+    def obtener_lote(self, lote_id):
+        """Estado del lote: el de cada video y el progreso agregado de sus trabajos (sin duplicados)."""
+        with self._conexion(lectura=True) as con:
+            fila = con.execute("SELECT data FROM lotes WHERE id = ?", (lote_id,)).fetchone()
+            if fila is None:
+                return None
+            videos = json.loads(fila['data'])['videos']
+            ids = sorted({v['jobId'] for v in videos})
+            marcadores = ",".join("?" * len(ids))
+            estados = {f['id']: json.loads(f['data'])
+                       for f in con.execute(f"SELECT id, data FROM jobs WHERE id IN ({marcadores})", ids).fetchall()}
+        por_estado = {}
+        for job_id in ids:
+            estado = estados.get(job_id, {}).get('status', 'unknown')
+            por_estado[estado] = por_estado.get(estado, 0) + 1
+        terminados = sum(por_estado.get(e, 0) for e in ESTADOS_FINALES)
+        if terminados < len(ids):
+            estado_lote = 'queued' if por_estado.get('queued', 0) == len(ids) else 'processing'
+        else:
+            estado_lote = 'completed_with_errors' if por_estado.get('error') else 'completed'
+        return {
+            "status": estado_lote,
+            "videos": [dict(v, **{k: estados.get(v['jobId'], {}).get(k) for k in ('status', 'progress', 'videoUrl', 'error')})
+                       for v in videos],
+            "jobs": len(ids),
+            "jobsByStatus": por_estado,
+            "progress": f"{terminados}/{len(ids)}",
+        }
+
+    def reclamar_siguiente(self, max_activos, timeout_activo):
+        """
+        Toma atómicamente el trabajo en cola más antiguo si hay menos de `max_activos`
+        en curso. Los trabajos activos sin actualizaciones durante `timeout_activo`
+        segundos (worker caído) se marcan como error y liberan su plaza.
+        Un trabajo de lote que reutiliza la receta de otro ('recipeFromBatchJob') no se
+        reclama mientras ese otro siga sin receta: no ocupa una plaza esperándola.
+        """
+        marcadores = ",".join("?" * len(ESTADOS_ACTIVOS))
+        ahora = time.time()
+        with self._conexion() as con:
+            for fila in con.execute(
+                f"SELECT id, data FROM jobs WHERE status IN ({marcadores}) AND updated_at < ?",
+                (*ESTADOS_ACTIVOS, ahora - timeout_activo),
+            ).fetchall():
+                data = json.loads(fila['data'])
+                data.update({"status": "error", "error": "El trabajo quedó abandonado (worker caído o bloqueado)."})
+                con.execute("UPDATE jobs SET status = 'error', data = ?, updated_at = ? WHERE id = ?",
+                            (json.dumps(data), ahora, fila['id']))
+                logging.warning(f"[{fila['id']}] PLANIFICADOR: Trabajo abandonado marcado como error.")
+
+            activos = con.execute(f"SELECT COUNT(*) FROM jobs WHERE status IN ({marcadores})", ESTADOS_ACTIVOS).fetchone()[0]
+            if activos >= max_activos:
+                return None
+            fila = next((f for f in con.execute(
+                "SELECT id, data, payload FROM jobs WHERE status = 'queued' ORDER BY created_at"
+            ).fetchall() if not self._espera_receta(con, json.loads(f['payload']))), None)
+            if fila is None:
+                return None
+            data = json.loads(fila['data'])
+            data['status'] = 'pending_brain'
+            con.execute("UPDATE jobs SET status = ?, data = ?, worker_pid = ?, updated_at = ? WHERE id = ?",
+                        ('pending_brain', json.dumps(data), os.getpid(), ahora, fila['id']))
+            return fila['id'], json.loads(fila['payload'])
+
+    @staticmethod
+    def _espera_receta(con, payload):
+        """Si el trabajo depende de la receta de otro del lote que aún no la tiene (y no ha fallado)."""
+        origen = payload.get('recipeFromBatchJob')
+        if not origen:
+            return False
+        fila = con.execute("SELECT status, data FROM jobs WHERE id = ?", (origen,)).fetchone()
+        if fila is None or fila['status'] == 'error':
+            return False
+        return not json.loads(fila['data']).get('recipe')
+
+    def workers_con_trabajos(self):
+        """Pids de los workers que tienen trabajos activos."""
+        marcadores = ",".join("?" * len(ESTADOS_ACTIVOS))
+        with self._conexion(lectura=True) as con:
+            return {fila[0] for fila in con.execute(
+                f"SELECT DISTINCT worker_pid FROM jobs WHERE worker_pid IS NOT NULL AND status IN ({marcadores})",
+                ESTADOS_ACTIVOS).fetchall()}
+
+    def liberar_trabajos_de(self, pid, reencolar=False):
+        """
+        Trabajos activos del worker `pid`, que ya no existe. Con `reencolar` (parada ordenada
+        del pool) vuelven a la cola en su puesto y empiezan de cero; si no (el worker murió a
+        mitad) se marcan como error. Devuelve sus ids.
+        """
+        marcadores = ",".join("?" * len(ESTADOS_ACTIVOS))
+        ahora = time.time()
+        with self._conexion() as con:
+            filas = con.execute(f"SELECT id, data FROM jobs WHERE worker_pid = ? AND status IN ({marcadores})",
+                                (pid, *ESTADOS_ACTIVOS)).fetchall()
+            for fila in filas:
+                if reencolar:
+                    data = {"status": "queued", "progress": "0%"}
+                    for tabla in ('etapas', 'progreso_frames', 'contadores'):
+                        con.execute(f"DELETE FROM {tabla} WHERE job_id = ?", (fila['id'],))
+                else:
+                    data = dict(json.loads(fila['data']), status="error",
+                                error="El worker que ejecutaba el trabajo terminó inesperadamente.")
+                con.execute("UPDATE jobs SET status = ?, data = ?, worker_pid = NULL, updated_at = ? WHERE id = ?",
+                            (data['status'], json.dumps(data), ahora, fila['id']))
+        return [fila['id'] for fila in filas]
+
+
+class _Transaccion:
+    """Context manager que ejecuta el bloque dentro de BEGIN IMMEDIATE (o DEFERRED) ... COMMIT."""
+
+    def __init__(self, con, modo="IMMEDIATE"):
+        self.con = con
+        self.modo = modo
+
+    def __enter__(self):
+        self.con.execute(f"BEGIN {self.modo}")
+        return self.con
+
+    def __exit__(self, tipo, valor, traza):
+        self.con.execute("ROLLBACK" if tipo else "COMMIT")
+        return False
+
+
+class Planificador:
+    """
+    Cola con límite global de renders simultáneos. La API solo encola (`enviar`,
+    `enviar_lote`) y cada proceso del pool de workers (worker.py) llama a `atender`:
+    reclama trabajos de la cola compartida respetando el límite y los ejecuta de uno en uno.
+    """
+
+    def __init__(self, store, max_concurrentes=2, max_cola=20, intervalo=1.0, timeout_activo=3600,
+                 max_cola_lotes=None):
+        self.store = store
+        self.max_concurrentes = max_concurrentes
+        self.max_cola = max_cola
+        # Un lote entra entero o no entra, así que admite una cola más larga que los envíos sueltos
+        self.max_cola_lotes = max_cola_lotes or max_cola
+        self.intervalo = intervalo
+        self.timeout_activo = timeout_activo
+
+    def enviar(self, payload, job_id=None):
+        """Encola un trabajo y devuelve su id. Lanza ColaLlena si se alcanzó el máximo."""
+        job_id = job_id or str(uuid.uuid4())
+        self.store.encolar(job_id, payload, self.max_cola)
+        return job_id
+
+    def enviar_lote(self, trabajos, videos, lote_id=None, urls=()):
+        """
+        Encola los trabajos [(job_id, payload)] de un lote, y la precarga de sus `urls`, y
+        devuelve su id. Lanza ColaLlena si no caben.
+        """
+        lote_id = lote_id or str(uuid.uuid4())
+        self.store.encolar_lote(lote_id, trabajos, videos, self.max_cola_lotes, urls)
+        return lote_id
+
+    def atender_precargas(self, precargar, timeout=600):
+        """
+        Bucle (en un hilo de cada worker) que ejecuta las precargas de lotes con
+        `precargar(lote_id, urls)`, sin ocupar plaza de render. No retorna.
+        """
+        while True:
+            try:
+                reclamada = self.store.reclamar_precarga(timeout)
+            except Exception:
+                logging.error("PLANIFICADOR: Error al reclamar precarga.", exc_info=True)
+                reclamada = None
+            if reclamada is None:
+                time.sleep(self.intervalo)
+                continue
+            lote_id, urls = reclamada
+            try:
+                precargar(lote_id, urls)
+            except Exception:
+                # Cada trabajo vuelve a intentarlo (y informa del error) en su propia descarga
+                logging.warning(f"[lote {lote_id}] PLANIFICADOR: Fallo al precargar los medios del lote.", exc_info=True)
+            self.store.terminar_precarga(lote_id)
+
+    def atender(self, ejecutar):
+        """Bucle de un worker: reclama el siguiente trabajo y lo ejecuta con `ejecutar(job_id, payload)`. No retorna."""
+        while True:
+            try:
+                reclamado = self.store.reclamar_siguiente(self.max_concurrentes, self.timeout_activo)
+            except Exception:
+                logging.error("PLANIFICADOR: Error al reclamar trabajo.", exc_info=True)
+                reclamado = None
+            if reclamado is None:
+                time.sleep(self.intervalo)
+                continue
+            job_id, payload = reclamado
+            logging.info(f"[{job_id}] PLANIFICADOR: Trabajo iniciado en el worker {os.getpid()}.")
+            try:
+                ejecutar(job_id, payload)
+            except Exception:
+                # `ejecutar` ya marca el trabajo como error; el worker sigue atendiendo la cola
+                logging.error(f"[{job_id}] PLANIFICADOR: Fallo no controlado del trabajo.", exc_info=True)
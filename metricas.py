@@ -0,0 +1,107 @@
+# metricas.py
+# Instrumentación de los trabajos: tiempos por etapa (guardados en el JobStore para
+# que los vean todos los procesos), progreso de codificación frame a frame y
+# exposición agregada en formato de texto de Prometheus para /metrics.
+
+import time
+import logging
+from contextlib import contextmanager
+
+from proglog import ProgressBarLogger
+
+# Límites (segundos) de los histogramas de latencia por etapa
+LIMITES_LATENCIA = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+
+@contextmanager
+def medir_etapa(store, job_id, etapa, escena=None):
+    """Registra cuánto tarda el bloque como `etapa` del trabajo (también si lanza una excepción)."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        segundos = time.perf_counter() - inicio
+        try:
+            store.registrar_etapa(job_id, etapa, segundos, escena)
+        except Exception:
+            # Las métricas nunca deben tumbar un render
+            logging.warning(f"[{job_id}] MÉTRICAS: No se pudo registrar la etapa '{etapa}'.", exc_info=True)
+
+
+class LoggerProgresoFrames(ProgressBarLogger):
+    """
+    Logger de proglog para write_videofile: llama a `al_progresar(hechos, total)` a medida
+    que moviepy escribe frames, como mucho una vez cada `intervalo` segundos (y siempre
+    con el último frame).
+    """
+
+    def __init__(self, al_progresar, intervalo=1.0):
+        super().__init__()
+        self.al_progresar = al_progresar
+        self.intervalo = intervalo
+        self._ultimo = 0.0
+
+    def bars_callback(self, bar, attr, value, old_value=None):
+        if bar != 't' or attr != 'index':
+            return
+        hechos = value + 1
+        # moviepy calcula el total con int(duración*fps), que puede quedarse un frame corto
+        total = max(self.bars[bar]['total'], hechos)
+        ahora = time.monotonic()
+        if hechos >= total or ahora - self._ultimo >= self.intervalo:
+            self._ultimo = ahora
+            try:
+                self.al_progresar(hechos, total)
+            except Exception:
+                logging.warning("MÉTRICAS: No se pudo registrar el progreso de frames.", exc_info=True)
+
+
+def logger_frames(store, job_id, clave):
+    """LoggerProgresoFrames que guarda el progreso del codificador `clave` en el JobStore."""
+    return LoggerProgresoFrames(lambda hechos, total: store.registrar_frames(job_id, clave, hechos, total))
+
+
+def exposicion_prometheus(store, estados_activos):
+    """Texto de /metrics: trabajos por estado, profundidad de cola, renders activos, contadores e histogramas por etapa."""
+    por_estado = store.contar_por_estado()
+    lineas = [
+        "# HELP render_queue_depth Trabajos en cola esperando una plaza de render.",
+        "# TYPE render_queue_depth gauge",
+        f"render_queue_depth {por_estado.get('queued', 0)}",
+        "# HELP render_active_jobs Trabajos en curso (cerebro, descarga, render o subida).",
+        "# TYPE render_active_jobs gauge",
+        f"render_active_jobs {sum(por_estado.get(e, 0) for e in estados_activos)}",
+        "# HELP render_jobs Trabajos por estado.",
+        "# TYPE render_jobs gauge",
+    ]
+    lineas += [f'render_jobs{{status="{estado}"}} {n}' for estado, n in sorted(por_estado.items())]
+    for nombre, valor in sorted(store.totales_contadores().items()):
+        lineas += [f"# TYPE render_{nombre}_total counter", f"render_{nombre}_total {valor}"]
+    lineas += [
+        "# HELP render_stage_seconds Duración de cada etapa por trabajo.",
+        "# TYPE render_stage_seconds histogram",
+    ]
+    for etapa, (n, suma, acumulados) in sorted(store.histograma_etapas(LIMITES_LATENCIA).items()):
+        for limite, acumulado in zip(LIMITES_LATENCIA, acumulados):
+            lineas.append(f'render_stage_seconds_bucket{{stage="{etapa}",le="{limite}"}} {acumulado}')
+        lineas.append(f'render_stage_seconds_bucket{{stage="{etapa}",le="+Inf"}} {n}')
+        lineas.append(f'render_stage_seconds_sum{{stage="{etapa}"}} {suma:.6f}')
+        lineas.append(f'render_stage_seconds_count{{stage="{etapa}"}} {n}')
+    return "\n".join(lineas) + "\n"
+
+
+def cronometrar_frames(clip):
+    """
+    Envuelve el clip para acumular en `tiempo['segundos']` lo que tarda en generar sus
+    frames: moviepy compone de forma perezosa dentro de write_videofile, así que esto
+    separa la composición de la codificación.
+    """
+    tiempo = {"segundos": 0.0}
+
+    def generar(get_frame, t):
+        inicio = time.perf_counter()
+        frame = get_frame(t)
+        tiempo["segundos"] += time.perf_counter() - inicio
+        return frame
+
+    return clip.fl(generar), tiempo
@@ -0,0 +1,27 @@
+# perfiles.py
+# Perfiles de codificación seleccionables por trabajo (resolución, fps, preset/CRF de x264, hilos).
+
+from collections import namedtuple
+
+PerfilCodificacion = namedtuple("PerfilCodificacion", "nombre escala fps preset crf threads")
+
+PERFILES_CODIFICACION = {
+    # Borrador/preview: para revisar las decisiones de la IA en una fracción del tiempo
+    "draft": PerfilCodificacion("draft", escala=0.5, fps=15, preset="ultrafast", crf=30, threads=0),
+    "standard": PerfilCodificacion("standard", escala=1.0, fps=24, preset="medium", crf=23, threads=0),
+    "archive": PerfilCodificacion("archive", escala=1.0, fps=30, preset="slow", crf=18, threads=0),
+}
+ALIAS_PERFILES = {"preview": "draft"}
+PERFIL_POR_DEFECTO = "standard"
+
+
+def obtener_perfil(nombre=None):
+    """Devuelve el perfil por nombre (o alias). Lanza KeyError si no existe."""
+    nombre = nombre or PERFIL_POR_DEFECTO
+    return PERFILES_CODIFICACION[ALIAS_PERFILES.get(nombre, nombre)]
+
+
+def canvas_de(perfil, canvas_base):
+    """Lienzo de salida escalado por el perfil, con dimensiones pares (requisito de yuv420p)."""
+    return tuple(max(2, int(round(lado * perfil.escala / 2)) * 2) for lado in canvas_base)
+
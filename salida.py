@@ -0,0 +1,184 @@
+# salida.py
+# Subida del video final por chunks (sesión reanudable de GCS) directamente desde
+# el archivo en disco, opcionalmente mientras el codificador todavía lo escribe.
+
+import os
+import logging
+import threading
+
+TAMANO_CHUNK_SUBIDA = 8 * 1024 * 1024  # múltiplo de 256 KB, como exige GCS
+
+# MP4 fragmentado: se escribe de forma secuencial (sin reescribir el 'moov' al final),
+# así que puede subirse mientras crece. '+faststart' en cambio reescribe el archivo.
+MOVFLAGS_STREAMING = "frag_keyframe+empty_moov+default_base_moof"
+MOVFLAGS_FASTSTART = "+faststart"
+
+
+class DestinoGCS:
+    """Sube a un bucket de GCS con BlobWriter (subida reanudable por chunks)."""
+
+    def __init__(self, obtener_bucket):
+        self.obtener_bucket = obtener_bucket
+
+    def abrir(self, nombre, content_type, chunk_size):
+        blob = self.obtener_bucket().blob(nombre)
+        return _EscritorGCS(blob.open('wb', chunk_size=chunk_size, content_type=content_type))
+
+    def url_publica(self, nombre):
+        return self.obtener_bucket().blob(nombre).public_url
+
+
+class _EscritorGCS:
+    """BlobWriter que además sabe cancelar: cierra la sesión reanudable en lugar de finalizar el objeto."""
+
+    def __init__(self, writer):
+        self._writer = writer
+
+    def write(self, datos):
+        return self._writer.write(datos)
+
+    def close(self):
+        self._writer.close()
+
+    def abortar(self):
+        # Cerrar el buffer primero: BlobWriter.close() (que también se llama al recolectarlo)
+        # subiría lo pendiente como último chunk y el objeto a medias quedaría publicado
+        self._writer._buffer.close()
+        sesion = self._writer._upload_and_transport
+        if sesion is None:
+            return  # no se llegó a enviar ningún chunk: no hay sesión en GCS
+        upload, transport = sesion
+        if upload.finished:
+            return
+        # GCS descarta los bytes recibidos y responde 499 al DELETE de la URL de la sesión
+        transport.request("DELETE", upload.resumable_url)
+
+
+class _EscritorLocal:
+    """Escribe en '<ruta>.part' y solo la renombra al cerrar: nunca queda un archivo a medias visible."""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        self._f = open(f"{ruta}.part", 'wb')
+
+    def write(self, datos):
+        return self._f.write(datos)
+
+    def close(self):
+        self._f.close()
+        os.replace(f"{self.ruta}.part", self.ruta)
+
+    def abortar(self):
+        self._f.close()
+        os.remove(f"{self.ruta}.part")
+
+
+class DestinoLocal:
+    """Destino en el sistema de archivos local (desarrollo y pruebas sin GCS)."""
+
+    def __init__(self, directorio, url_base=None):
+        self.directorio = directorio
+        self.url_base = url_base
+
+    def abrir(self, nombre, content_type, chunk_size):
+        return _EscritorLocal(os.path.join(self.directorio, nombre))
+
+    def url_publica(self, nombre):
+        if self.url_base:
+            return f"{self.url_base.rstrip('/')}/{nombre}"
+        return f"file://{os.path.abspath(os.path.join(self.directorio, nombre))}"
+
+
+class SubidaProgresiva:
+    """
+    Sube `ruta` a `destino` por chunks sin cargar el archivo en memoria. Con `iniciar()`
+    la subida corre en un hilo que sigue el archivo mientras crece; `terminar()` indica
+    que el codificador acabó, espera al último chunk y devuelve la URL pública. Sin
+    `iniciar()`, `terminar()` sube el archivo completo de forma síncrona.
+    """
+
+    def __init__(self, destino, ruta, nombre, content_type, chunk_size=TAMANO_CHUNK_SUBIDA,
+                 al_progresar=None, intervalo=0.5):
+        self.destino = destino
+        self.ruta = ruta
+        self.nombre = nombre
+        self.content_type = content_type
+        self.chunk_size = chunk_size
+        self.al_progresar = al_progresar
+        self.intervalo = intervalo
+        self.bytes_subidos = 0
+        self._fin = threading.Event()
+        self._cancelado = False
+        self._error = None
+        self._hilo = None
+
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._subir, daemon=True, name=f"subida-{self.nombre}")
+        self._hilo.start()
+        return self
+
+    def terminar(self):
+        self._fin.set()
+        if self._hilo is None:
+            self._subir()
+        else:
+            self._hilo.join()
+        if self._error:
+            raise self._error
+        return self.destino.url_publica(self.nombre)
+
+    def cancelar(self):
+        """Aborta la subida sin finalizar el objeto de destino (p.ej. si falla el render)."""
+        self._cancelado = True
+        self._fin.set()
+        if self._hilo is not None:
+            self._hilo.join()
+
+    def _subir(self):
+        escritor = None
+        try:
+            while not os.path.exists(self.ruta):
+                if self._cancelado:
+                    logging.info(f"SUBIDA: {self.nombre} cancelada antes de empezar.")
+                    return
+                if self._fin.is_set():
+                    raise FileNotFoundError(self.ruta)
+                self._fin.wait(self.intervalo)
+            escritor = self.destino.abrir(self.nombre, self.content_type, self.chunk_size)
+            with open(self.ruta, 'rb') as f:
+                while not self._cancelado:
+                    # Leer el flag ANTES de leer datos: si ya estaba activo y no hay más, el archivo está completo
+                    terminado = self._fin.is_set()
+                    datos = f.read(self.chunk_size)
+                    if datos:
+                        escritor.write(datos)
+                        self.bytes_subidos += len(datos)
+                        if self.al_progresar:
+                            self.al_progresar(self.bytes_subidos)
+                    elif terminado:
+                        break
+                    else:
+                        self._fin.wait(self.intervalo)
+            if self._cancelado:
+                self._abortar(escritor)
+                logging.info(f"SUBIDA: {self.nombre} cancelada ({self.bytes_subidos} bytes enviados y descartados).")
+                return
+            escritor.close()
+            logging.info(f"SUBIDA: {self.nombre} completada ({self.bytes_subidos} bytes).")
+        except Exception as e:
+            if self._cancelado:
+                # Un chunk en vuelo que falla durante la cancelación no es un error de la subida
+                logging.info(f"SUBIDA: {self.nombre} cancelada ({e}).")
+            else:
+                logging.error(f"SUBIDA: Fallo subiendo {self.nombre}.", exc_info=True)
+                self._error = e
+            self._abortar(escritor)
+
+    def _abortar(self, escritor):
+        if escritor is None or not hasattr(escritor, 'abortar'):
+            return
+        try:
+            escritor.abortar()
+        except Exception:
+            logging.warning(f"SUBIDA: No se pudo cerrar la sesión de {self.nombre}.", exc_info=True)
@@ -0,0 +1,190 @@
+# segmentos.py
+# Renderizado por escenas: cada escena se codifica a su propio segmento en un
+# pool de procesos y al final los segmentos se unen sin recodificar.
+
+import os
+import json
+import math
+import shutil
+import hashlib
+import logging
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from moviepy.config import get_setting
+
+from cache_medios import CacheDiscoLRU
+
+def parametros_segmento(perfil):
+    """
+    Todos los segmentos de un trabajo DEBEN compartir estos parámetros: el demuxer
+    'concat' de ffmpeg solo puede unirlos con '-c copy' si códec, perfil, pix_fmt y fps
+    son idénticos. Los segmentos son solo video: el audio de toda la línea de tiempo se
+    mezcla aparte (audio_mezcla.py) y se añade al unirlos.
+    """
+    return {
+        "codec": "libx264",
+        "fps": perfil.fps,
+        "preset": perfil.preset,
+        "audio": False,
+        "ffmpeg_params": ["-crf", str(perfil.crf), "-pix_fmt", "yuv420p", "-profile:v", "high"],
+    }
+
+
+def ajustar_a_frames(clip, fps):
+    """
+    moviepy genera un frame por cada t de arange(0, duracion, 1/fps): una duración que por
+    redondeo queda un pelo por encima de un número entero de frames añade un frame de más.
+    Se fija la duración a medio frame por debajo para que el conteo sea exacto.
+    """
+    n_frames = max(1, math.ceil(clip.duration * fps - 1e-3))
+    return clip.set_duration((n_frames - 0.5) / fps)
+
+
+def escribir_segmento(clip, ruta, perfil, threads=1, logger=None):
+    """Codifica un clip con los parámetros comunes de segmento del perfil (`logger`: proglog, p.ej. de progreso)."""
+    ajustar_a_frames(clip, perfil.fps).write_videofile(ruta, threads=threads, logger=logger, **parametros_segmento(perfil))
+    return ruta
+
+
+def concatenar_segmentos(rutas, ruta_salida, movflags="+faststart", ruta_audio=None):
+    """Une los segmentos con el demuxer concat de ffmpeg sin recodificar el video y, si se da, añade la pista de audio."""
+    lista_path = f"{ruta_salida}.txt"
+    with open(lista_path, 'w') as f:
+        for ruta in rutas:
+            f.write(f"file '{os.path.abspath(ruta)}'\n")
+    comando = [
+        get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error",
+        "-f", "concat", "-safe", "0", "-i", lista_path,
+    ]
+    if ruta_audio:
+        comando += ["-i", ruta_audio, "-map", "0:v", "-map", "1:a", "-c:v", "copy", "-c:a", "aac", "-b:a", "192k"]
+    else:
+        comando += ["-c", "copy"]
+    comando += ["-movflags", movflags, ruta_salida]
+    try:
+        subprocess.run(comando, check=True, capture_output=True)
+    except subprocess.CalledProcessError as e:
+        logging.error(f"Fallo al concatenar segmentos: {e.stderr.decode(errors='ignore')}")
+        raise
+    finally:
+        os.remove(lista_path)
+    return ruta_salida
+
+
+def renderizar_en_paralelo(funcion, tareas, workers, al_completar=None, al_terminar=None, metodo="fork"):
+    """
+    Ejecuta `funcion(tarea)` para cada tarea en un pool de `workers` procesos.
+    Devuelve los resultados en el mismo orden que `tareas`. `al_completar(hechas, total)`
+    se invoca en el proceso padre cada vez que termina una tarea, y `al_terminar(i, resultado)`
+    con el índice y el resultado de esa tarea (el resultado devuelto es el de `al_terminar`).
+
+    `metodo` es el de multiprocessing. 'fork' hereda los módulos ya importados (moviepy,
+    clientes) sin reimportarlos, pero solo es seguro si no hay otros hilos a mitad de una
+    llamada gRPC. Con 'forkserver' los procesos salen de un servidor limpio que importa una
+    vez el módulo de `funcion`.
+    """
+    resultados = [None] * len(tareas)
+    contexto = multiprocessing.get_context(metodo)
+    if metodo == "forkserver":
+        contexto.set_forkserver_preload([funcion.__module__])
+    with ProcessPoolExecutor(max_workers=max(1, workers), mp_context=contexto) as pool:
+        futuros = {pool.submit(funcion, tarea): i for i, tarea in enumerate(tareas)}
+        for hechas, futuro in enumerate(as_completed(futuros), start=1):
+            i = futuros[futuro]
+            resultados[i] = futuro.result()
+            if al_terminar:
+                resultados[i] = al_terminar(i, resultados[i])
+            if al_completar:
+                al_completar(hechas, len(tareas))
+    return resultados
+
+
+def _solapes_en_frames(duraciones, transiciones, fps):
+    """(frames de cada escena, frames de solape con la siguiente), acotando cada transición a lo disponible."""
+    n = len(duraciones)
+    frames = [max(1, int(round(d * fps))) for d in duraciones]
+    solapes = [0] * n
+    for i in range(n - 1):
+        transicion = transiciones[i] or {}
+        disponible = frames[i] - (solapes[i - 1] if i else 0)
+        solapes[i] = max(0, min(int(math.floor(float(transicion.get('duration', 0) or 0) * fps)), disponible, frames[i + 1]))
+    return frames, solapes
+
+
+def linea_de_tiempo(duraciones, transiciones, fps):
+    """
+    Posición de cada escena en el video final, coherente con planificar_tramos: lista de
+    {"inicio", "duracion", "entrada", "salida"} en segundos, donde entrada/salida son los
+    solapes con la escena anterior/siguiente.
+    """
+    frames, solapes = _solapes_en_frames(duraciones, transiciones, fps)
+    escenas, inicio = [], 0
+    for i, n_frames in enumerate(frames):
+        escenas.append({"inicio": inicio / fps, "duracion": n_frames / fps,
+                        "entrada": (solapes[i - 1] if i else 0) / fps, "salida": solapes[i] / fps})
+        inicio += n_frames - solapes[i]
+    return escenas
+
+
+def planificar_tramos(duraciones, transiciones, fps):
+    """
+    Divide la línea de tiempo en tramos: el cuerpo de cada escena (lo que queda fuera de
+    las ventanas de transición) y una ventana por transición, donde se superponen el final
+    de una escena y el principio de la siguiente. Solo las ventanas componen dos clips;
+    los cuerpos pasan tal cual, así que una transición cuesta lo que dura y no lo que dura
+    el video. `transiciones[i]` es la transición de la escena i a la i+1 (o None).
+    Todos los cortes caen en frames enteros para que los segmentos unidos no deriven.
+    """
+    n = len(duraciones)
+    frames, solapes = _solapes_en_frames(duraciones, transiciones, fps)
+    tramos = []
+    for i in range(n):
+        inicio, fin = (solapes[i - 1] if i else 0), frames[i] - solapes[i]
+        if fin > inicio:
+            tramos.append({"tipo": "escena", "escena": i, "inicio": round(inicio / fps, 6), "fin": round(fin / fps, 6)})
+        if solapes[i]:
+            tramos.append({"tipo": "transicion", "escenas": [i, i + 1], "duracion": round(solapes[i] / fps, 6),
+                           "transicion": transiciones[i]})
+    return tramos
+
+
+def clave_segmento(hashes_medios, tipo_medio, receta, perfil, canvas, version_render):
+    """
+    Hash de todo lo que determina el segmento de una escena: contenido de sus medios
+    (sha256 de la caché de medios, no la URL), su fragmento de receta, el perfil de
+    codificación, el lienzo y la versión del renderizador.
+    """
+    contenido = json.dumps(
+        {"medios": hashes_medios, "tipo": tipo_medio, "receta": receta, "perfil": perfil._asdict(),
+         "canvas": list(canvas), "version": version_render},
+        sort_keys=True, ensure_ascii=False, separators=(',', ':'),
+    )
+    return hashlib.sha256(contenido.encode('utf-8')).hexdigest()
+
+
+def clave_tramo(tramo, claves_escenas):
+    """Clave de un tramo: las claves de las escenas que usa más su corte (o su transición)."""
+    contenido = json.dumps({"tramo": tramo, "escenas": claves_escenas}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(contenido.encode('utf-8')).hexdigest()
+
+
+class CacheSegmentos:
+    """
+    Segmentos ya codificados por escena, acotados por tamaño (expulsión LRU). Al
+    reenviar un trabajo con una escena editada solo se vuelve a renderizar esa escena;
+    el resto se reutiliza y se une con '-c copy'.
+    """
+
+    def __init__(self, directorio, max_bytes):
+        self._cache = CacheDiscoLRU(directorio, max_bytes)
+
+    def obtener(self, clave):
+        return self._cache.obtener(f"{clave}.mp4")
+
+    def guardar(self, clave, ruta_segmento):
+        """Mueve el segmento recién codificado a la caché y devuelve su nueva ruta."""
+        ruta_tmp = self._cache.archivo_temporal()
+        shutil.move(ruta_segmento, ruta_tmp)  # el directorio de trabajo puede estar en otro disco
+        return self._cache.guardar(f"{clave}.mp4", ruta_tmp)
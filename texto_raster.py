@@ -0,0 +1,215 @@
+# texto_raster.py
+# Rasterizado de texto con Pillow: cada (texto, estilo) se dibuja UNA vez a un RGBA
+# cacheado y las animaciones (máquina de escribir, karaoke, popup) trabajan sobre
+# ese mismo raster en lugar de crear un TextClip (un proceso de ImageMagick) por
+# letra o por palabra.
+
+import logging
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont, ImageColor
+from moviepy.editor import ImageClip, VideoClip
+
+FUENTE_POR_DEFECTO = "DejaVuSans"
+
+
+@lru_cache(maxsize=32)
+def _fuente(font, fontsize):
+    """Carga una fuente TrueType por ruta o por nombre (p.ej. 'Arial-Bold'), con respaldo a DejaVuSans."""
+    for candidata in (font, FUENTE_POR_DEFECTO):
+        if not candidata:
+            continue
+        try:
+            return ImageFont.truetype(candidata, fontsize)
+        except OSError:
+            logging.warning(f"TEXTO: Fuente '{candidata}' no encontrada.")
+    return ImageFont.load_default()
+
+
+def _rgba(color, opacidad=1.0):
+    if isinstance(color, (list, tuple)):
+        rgb = tuple(int(c) for c in color[:3])
+    else:
+        rgb = ImageColor.getrgb(color)[:3]
+    return rgb + (int(round(255 * opacidad)),)
+
+
+class RasterTexto:
+    """
+    Texto ya dibujado. `rgba` es un array (h, w, 4) de solo lectura; `lineas` guarda por
+    línea (y0, y1, x_inicio, anchos de prefijo por carácter) y `palabras` las cajas
+    (x0, y0, x1, y1) de cada palabra, en el mismo orden que `texto.split()`.
+    """
+
+    def __init__(self, rgba, lineas, palabras):
+        self.rgba = rgba
+        self.lineas = lineas
+        self.palabras = palabras
+        self.n_caracteres = sum(len(anchos) - 1 for _, _, _, anchos in lineas)
+
+    @property
+    def size(self):
+        return self.rgba.shape[1], self.rgba.shape[0]
+
+
+def _clave_estilo(fontsize=48, color='white', font=None, stroke_color=None, stroke_width=0,
+                  padding=0, bg_color=None, bg_opacity=0.0, interlineado=4, **ignorados):
+    """Normaliza el estilo a una tupla hashable. Ignora opciones propias de TextClip (method, align...)."""
+    def congelar(valor):
+        return tuple(valor) if isinstance(valor, list) else valor
+    return (int(fontsize), congelar(color), font, congelar(stroke_color), int(stroke_width or 0),
+            int(padding), congelar(bg_color), float(bg_opacity), int(interlineado))
+
+
+def rasterizar_texto(texto, **estilo):
+    """Devuelve el RasterTexto de (texto, estilo), dibujándolo solo la primera vez."""
+    return _rasterizar(texto, _clave_estilo(**estilo))
+
+
+@lru_cache(maxsize=256)
+def _rasterizar(texto, clave):
+    fontsize, color, font, stroke_color, stroke_width, padding, bg_color, bg_opacity, interlineado = clave
+    fuente = _fuente(font, fontsize)
+    ascenso, descenso = fuente.getmetrics()
+    alto_linea = ascenso + descenso + 2 * stroke_width
+    lineas_texto = texto.split('\n')
+    anchos_linea = [fuente.getlength(linea) + 2 * stroke_width for linea in lineas_texto]
+    ancho = int(np.ceil(max(anchos_linea))) + 2 * padding
+    alto = alto_linea * len(lineas_texto) + interlineado * (len(lineas_texto) - 1) + 2 * padding
+
+    fondo = _rgba(bg_color, bg_opacity) if bg_color is not None and bg_opacity > 0 else (0, 0, 0, 0)
+    imagen = Image.new('RGBA', (max(ancho, 1), max(alto, 1)), fondo)
+    dibujo = ImageDraw.Draw(imagen)
+    lineas, palabras = [], []
+    for n, (linea, ancho_linea) in enumerate(zip(lineas_texto, anchos_linea)):
+        y0 = padding + n * (alto_linea + interlineado)
+        x0 = padding + (ancho - 2 * padding - ancho_linea) / 2  # líneas centradas, como TextClip
+        dibujo.text((x0 + stroke_width, y0 + stroke_width), linea, font=fuente, fill=_rgba(color),
+                    stroke_width=stroke_width, stroke_fill=_rgba(stroke_color) if stroke_color else None)
+        anchos = [x0 + fuente.getlength(linea[:i]) + (2 * stroke_width if i else 0) for i in range(len(linea) + 1)]
+        lineas.append((y0, y0 + alto_linea, x0, anchos))
+        inicio = 0
+        for palabra in linea.split():
+            inicio = linea.index(palabra, inicio)
+            fin = inicio + len(palabra)
+            palabras.append((int(anchos[inicio]), y0, int(np.ceil(anchos[fin])) + stroke_width, y0 + alto_linea))
+            inicio = fin
+
+    rgba = np.array(imagen)
+    rgba.setflags(write=False)
+    return RasterTexto(rgba, lineas, palabras)
+
+
+def _clip_desde_rgba(rgba):
+    clip = ImageClip(np.ascontiguousarray(rgba[..., :3]))
+    return clip.set_mask(ImageClip(rgba[..., 3] / 255.0, ismask=True))
+
+
+def clip_texto(texto, **estilo):
+    """Equivalente a TextClip (con fondo opcional vía padding/bg_color/bg_opacity) desde el raster cacheado."""
+    return _clip_desde_rgba(rasterizar_texto(texto, **estilo).rgba)
+
+
+def texto_popup(texto, duracion_anim, **estilo):
+    """Aparición con rebote (ease-out-back) escalando el raster cacheado."""
+    def ease_out_back(t_norm):
+        c1 = 1.70158
+        c3 = c1 + 1
+        return 1 + c3 * pow(t_norm - 1, 3) + c1 * pow(t_norm - 1, 2)
+    raster = rasterizar_texto(texto, **estilo)
+    w, h = raster.size
+    escala_minima = 2.0 / min(raster.size)  # un frame de 0 px rompe el redimensionado
+    def resize_func(t):
+        return max(ease_out_back(t / duracion_anim), escala_minima) if t < duracion_anim else 1
+    ultimo = {"t": None}
+
+    def estado(t):
+        # Se escala el RGBA entero con Pillow (que premultiplica el alfa al interpolar): el
+        # resize de moviepy trunca la máscara float a 0/1 y se perdía el antialiasing
+        if t != ultimo["t"]:
+            escala = resize_func(t)
+            rgba = raster.rgba
+            if escala != 1:
+                tamano = (max(1, int(w * escala)), max(1, int(h * escala)))
+                rgba = np.asarray(Image.fromarray(raster.rgba).resize(tamano, Image.BILINEAR))
+            ultimo.update(t=t, rgb=rgba[..., :3], alfa=rgba[..., 3] / 255.0)
+        return ultimo
+
+    clip = VideoClip(lambda t: estado(t)["rgb"])
+    return clip.set_mask(VideoClip(lambda t: estado(t)["alfa"], ismask=True))
+
+
+def _alfa_prefijo(raster, n_visibles):
+    """Alfa (float32, 0-1) del raster con solo los primeros `n_visibles` caracteres visibles."""
+    alfa = raster.rgba[..., 3]
+    visible = np.zeros(alfa.shape, dtype=np.float32)
+    restantes = n_visibles
+    for y0, y1, _, anchos in raster.lineas:
+        if restantes <= 0:
+            break
+        n_linea = min(restantes, len(anchos) - 1)
+        x_fin = alfa.shape[1] if n_linea == len(anchos) - 1 else int(np.ceil(anchos[n_linea]))
+        visible[y0:y1, :x_fin] = alfa[y0:y1, :x_fin] / 255.0
+        restantes -= n_linea
+    return visible
+
+
+def texto_maquina_escribir(texto, duracion_total, bg_color=None, bg_opacity=0.0, **estilo):
+    """
+    Efecto máquina de escribir con un solo raster: en cada frame se revela el prefijo
+    (por ancho acumulado de caracteres) y, si hay fondo, se compone sobre él. Solo se
+    recalcula cuando cambia el número de letras visibles.
+    """
+    estilo.pop('fps', None)
+    raster = rasterizar_texto(texto, **estilo)
+    rgb_texto = raster.rgba[..., :3].astype(np.float32)
+    if bg_color is not None and bg_opacity > 0:
+        rgb_fondo = np.array(_rgba(bg_color)[:3], dtype=np.float32)
+        alfa_fondo = float(bg_opacity)
+    else:
+        rgb_fondo, alfa_fondo = np.zeros(3, dtype=np.float32), 0.0
+    n_total = max(raster.n_caracteres, 1)
+    duracion_por_letra = duracion_total / n_total
+    ultimo = {"n": None}
+
+    def estado(t):
+        n = min(int(t / duracion_por_letra) + 1, n_total) if duracion_por_letra else n_total
+        if n != ultimo["n"]:
+            alfa_texto = _alfa_prefijo(raster, n)[..., None]
+            alfa = alfa_texto + alfa_fondo * (1 - alfa_texto)
+            rgb = (rgb_texto * alfa_texto + rgb_fondo * alfa_fondo * (1 - alfa_texto)) / np.maximum(alfa, 1e-6)
+            ultimo.update(n=n, rgb=rgb.astype(np.uint8), alfa=alfa[..., 0])
+        return ultimo
+
+    clip = VideoClip(lambda t: estado(t)["rgb"], duration=duracion_total)
+    return clip.set_mask(VideoClip(lambda t: estado(t)["alfa"], ismask=True, duration=duracion_total))
+
+
+def texto_karaoke(word_timestamps, color='white', highlight_color='yellow', **estilo):
+    """
+    Karaoke sobre un único raster de la frase: cada palabra se resalta copiando su caja
+    desde el raster del color de resaltado mientras dura su intervalo.
+    """
+    frase = " ".join(d['word'] for d in word_timestamps)
+    normal = rasterizar_texto(frase, color=color, **estilo)
+    resaltado = rasterizar_texto(frase, color=highlight_color, **estilo)
+    rgb_normal = np.ascontiguousarray(normal.rgba[..., :3])
+    rgb_resaltado = resaltado.rgba[..., :3]
+    duracion_total = word_timestamps[-1]['end_time']
+    ultimo = {"activas": None, "frame": rgb_normal}
+
+    def make_frame(t):
+        activas = tuple(i for i, d in enumerate(word_timestamps) if d['start_time'] <= t < d['end_time'])
+        if activas != ultimo["activas"]:
+            frame = rgb_normal
+            if activas:
+                frame = rgb_normal.copy()
+                for i in activas:
+                    x0, y0, x1, y1 = normal.palabras[i]
+                    frame[y0:y1, x0:x1] = rgb_resaltado[y0:y1, x0:x1]
+            ultimo.update(activas=activas, frame=frame)
+        return ultimo["frame"]
+
+    clip = VideoClip(make_frame, duration=duracion_total)
+    return clip.set_mask(ImageClip(normal.rgba[..., 3] / 255.0, ismask=True).set_duration(duracion_total))
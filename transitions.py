@@ -2,12 +2,15 @@
 
 from moviepy.editor import *
 
+# Todas las transiciones reciben la cola de la escena saliente y la cabeza de la entrante,
+# ambas ya recortadas a `duracion`: solo la ventana de solape se compone con dos clips.
+
 def fundido_cruzado(clip1, clip2, duracion):
-    return crossfadein(clip2.set_duration(duracion), clip1)
+    return CompositeVideoClip([clip1, clip2.crossfadein(duracion)], size=clip1.size).set_duration(duracion)
 
 def deslizamiento(clip1, clip2, duracion, direccion="izquierda"):
     w, h = clip1.size
-    
+
     def pos_clip1(t):
         if direccion == "izquierda": return (-w * t / duracion, 0)
         elif direccion == "derecha": return (w * t / duracion, 0)
@@ -22,7 +25,24 @@ def deslizamiento(clip1, clip2, duracion, direccion="izquierda"):
 
     clip1_animado = clip1.set_position(pos_clip1)
     clip2_animado = clip2.set_position(pos_clip2)
-    
+
     return CompositeVideoClip([clip2_animado, clip1_animado], size=(w,h)).set_duration(duracion)
 
 # Puedes añadir aquí la función de 'wipe' y otras que creamos.
+
+TRANSICIONES = {
+    "crossfade": lambda c1, c2, d, t: fundido_cruzado(c1, c2, d),
+    "fade": lambda c1, c2, d, t: fundido_cruzado(c1, c2, d),
+    "slide": lambda c1, c2, d, t: deslizamiento(c1, c2, d, t.get('direction', 'izquierda')),
+}
+
+def componer_transicion(clip_saliente, clip_entrante, transicion, duracion):
+    """Ventana de transición (`transition_to_next` de la receta) entre dos escenas completas."""
+    cola = clip_saliente.subclip(clip_saliente.duration - duracion, clip_saliente.duration)
+    cabeza = clip_entrante.subclip(0, duracion)
+    # El audio se funde igual que en el motor ffmpeg (acrossfade)
+    if cola.audio is not None:
+        cola = cola.audio_fadeout(duracion)
+    if cabeza.audio is not None:
+        cabeza = cabeza.audio_fadein(duracion)
+    return TRANSICIONES[transicion['type']](cola, cabeza, duracion, transicion)
@@ -1,61 +1,172 @@
 # efectos_visuales/vfx.py
 
 import numpy as np
+from functools import lru_cache
 from moviepy.editor import *
 from moviepy.video.fx.all import *
+from moviepy.video.fx.resize import resizer
 import requests
 import os
 
-def aplicar_correccion_color(clip, brillo=0, contraste=0, saturacion=1.0, tinte=None):
-    clip_procesado = clip
+# Color del tinte sepia y su opacidad (sobre el blanco y negro)
+TINTE_SEPIA = ((112, 66, 20), 0.4)
+
+@lru_cache(maxsize=32)
+def tabla_color(brillo=0, contraste=0, saturacion=1.0, tinte=None, filtro=None):
+    """
+    Compila toda la etapa de color a una tabla uint8 (3, n) construida una sola vez:
+    filtro (b&n / sepia / invertir) -> colorx(saturacion) -> lum_contrast(brillo, contraste)
+    -> tinte, con los mismos redondeos que la cadena de moviepy. Con b&n o sepia la
+    tabla se indexa por la suma R+G+B (0-765) y si no, por el valor de cada canal.
+    Devuelve (tabla, por_suma).
+    """
+    por_suma = filtro in ('b&n', 'sepia')
+    if por_suma:
+        v = np.floor(np.arange(766, dtype=np.float64) / 3)[:, None].repeat(3, axis=1)
+    else:
+        v = np.arange(256, dtype=np.float64)[:, None].repeat(3, axis=1)
+        if filtro == 'invertir':
+            v = 255 - v
+    if filtro == 'sepia':
+        color, opacidad = TINTE_SEPIA
+        v = np.floor(v * (1 - opacidad) + np.array(color) * opacidad)
     if saturacion != 1.0:
-        clip_procesado = clip_procesado.fx(colorx, factor=saturacion)
+        v = np.floor(np.minimum(255, v * saturacion))
     if brillo != 0 or contraste != 0:
-        clip_procesado = clip_procesado.fx(lum_contrast, lum=brillo, contrast=contraste)
+        v = np.floor(np.clip(v + brillo + contraste * (v - 127), 0, 255))
+    if tinte:
+        color, opacidad = tinte
+        v = v * (1 - opacidad) + np.array(color, dtype=np.float64) * opacidad
+    tabla = np.ascontiguousarray(np.clip(np.floor(v), 0, 255).astype(np.uint8).T)
+    tabla.setflags(write=False)
+    return tabla, por_suma
+
+def aplicar_color(clip, brillo=0, contraste=0, saturacion=1.0, tinte=None, filtro=None):
+    """Toda la etapa de color en una única pasada uint8 por frame (una consulta a la tabla)."""
     if tinte:
-        color_tinte, opacidad_tinte = tinte
-        tinte_clip = ColorClip(size=clip.size, color=color_tinte, duration=clip.duration).set_opacity(opacidad_tinte)
-        clip_procesado = CompositeVideoClip([clip_procesado, tinte_clip])
-    return clip_procesado
+        color, opacidad = tinte
+        tinte = (tuple(int(c) for c in color), float(opacidad))
+    tabla, por_suma = tabla_color(float(brillo), float(contraste), float(saturacion), tinte, filtro)
+
+    def colorear(frame):
+        if frame.dtype != np.uint8:
+            frame = np.clip(frame, 0, 255).astype(np.uint8)
+        if por_suma:
+            suma = frame[..., 0].astype(np.uint16)
+            suma += frame[..., 1]
+            suma += frame[..., 2]
+            entradas = (suma, suma, suma)
+        else:
+            entradas = (frame[..., 0], frame[..., 1], frame[..., 2])
+        salida = np.empty(frame.shape[:2] + (3,), dtype=np.uint8)
+        for c in range(3):
+            salida[..., c] = np.take(tabla[c], entradas[c])
+        return salida
+
+    return clip.fl_image(colorear)
+
+def aplicar_correccion_color(clip, brillo=0, contraste=0, saturacion=1.0, tinte=None):
+    return aplicar_color(clip, brillo, contraste, saturacion, tinte)
 
 def aplicar_filtro(clip, tipo_filtro='b&n'):
-    if tipo_filtro == 'b&n':
-        return clip.fx(blackwhite)
-    elif tipo_filtro == 'sepia':
-        clip_bn = clip.fx(blackwhite)
-        tinte_sepia = ColorClip(size=clip.size, color=[112, 66, 20], duration=clip.duration).set_opacity(0.4)
-        return CompositeVideoClip([clip_bn, tinte_sepia])
-    elif tipo_filtro == 'invertir':
-        return clip.fx(invert_colors)
+    if tipo_filtro in ('b&n', 'sepia', 'invertir'):
+        return aplicar_color(clip, filtro=tipo_filtro)
     return clip
 
+@lru_cache(maxsize=8)
+def mascara_viñeta(w, h, radio=0.7, suavizado=0.4):
+    """Máscara float32 (h, w) de la viñeta: 0 en el centro, 1 en los bordes. Cacheada por tamaño y parámetros."""
+    y, x = np.ogrid[0:h, 0:w]
+    dist_centro = np.sqrt(((x - w / 2) / (w / 2))**2 + ((y - h / 2) / (h / 2))**2, dtype=np.float32)
+    mascara = np.clip((dist_centro - radio) / suavizado, 0, 1).astype(np.float32)
+    mascara.setflags(write=False)
+    return mascara
+
+@lru_cache(maxsize=8)
+def _pesos_viñeta(w, h, radio, suavizado, color):
+    """
+    Pesos en punto fijo (x256) para frame * factor + aporte: factor (h, w, 1) uint16 y
+    aporte (h, w, 3) uint16 con el color ya premultiplicado, o None si el color es negro.
+    """
+    mascara = mascara_viñeta(w, h, radio, suavizado)[..., None]
+    factor = np.round((1 - mascara) * 256).astype(np.uint16)
+    aporte = None
+    if any(color):
+        aporte = np.round(mascara * np.array(color, dtype=np.float32) * 256).astype(np.uint16)
+        aporte.setflags(write=False)
+    factor.setflags(write=False)
+    return factor, aporte
+
 def aplicar_viñeta(clip, radio=0.7, suavizado=0.4, color=(0, 0, 0)):
+    """Oscurece los bordes con una única multiplicación por frame, sin capas extra de composición."""
     w, h = clip.size
-    y, x = np.ogrid[0:h, 0:w]
-    dist_centro = np.sqrt(((x - w / 2) / (w / 2))**2 + ((y - h / 2) / (h / 2))**2)
-    mascara = np.clip((dist_centro - radio) / suavizado, 0, 1)
-    viñeta_overlay = ColorClip(size=(w, h), color=color, duration=clip.duration)
-    viñeta_con_mascara = viñeta_overlay.set_mask(ImageClip(mascara * 255, ismask=True))
-    return CompositeVideoClip([clip, viñeta_con_mascara])
+    factor, aporte = _pesos_viñeta(w, h, float(radio), float(suavizado), tuple(int(c) for c in color))
+    acumulador = np.empty((h, w, 3), dtype=np.uint16)  # reutilizado en cada frame de este clip
+
+    def viñetear(frame):
+        if frame.dtype != np.uint8:
+            frame = np.clip(frame, 0, 255).astype(np.uint8)
+        np.multiply(frame, factor, out=acumulador)
+        if aporte is not None:
+            np.add(acumulador, aporte, out=acumulador)
+        np.right_shift(acumulador, 8, out=acumulador)
+        return acumulador.astype(np.uint8)
+
+    return clip.fl_image(viñetear)
 
 def aplicar_cambio_velocidad(clip, factor=1.0):
     return clip.fx(speedx, factor=factor)
 
-def generar_overlay_grano(w, h, duracion, fps=30, intensidad=0.08):
-    num_frames = int(duracion * fps)
-    fuerza_ruido = int(255 * intensidad)
-    frames = []
-    for _ in range(num_frames):
-        ruido = np.random.normal(loc=128, scale=fuerza_ruido, size=(h, w))
-        ruido = np.clip(ruido, 0, 255).astype(np.uint8)
-        frame_grano = np.dstack([ruido, ruido, ruido])
-        frames.append(frame_grano)
-    return ImageSequenceClip(frames, fps=fps)
-
-def aplicar_overlay_textura(clip, tipo_textura='grano', intensidad=0.08, opacidad=0.15):
+@lru_cache(maxsize=4)
+def _pool_grano(intensidad, n_teselas=8, lado=256, semilla=1234):
+    """Pool pequeño y determinista de teselas de ruido uint8 (centrado en 128) de un solo canal."""
+    rng = np.random.default_rng(semilla)
+    ruido = rng.normal(loc=128, scale=int(255 * intensidad), size=(n_teselas, lado, lado))
+    pool = np.clip(ruido, 0, 255).astype(np.uint8)
+    pool.setflags(write=False)
+    return pool
+
+def _grano_frame(w, h, n_frame, intensidad, semilla=1234, out=None):
+    """Frame de grano (h, w) uint8 para el frame `n_frame`: una tesela del pool con desplazamiento aleatorio."""
+    pool = _pool_grano(intensidad, semilla=semilla)
+    n_teselas, lado, _ = pool.shape
+    rng = np.random.default_rng((semilla, n_frame))
+    indice, dx, dy = rng.integers(0, n_teselas), rng.integers(0, lado), rng.integers(0, lado)
+    filas = (np.arange(h) + dy) % lado
+    columnas = (np.arange(w) + dx) % lado
+    if out is None:
+        out = np.empty((h, w), dtype=np.uint8)
+    np.take(pool[indice][filas], columnas, axis=1, out=out)
+    return out
+
+def generar_overlay_grano(w, h, duracion, fps=30, intensidad=0.08, semilla=1234):
+    """Clip de grano generado bajo demanda frame a frame: memoria constante sea cual sea la duración."""
+    def make_frame(t):
+        ruido = _grano_frame(w, h, int(round(t * fps)), intensidad, semilla)
+        return np.dstack([ruido, ruido, ruido])
+    return VideoClip(make_frame, duration=duracion).set_fps(fps)
+
+def aplicar_overlay_textura(clip, tipo_textura='grano', intensidad=0.08, opacidad=0.15, semilla=1234):
     if tipo_textura == 'grano':
-        textura_overlay = generar_overlay_grano(w=clip.w, h=clip.h, duracion=clip.duration, fps=clip.fps, intensidad=intensidad)
-        return CompositeVideoClip([clip, textura_overlay.set_opacity(opacidad)])
+        w, h = clip.size
+        fps = clip.fps or 24
+        # Mezcla fusionada en punto fijo: frame * (1 - opacidad) + grano * opacidad
+        peso_clip = np.uint16(round((1 - opacidad) * 256))
+        peso_grano = np.uint16(round(opacidad * 256))
+        grano = np.empty((h, w), dtype=np.uint8)
+        grano_ponderado = np.empty((h, w, 1), dtype=np.uint16)
+        acumulador = np.empty((h, w, 3), dtype=np.uint16)
+
+        def mezclar(get_frame, t):
+            frame = get_frame(t)
+            _grano_frame(w, h, int(round(t * fps)), intensidad, semilla, out=grano)
+            np.multiply(grano[..., None], peso_grano, out=grano_ponderado)
+            np.multiply(frame, peso_clip, out=acumulador)
+            np.add(acumulador, grano_ponderado, out=acumulador)
+            np.right_shift(acumulador, 8, out=acumulador)
+            return acumulador.astype(np.uint8)
+
+        return clip.fl(mezclar)
     return clip
 
 def crear_efecto_ken_burns(clip, duracion, video_size=(1280, 720), zoom_dir='in', pan_dir='derecha', factor_zoom=1.5):
@@ -77,6 +188,10 @@ def crear_efecto_ken_burns(clip, duracion, video_size=(1280, 720), zoom_dir='in'
         alto_actual = interp(h_inicial, h_final, t)
         x_centro_actual = interp(x_centro_inicial, x_centro_final, t)
         y_centro_actual = interp(y_centro_inicial, y_centro_final, t)
-        frame_recortado = crop(get_frame(t), x_center=x_centro_actual, y_center=y_centro_actual, width=ancho_actual, height=alto_actual)
-        return resize(frame_recortado, newsize=video_size)
+        # La ventana de recorte se desplaza (no se encoge) para quedar dentro de la imagen
+        ancho_actual, alto_actual = int(round(ancho_actual)), int(round(alto_actual))
+        x1 = min(max(int(round(x_centro_actual - ancho_actual / 2)), 0), img_w - ancho_actual)
+        y1 = min(max(int(round(y_centro_actual - alto_actual / 2)), 0), img_h - alto_actual)
+        frame_recortado = get_frame(t)[y1:y1 + alto_actual, x1:x1 + ancho_actual]
+        return resizer(frame_recortado, video_size)
     return clip.set_duration(duracion).fl(transformar_frame)
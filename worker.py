@@ -0,0 +1,159 @@
+# worker.py
+# Pool de workers de render: procesos de larga vida que importan moviepy, numpy y los
+# clientes de Google una sola vez y ejecutan, de uno en uno, los trabajos que la API
+# (api.py) deja en la cola del JobStore y, en un hilo aparte, las precargas de medios de
+# los lotes. Las cachés por proceso (fuentes y rasters de texto, tablas de color, PCM de
+# SFX, filtros de ffmpeg...) siguen calientes entre trabajos.
+#   python worker.py
+# La cola es SQLite: la API y el pool deben compartir máquina y JOBS_DB_PATH.
+# Cada worker tiene su propio grupo de procesos: el supervisor le reenvía SIGTERM (a él y a
+# sus procesos de segmentos y ffmpeg) y, cuando un worker muere, libera el trabajo que tenía.
+
+import os
+import sys
+import time
+import signal
+import logging
+import threading
+import multiprocessing
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Procesos del pool; el límite global de renders simultáneos sigue siendo RENDER_MAX_CONCURRENTES
+WORKERS = int(os.getenv("RENDER_POOL_WORKERS", os.getenv("RENDER_MAX_CONCURRENTES", "2")))
+# Espera mínima entre reinicios de un mismo worker caído
+PAUSA_REINICIO = float(os.getenv("RENDER_POOL_PAUSA_REINICIO", "5"))
+# Segundos que tiene un worker para limpiar tras SIGTERM antes de matar su grupo
+ESPERA_PARADA = float(os.getenv("RENDER_POOL_ESPERA_PARADA", "30"))
+
+
+def calentar(app):
+    """Prepara lo que el primer trabajo pagaría al arrancar: fuente por defecto, filtros de ffmpeg y catálogo de SFX."""
+    import texto_raster
+    import ffmpeg_backend
+    inicio = time.perf_counter()
+    for paso, funcion in (("texto", lambda: texto_raster.rasterizar_texto("Aa", fontsize=48)),
+                          ("ffmpeg", ffmpeg_backend.filtros_disponibles),
+                          ("sfx", app.CATALOGO_SFX.obtener)):
+        try:
+            funcion()
+        except Exception as e:
+            logging.warning(f"WORKER {os.getpid()}: No se pudo precalentar '{paso}' ({e}).")
+    logging.info(f"WORKER {os.getpid()}: Listo en {time.perf_counter() - inicio:.2f}s.")
+
+
+def proceso_worker():
+    pid = os.getpid()
+
+    def detener(signum, frame):
+        if os.getpid() != pid:
+            # Procesos hijos (pool de segmentos): mueren sin más, el worker se encarga de limpiar
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+        # SystemExit no lo captura el `except Exception` del trabajo: solo corren sus `finally`
+        # (espacio de trabajo, subida) y el supervisor devuelve el trabajo a la cola
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, detener)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    os.setpgrp()
+    # Al importarlo se cargan moviepy y numpy y se crean los clientes de Google, una vez por proceso
+    import app
+    calentar(app)
+    # Las precargas de lotes corren en un hilo aparte: son E/S y no ocupan plaza de render
+    threading.Thread(target=app.PLANIFICADOR.atender_precargas, args=(app.precargar_lote,),
+                     name="precargas", daemon=True).start()
+    app.PLANIFICADOR.atender(app.ejecutar_trabajo)
+
+
+def señalar(proceso, signum):
+    """Envía `signum` al grupo del worker (o solo a él si aún no ha creado su grupo)."""
+    for enviar in (os.killpg, os.kill):
+        try:
+            enviar(proceso.pid, signum)
+            return
+        except ProcessLookupError:
+            continue
+
+
+def liberar(jobs, proceso, reencolar):
+    """Mata lo que quede del grupo del worker (ya terminado) y libera en el JobStore los trabajos que tenía."""
+    try:
+        os.killpg(proceso.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    for job_id in jobs.liberar_trabajos_de(proceso.pid, reencolar):
+        if reencolar:
+            logging.info(f"[{job_id}] WORKER: Trabajo devuelto a la cola al detener el worker {proceso.pid}.")
+        else:
+            logging.error(f"[{job_id}] WORKER: Trabajo marcado como error: su worker {proceso.pid} murió.")
+
+
+def recuperar_huerfanos(jobs):
+    """
+    Al arrancar, devuelve a la cola los trabajos de workers que ya no existen (el pool se
+    cortó sin poder liberarlos, p.ej. un reinicio de la máquina o un SIGKILL al supervisor).
+    """
+    from espacio_trabajo import proceso_vivo
+    for pid in jobs.workers_con_trabajos():
+        if proceso_vivo(pid):
+            continue
+        for job_id in jobs.liberar_trabajos_de(pid, reencolar=True):
+            logging.warning(f"[{job_id}] WORKER: Trabajo huérfano del worker {pid} devuelto a la cola.")
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s'
+    )
+    # 'spawn': cada worker importa por su cuenta (los clientes gRPC no sobreviven a un fork).
+    # No son daemon: los trabajos abren a su vez pools de procesos para los segmentos.
+    contexto = multiprocessing.get_context("spawn")
+    from jobs_store import JobStore
+    jobs = JobStore(os.getenv("JOBS_DB_PATH", "/tmp/render_jobs.sqlite3"))
+    recuperar_huerfanos(jobs)
+    procesos = {}
+    ultimo_arranque = {}
+    parar = []
+
+    def terminar(signum, frame):
+        parar.append(signum)
+
+    signal.signal(signal.SIGTERM, terminar)
+    signal.signal(signal.SIGINT, terminar)
+
+    logging.info(f"WORKER: Arrancando pool de {WORKERS} workers de render.")
+    while not parar:
+        for n in range(WORKERS):
+            proceso = procesos.get(n)
+            if proceso is not None and proceso.is_alive():
+                continue
+            if proceso is not None:
+                logging.error(f"WORKER: El worker {n} (pid {proceso.pid}) terminó con código {proceso.exitcode}. Se reinicia.")
+                liberar(jobs, proceso, reencolar=False)
+                del procesos[n]
+            if n in ultimo_arranque and time.monotonic() - ultimo_arranque[n] < PAUSA_REINICIO:
+                continue
+            procesos[n] = contexto.Process(target=proceso_worker, name=f"render-worker-{n}")
+            procesos[n].start()
+            ultimo_arranque[n] = time.monotonic()
+        time.sleep(1)
+
+    logging.info("WORKER: Deteniendo el pool.")
+    for proceso in procesos.values():
+        señalar(proceso, signal.SIGTERM)
+    limite = time.monotonic() + ESPERA_PARADA
+    for proceso in procesos.values():
+        proceso.join(timeout=max(0, limite - time.monotonic()))
+        if proceso.is_alive():
+            logging.warning(f"WORKER: El worker {proceso.pid} no terminó a tiempo; se mata su grupo.")
+        liberar(jobs, proceso, reencolar=True)
+        proceso.join()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())